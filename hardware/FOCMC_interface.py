@@ -7,13 +7,12 @@ Adin Ackerman
 
 from threading import Lock, Condition
 from itertools import chain
+from collections import deque
 from serial import Serial
 from serial.serialutil import SerialException
 from datetime import datetime
 from typing import Literal, Any, Optional
 
-from lib.utils import threaded_callback
-
 
 class MotorException(Exception):
     pass
@@ -35,12 +34,17 @@ class Motor:
         The offset angle of the motor
     lock: Lock
         Thread lock for serial calls
+    log: deque[tuple[str, str, str]]
+        The most recent (time, command, response) exchanges
+    log_count: int
+        The total number of exchanges logged
     """
     device_name: str = 'Adafruit Feather M0'
     m_id: int = -1
     offset: float = 0
     control_mode: Literal['torque', 'velocity', 'angle'] = 'torque'
-    log: list[tuple[str, str, str]]
+    log: deque[tuple[str, str, str]]
+    log_count: int = 0
     LOG_SIZE: int = 100
     log_informer: Condition = Condition()
 
@@ -58,19 +62,37 @@ class Motor:
         self.port = port
         self.ser = Serial(baudrate=9600, timeout=1)
         self.lock = Lock()
-        self.log = []
+        self.log_lock = Lock()
+        self.log = deque(maxlen=self.LOG_SIZE)
 
         self.connect()
 
-    @threaded_callback
     def _log_entry(self, command: str, response: str) -> None:
-        if len(self.log) > self.LOG_SIZE:
-            self.log.pop(0)
-        
-        self.log.append((datetime.now().strftime('%H:%M:%S'), command, response))
+        with self.log_lock:
+            self.log.append((datetime.now().strftime('%H:%M:%S'), command, response))
+            self.log_count += 1
+
         with self.log_informer:
             self.log_informer.notify()
 
+    def log_since(self, count: int) -> tuple[list[tuple[str, str, str]], int]:
+        """
+        Get the log entries added after a given point
+
+        Parameters
+        ----------
+        count: int
+            A log_count previously returned by this method, 0 for the whole log
+
+        Returns
+        -------
+        tuple[list[tuple[str, str, str]], int]
+            The new entries still held in the log, and the current log_count
+        """
+        with self.log_lock:
+            new = min(self.log_count - count, len(self.log))
+            return list(self.log)[len(self.log) - new:], self.log_count
+
     def _send_command(self, cmd: str, return_type: Optional[type] = None) -> Any:
         """
         Send a command to the motor
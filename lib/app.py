@@ -1,18 +1,34 @@
-from threading import Thread
-from abc import ABCMeta
+from threading import Event, Thread
+from io import StringIO
 
+from lib.calibration import take_warm_start
 from lib.system import System, JogError
-from lib.gcode import read_gcode_line
+from lib.job import Job, JobQueue
+from lib.motion import MotionThread
+from lib.telemetry import Telemetry
+from lib.optimizer import optimize_job
+from lib.plugins import PluginSpec, discover, load, report
+from lib.profiler import startup
+from lib.shared_state import SharedStateServer
+from lib.workspace import WorkspaceMap
 
 import tkinter as tk
 from tkinter import messagebox
 from tkinter import filedialog as fd
 import tkinter.ttk as ttk
 
-from typing import Optional
+from typing import Callable, Optional
 
 class Application(ttk.Frame):
     system: System
+    # The job being run, None between jobs.
+    current_job: Optional[Job] = None
+    # The number of waypoints of the current job completed.
+    job_progress: int = 0
+    # Publishes state to local processes while sharing is on.
+    shared_state: Optional[SharedStateServer] = None
+    # Set once the hardware is connected and homed.
+    ready: Event
 
     def __init__(self, master: tk.Tk):
         super().__init__(master)
@@ -23,6 +39,7 @@ class Application(ttk.Frame):
         self.move_duration_var.set(2)
         self.motors_enabled_var = tk.BooleanVar()
         self.motors_enabled_var.set(True)
+        self.share_state_var = tk.BooleanVar()
 
         # self.init_popup = tk.Toplevel(self)
         # self.init_popup.geometry('500x100')
@@ -33,50 +50,101 @@ class Application(ttk.Frame):
         #     self.init_popup, mode='indeterminate', value=1)
         # progress_bar.pack(fill='x', expand=1, side='bottom', padx=10, pady=10)
 
-        self.system = System()
+        # Bring up the hardware while the GUI is built, the GUI waits for it
+        # only where it has to.
+        self.ready = Event()
+        # Set once the calibration is read and the calibration wizard exists, homing needs both.
+        self._prepared = Event()
+        Thread(target=self.init_system, daemon=True).start()
 
-        # Initialize first-party widgets
-        from widgets.builtin.calibration_wizard import CalibrationWizard
-        from widgets.builtin.configure_motors import ConfigureMotors
-        from widgets.builtin.visual import Visual
-        try:
-            from widgets.builtin.hand_tracking import HandTracking
-            self.hand_tracking = HandTracking(self)
-        except:
-            messagebox.showwarning(__name__, 'Failed to initialize hand tracking widget.')
+        with startup.phase('calibration'):
+            try:
+                self._calibration = System.read_calibration()
+            except (OSError, ValueError) as e:
+                print(f'[WARNING] [{__name__}] Calibration could not be read, the wizard will run: {e}')
+                self._calibration = None
+
+            self._warm_start = take_warm_start()
+
+        with startup.phase('widgets'):
+            # Initialize first-party widgets
+            from widgets.builtin.calibration_wizard import CalibrationWizard
+            from widgets.builtin.configure_motors import ConfigureMotors
+            from widgets.builtin.visual import Visual
+            from widgets.builtin.job_queue import JobQueueManager
+            from widgets.builtin.scope import Scope
+
+            self.calibration_wizard = CalibrationWizard(self)
+            self.configureation_panel = ConfigureMotors(self)
+            self.visual = Visual(self)
+            self.job_queue_manager = JobQueueManager(self)
+            self.scope = Scope(self)
+
+            # Hand tracking pulls in OpenCV and MediaPipe, it is imported when first opened
+            self.hand_tracking = PluginSpec(
+                'widgets.builtin.hand_tracking', 'HandTracking', 'Hand Tracking', 'Teleoperation from a camera.', 0
+            )
 
-        self.calibration_wizard = CalibrationWizard(self)
-        self.configureation_panel = ConfigureMotors(self)
-        self.visual = Visual(self)
-        self.third_party = []
+            # Discover third-party widgets, they are imported when first opened
+            self.third_party = discover('widgets/third_party', 'widgets.third_party')
+            print(f'[INFO] [{__name__}] Third-party widgets:\n{report(self.third_party)}')
 
-        # Initialize Up Robot Arm
-        Thread(target=self.init_system, daemon=True).start()
+        self._prepared.set()
+
+        with startup.phase('interface'):
+            self.create_widgets()
+
+    def open_plugin(self, spec: PluginSpec):
+        try:
+            widget = load(spec, self)
+        except Exception as e:
+            messagebox.showerror(__name__, f'Failed to load {spec.label}: {e}')
+            return
+
+        widget.show()
 
-        from lib.widget import Widget
-        import os
-
-        # Initialize third-party widgets
-        
-        files = os.listdir('widgets/third_party')
-
-        for name in files:
-            name = name.strip().split('.')[0]
-            exec(f'from widgets.third_party import {name}')
-            module = eval(f'{name}')
-            attrs = dir(module)
-
-            cls_names = [c for c in attrs if type((attr := getattr(module, c))) == ABCMeta and issubclass(attr, Widget) and attr != Widget]
-            for cls_name in cls_names:
-                _cls = eval(f'module.{cls_name}')
-                exec(f'self.{cls_name} = _cls(self)')
-                self.third_party.append(_cls)
-        
     def init_system(self):
-        self.system.load_motors(self.calibration_wizard.show)
+        """
+        Connect to and home the hardware, then enable the GUI.
+
+        This function is intended to be launched in a thread.
+        """
+        with startup.phase('hardware'):
+            try:
+                system = System()
+            except (KeyError, AttributeError):
+                # System has already told the user what is missing.
+                self.after(0, self.root.destroy)
+                return
+
+            self.system = system
+            self.workspace = WorkspaceMap(self.system)
+            self.job_queue = JobQueue(self.system, self.workspace, self.current_pose)
+            self.motion = MotionThread(self.system)
+            self.telemetry = Telemetry(self.system)
+
+        self._prepared.wait()
+
+        with startup.phase('homing'):
+            self.system.load_motors(self.calibration_wizard.show, self._calibration, self._warm_start)
+
         # self.init_popup.destroy()
-        self.create_widgets()
-        self.init_gamepad()
+        self.after(0, self._system_ready)
+
+        with startup.phase('gamepad'):
+            self.init_gamepad()
+
+    def _system_ready(self):
+        low, high = self.system.end_effector.value_range
+        self.target_e_var.set((low + high) // 2)
+        self.target_e_slider.configure(from_=low, to=high)
+
+        for widget in self.hardware_controls:
+            widget['state'] = 'normal'
+        self.root.config(menu=self.menubar)
+
+        self.ready.set()
+        startup.ready()
 
     def init_gamepad(self):
         # Initialize gamepad
@@ -101,19 +169,38 @@ class Application(ttk.Frame):
         file_menu.add_command(
             label='Load Job', command=lambda: Thread(target=self.load_job).start()
         )
-        file_menu.add_command(label='Save Job')
+        file_menu.add_command(
+            label='Save Job', command=lambda: Thread(target=self.save_job, daemon=True).start()
+        )
+        file_menu.add_command(label='Job Queue...', command=self.job_queue_manager.show)
+        file_menu.add_command(
+            label='Optimize Job...', command=lambda: Thread(target=self.optimize_job, daemon=True).start()
+        )
         tools_menu.add_command(label='Record Job')
         tools_menu.add_cascade(label='Motors', menu=motor_menu)
         tools_menu.add_command(
             label='Calibration Wizard', command=self.calibration_wizard.show
         )
         tools_menu.add_command(label='Visual', command=self.visual.show)
+        tools_menu.add_command(label='Scope', command=self.scope.show)
+        tools_menu.add_command(
+            label='Export Workspace Map...', command=self.export_workspace_map
+        )
         tools_menu.add_command(label='Hand Tracking',
-                               command=self.hand_tracking.show)
+                               command=lambda: self.open_plugin(self.hand_tracking))
         tools_menu.add_cascade(label='Third-party', menu=third_party_menu)
+        tools_menu.add_checkbutton(
+            label='Share State',
+            variable=self.share_state_var,
+            command=lambda: self.share_state(self.share_state_var.get()),
+        )
 
-        for i, _cls in enumerate(self.third_party):
-            third_party_menu.add_command(label=_cls.__name__, command=eval(f'self.{_cls.__name__}.show'))
+        for spec in self.third_party:
+            third_party_menu.add_command(label=spec.label, command=lambda spec=spec: self.open_plugin(spec))
+        third_party_menu.add_separator()
+        third_party_menu.add_command(
+            label='Report...', command=lambda: messagebox.showinfo('Third-party', report(self.third_party))
+        )
 
         motor_menu.add_checkbutton(
             label='Enable',
@@ -123,7 +210,8 @@ class Application(ttk.Frame):
         motor_menu.add_command(
             label='Configure...', command=self.configureation_panel.show
         )
-        self.root.config(menu=menubar)
+        # Shown once the system is ready, every menu entry needs the hardware.
+        self.menubar = menubar
 
         # Inside of Self
         r = 0
@@ -266,8 +354,9 @@ class Application(ttk.Frame):
 
         r += 2
 
+        # The range is set from the end effector once the system is ready.
         self.target_e_var = tk.IntVar()
-        self.target_e_var.set(sum(self.system.end_effector.value_range) // 2)
+        self.target_e_var.set(50)
         self.target_e_label = ttk.Label(slider_frame, text='Target E:')
         self.target_e_label.grid(row=r, padx=5)
 
@@ -283,8 +372,8 @@ class Application(ttk.Frame):
             slider_frame,
             variable=self.target_e_var,
             command=lambda e: self.update_targets(e=round(float(e))),
-            from_=self.system.end_effector.value_range[0],
-            to=self.system.end_effector.value_range[1],
+            from_=0,
+            to=100,
             orient='horizontal',
         )
         self.target_e_slider.grid(row=r, column=2, padx=5, sticky="WE")
@@ -313,6 +402,22 @@ class Application(ttk.Frame):
 
         r += 1
 
+        # Teleoperation commands joint velocities instead of positions.
+        self.velocity_teleop_var = tk.BooleanVar()
+        self.velocity_teleop_toggle = ttk.Checkbutton(
+            slider_frame, variable=self.velocity_teleop_var, text='Velocity Teleop'
+        )
+        self.velocity_teleop_toggle.grid(row=r, column=1, sticky='W', padx=5, pady=5)
+
+        r += 1
+
+        # Disabled until the system is ready.
+        self.hardware_controls = (
+            self.hand_pos_toggle, self.realtime_toggle, self.velocity_teleop_toggle, self.jog_button
+        )
+        for widget in self.hardware_controls:
+            widget['state'] = 'disabled'
+
     def hand_positioning(self):
         """
         Release motors to allow for hand movement.
@@ -339,6 +444,19 @@ class Application(ttk.Frame):
         self.motors_enabled(True)
         self.jog()
 
+    def current_pose(self) -> dict[str, float]:
+        """
+        The current targets, keyed by G-code axis.
+        """
+        return {
+            'X': self.target_x_var.get(),
+            'Y': self.target_y_var.get(),
+            'Z': self.target_z_var.get(),
+            'R': self.target_r_var.get(),
+            'E': self.target_e_var.get(),
+            'D': self.move_duration_var.get(),
+        }
+
     def load_job(self):
         file_name = fd.askopenfilename(
             title='Select Job File',
@@ -348,57 +466,180 @@ class Application(ttk.Frame):
         if not file_name:
             return
 
+        job = Job(file_name)
+
+        try:
+            job.prepare(self.system, self.workspace, self.current_pose(), self.system.joint_target)
+        except (OSError, ValueError) as e:
+            messagebox.showerror(__name__, f'Failed to load job.\n{e}')
+            return
+
+        if job.slow:
+            msg = f'{len(job.slow)} waypoint(s) lie in slow or unreachable regions of the workspace ' \
+                + f'(lines {", ".join(map(str, job.slow[:10]))}{", ..." if len(job.slow) > 10 else ""}).\n' \
+                + 'Run the job anyway?'
+            if not messagebox.askyesno(__name__, msg):
+                return
+
         self.job_popup = tk.Toplevel(self)
         self.job_popup.geometry('500x100')
         self.job_popup.protocol('WM_DELETE_WINDOW', lambda: None)
         ttk.Label(self.job_popup, text='Running Job').pack(side='top')
-        progress = 0
         progress_var = tk.IntVar()
-        self.job_abort = False
-
-        self.realtime_var.set(False)
 
         def terminator(self):
             self.job_abort = True
 
-        with open(file_name, 'r') as f:
-            lines = f.readlines()
+        abort_btn = ttk.Button(self.job_popup, text='Abort', command=lambda: terminator(self))
+        abort_btn.pack(side='bottom', padx=10, pady=10)
 
-            abort_btn = ttk.Button(self.job_popup, text='Abort', command=lambda: terminator(self))
-            abort_btn.pack(side='bottom', padx=10, pady=10)
+        progress_bar = ttk.Progressbar(
+            self.job_popup, variable=progress_var, length=500, maximum=len(job.poses)
+        )
+        progress_bar.pack(fill='x', expand=1,
+                          side='bottom', padx=10, pady=10)
 
-            progress_bar = ttk.Progressbar(
-                self.job_popup, variable=progress_var, length=500, maximum=len(lines)
-            )
-            progress_bar.pack(fill='x', expand=1,
-                              side='bottom', padx=10, pady=10)
-
-            for line in lines:
-                if self.job_abort: break
-
-                for argument, value in read_gcode_line(line):
-                    if argument == 'X':
-                        self.target_x_var.set(value)
-                    elif argument == 'Y':
-                        self.target_y_var.set(value)
-                    elif argument == 'Z':
-                        self.target_z_var.set(value)
-                    elif argument == 'R':
-                        self.target_r_var.set(value)
-                    elif argument == 'E':
-                        self.target_e_var.set(int(value))
-                    elif argument == 'D':
-                        self.move_duration_var.set(value)
-                try:
-                    self.jog()
-                except JogError:
-                    self.job_popup.destroy()
-                    return
-                progress += 1
-                progress_var.set(progress)
+        self.run_job(job, progress_var.set)
 
         self.job_popup.destroy()
 
+    def run_job(self, job: Job, progress: Optional[Callable[[int], None]] = None) -> bool:
+        """
+        Execute a prepared job.
+
+        This function is intended to be launched in a thread.
+
+        Parameters
+        ----------
+        job: Job
+            The job to execute.
+        progress: Optional[Callable[[int], None]]
+            Called with the number of completed waypoints.
+
+        Returns
+        -------
+        bool
+            Whether the job ran to completion.
+        """
+        timeout = 5
+        epsilon = 0.1
+
+        self.job_abort = False
+        self.realtime_var.set(False)
+        self.current_job = job
+        self.job_progress = 0
+
+        try:
+            for i, (pose, (t1, t2)) in enumerate(zip(job.poses, job.joints), 1):
+                if self.job_abort:
+                    return False
+
+                self.target_x_var.set(pose['X'])
+                self.target_y_var.set(pose['Y'])
+                self.target_z_var.set(pose['Z'])
+                self.target_r_var.set(pose['R'])
+                self.target_e_var.set(int(pose['E']))
+                self.move_duration_var.set(pose['D'])
+
+                try:
+                    self.system.smooth_move(
+                        pose['D'],
+                        timeout=timeout,
+                        epsilon=epsilon,
+                        t1=t1,
+                        t2=t2,
+                        z=pose['Z'],
+                        r=pose['R'],
+                        e=int(pose['E']),
+                    )
+                except JogError as e:
+                    job.error = str(e)
+                    return False
+
+                self.job_progress = i
+                if progress is not None:
+                    progress(i)
+
+            return True
+        finally:
+            # Nothing is drawn or published for a job which is no longer running.
+            self.current_job = None
+
+    def save_job(self):
+        """
+        Save every prepared job in the queue as a single job file.
+
+        This function is intended to be launched in a thread.
+        """
+        jobs = [job for job in self.job_queue.jobs if job.poses]
+
+        if not jobs:
+            messagebox.showinfo(__name__, 'There are no prepared jobs in the queue to save.')
+            return
+
+        file_name = fd.asksaveasfilename(
+            title='Save Job',
+            defaultextension='.gcode',
+            filetypes=[('GCode', '*.gcode')],
+        )
+
+        if not file_name:
+            return
+
+        with open(file_name, 'w') as f:
+            for job in jobs:
+                job.write(f)
+
+    def export_workspace_map(self):
+        file_name = fd.asksaveasfilename(
+            title='Export Workspace Map',
+            defaultextension='.ppm',
+            filetypes=[('Portable Pixmap', '*.ppm')],
+        )
+
+        if file_name:
+            self.workspace.save_image(file_name)
+
+    def optimize_job(self):
+        """
+        Reorder the unordered blocks of a job file for minimal travel time
+        and save the result to a new file.
+
+        This function is intended to be launched in a thread.
+        """
+        source_name = fd.askopenfilename(
+            title='Select Job File',
+            filetypes=[('GCode', '*.gcode')],
+        )
+
+        if not source_name:
+            return
+
+        optimized = StringIO()
+
+        try:
+            with open(source_name, 'r') as f:
+                before, after = optimize_job(self.system, f, optimized, self.current_pose())
+        except (ValueError, AssertionError) as e:
+            messagebox.showerror(__name__, f'Failed to optimize job.\n{e}')
+            return
+
+        destination_name = fd.asksaveasfilename(
+            title='Save Optimized Job',
+            defaultextension='.gcode',
+            filetypes=[('GCode', '*.gcode')],
+        )
+
+        if not destination_name:
+            return
+
+        with open(destination_name, 'w') as f:
+            f.write(optimized.getvalue())
+
+        msg = f'Estimated run time: {before:.1f} s -> {after:.1f} s\n' \
+            + f'Estimated saving: {before - after:.1f} s per cycle'
+        messagebox.showinfo(__name__, msg)
+
     def update_targets(
         self,
         x: Optional[float] = None,
@@ -406,7 +647,13 @@ class Application(ttk.Frame):
         z: Optional[float] = None,
         r: Optional[float] = None,
         e: Optional[int] = None,
+        move: bool = True,
     ):
+        """
+        Set the targets shown in the GUI, None leaves a target unchanged.
+
+        With move set and realtime mode on, the arm also moves to the targets.
+        """
         digits = 3
 
         if x is not None:
@@ -420,43 +667,93 @@ class Application(ttk.Frame):
         if e is not None:
             self.target_e_var.set(e)
 
-        if self.realtime_var.get():
+        if move and self.realtime_var.get():
             self.jog()
 
     def jog(self):
+        """
+        Move to the current targets.
+
+        In realtime mode the targets are handed to the motion thread and
+        this returns immediately, otherwise a smooth move is performed.
+        """
         timeout = 5
         epsilon = 0.1
 
+        if not self.ready.is_set():
+            return
+
+        if self.realtime_var.get():
+            self.motion.post(
+                self.target_x_var.get(),
+                self.target_y_var.get(),
+                self.target_z_var.get(),
+                self.target_r_var.get(),
+                self.target_e_var.get(),
+            )
+            return
+
         self.jog_button['state'] = 'disabled'
 
         t1, t2 = self.system.cartesian_to_dual_polar(
-            self.target_x_var.get(), self.target_y_var.get()
+            self.target_x_var.get(), self.target_y_var.get(), self.system.joint_target
         )
         z = self.target_z_var.get()
         r = self.target_r_var.get()
         e = self.target_e_var.get()
 
-        if self.realtime_var.get():
-            self.system.jog(t1=t1, t2=t2, z=z, r=r, e=e)
-        else:
-            self.system.smooth_move(
-                self.move_duration_var.get(),
-                timeout=timeout,
-                epsilon=epsilon,
-                t1=t1,
-                t2=t2,
-                z=z,
-                r=r,
-                e=e,
-            )
+        self.system.smooth_move(
+            self.move_duration_var.get(),
+            timeout=timeout,
+            epsilon=epsilon,
+            t1=t1,
+            t2=t2,
+            z=z,
+            r=r,
+            e=e,
+        )
 
         self.jog_button['state'] = 'normal'
 
     def motors_enabled(self, value: bool):
+        # The emergency stop must also work while homing.
+        if not hasattr(self, 'system'):
+            return
+
         self.system.motors_enabled(value)
         self.motors_enabled_var.set(value)
 
+    def job_state(self) -> tuple[str, int, int]:
+        """
+        The status, progress and number of waypoints of the current job.
+        """
+        job = self.current_job
+        if job is None:
+            return 'none', 0, 0
+
+        return job.status, self.job_progress, len(job.poses)
+
+    def share_state(self, value: bool):
+        """
+        Start or stop publishing state to, and taking setpoints from, local processes.
+        """
+        if value and self.shared_state is None:
+            try:
+                self.shared_state = SharedStateServer(self.system, self.telemetry, self.motion, self.job_state)
+            except FileExistsError:
+                messagebox.showerror(__name__, 'Shared state is already published by another process.')
+                self.share_state_var.set(False)
+        elif not value and self.shared_state is not None:
+            self.shared_state.stop()
+            self.shared_state = None
+
     def on_close(self):
-        self.motors_enabled(False)
-        self.system.end_effector.disable()
+        self.share_state(False)
+        if hasattr(self, 'system'):
+            self.motors_enabled(False)
+            self.system.end_effector.disable()
+
+            # Only a fully homed system has offsets worth keeping.
+            if self.ready.is_set():
+                self.system.save_warm_start()
         self.root.destroy()
@@ -0,0 +1,365 @@
+"""
+Motor calibration, stored in a single versioned JSON file keyed by motor ID.
+
+The file is read in one go and fully validated before anything uses it,
+and is replaced atomically on every save, so an interrupted write never
+leaves a half-written calibration behind.
+
+The offsets found by homing are saved separately on a clean shutdown, so
+the next start can skip homing axes which have not moved since.
+"""
+
+import json
+import math
+import os
+import os.path
+import tempfile
+from time import time
+from typing import Mapping, NamedTuple, Optional
+
+PATH = 'config/calibration.json'
+WARM_START_PATH = 'config/warm_start.json'
+VERSION = 1
+# The per-joint files used before, each holding the low, high and center positions.
+LEGACY_FILES: dict[int, str] = {
+    2: 'config/inner_rot',
+    3: 'config/outer_rot',
+    4: 'config/end_rot',
+}
+
+
+class CalibrationError(ValueError):
+    ...
+
+
+class MotorCalibration(NamedTuple):
+    """
+    The calibration of one motor with a limited range of motion.
+
+    Attributes
+    ----------
+    low: float
+        The lowest position, in the motor frame.
+    high: float
+        The highest position, in the motor frame.
+    center: float
+        The zero position of the joint, in the motor frame.
+    offset: Optional[float]
+        The last offset applied to the motor, which can differ from the
+        center by a full turn.
+    pids: Optional[Mapping[str, Mapping[str, float]]]
+        The gains of each PID stage, as keywords of Motor.set_PIDs,
+        None to keep the defaults.
+    timestamp: float
+        When the calibration was made.
+    """
+    low: float
+    high: float
+    center: float
+    offset: Optional[float] = None
+    pids: Optional[Mapping[str, Mapping[str, float]]] = None
+    timestamp: float = 0
+
+
+class AxisState(NamedTuple):
+    """
+    The homing result of an axis at shutdown.
+
+    Attributes
+    ----------
+    offset: float
+        The offset found by homing.
+    raw: float
+        The raw encoder position, without the offset.
+    """
+    offset: float
+    raw: float
+
+
+def _atomic_write(path: str, data) -> None:
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+
+    with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.tmp', delete=False) as f:
+        try:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        except BaseException:
+            os.remove(f.name)
+            raise
+
+    os.replace(f.name, path)
+
+
+def _number(value, what: str) -> float:
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise CalibrationError(f'{what} must be a finite number, got {value!r}.')
+
+    return float(value)
+
+
+def _parse_motor(m_id: int, data) -> MotorCalibration:
+    if not isinstance(data, dict):
+        raise CalibrationError(f'Motor {m_id} calibration must be an object.')
+
+    try:
+        low, high, center = (_number(data[key], f'Motor {m_id} {key}') for key in ('low', 'high', 'center'))
+    except KeyError as e:
+        raise CalibrationError(f'Motor {m_id} calibration is missing {e}.') from e
+
+    if not low <= center <= high:
+        raise CalibrationError(f'Motor {m_id} center {center} is not within [{low}, {high}].')
+
+    offset = data.get('offset')
+    if offset is not None:
+        offset = _number(offset, f'Motor {m_id} offset')
+
+    pids = data.get('pids')
+    if pids is not None:
+        if not isinstance(pids, dict) or not set(pids) <= {'vel', 'angle'} \
+                or not all(isinstance(gains, dict) for gains in pids.values()):
+            raise CalibrationError(f'Motor {m_id} PIDs must map vel and angle to gains.')
+
+        pids = {
+            stage: {name: _number(gain, f'Motor {m_id} {stage} {name}') for name, gain in gains.items()}
+            for stage, gains in pids.items()
+        }
+
+    return MotorCalibration(low, high, center, offset, pids, _number(data.get('timestamp', 0), 'Timestamp'))
+
+
+class CalibrationStore:
+    """
+    The calibration of every motor.
+
+    Attributes
+    ----------
+    path: str
+        The file the calibration is saved to.
+    motors: dict[int, MotorCalibration]
+        The calibration of each motor, by motor ID.
+    """
+    path: str
+    motors: dict[int, MotorCalibration]
+
+    def __init__(self, path: str = PATH, motors: Optional[dict[int, MotorCalibration]] = None):
+        self.path = path
+        self.motors = dict(motors or {})
+
+    def __getitem__(self, m_id: int) -> MotorCalibration:
+        return self.motors[m_id]
+
+    def __contains__(self, m_id: int) -> bool:
+        return m_id in self.motors
+
+    @classmethod
+    def load(cls, path: str = PATH) -> 'CalibrationStore':
+        """
+        Read and validate the calibration.
+
+        Without a calibration file, the legacy per-joint files are
+        migrated into one.
+
+        Parameters
+        ----------
+        path: str
+            The calibration file.
+
+        Returns
+        -------
+        CalibrationStore
+            The validated calibration.
+
+        Raises
+        ------
+        OSError
+            If the file could not be read.
+        CalibrationError
+            If the file is corrupted or of another version.
+        """
+        if not os.path.exists(path) and all(map(os.path.exists, LEGACY_FILES.values())):
+            return cls.migrate(path)
+
+        with open(path, 'r') as f:
+            text = f.read()
+
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise CalibrationError(f'{path} is not valid JSON: {e}') from e
+
+        if not isinstance(data, dict) or data.get('version') != VERSION:
+            raise CalibrationError(f'{path} is not a version {VERSION} calibration.')
+
+        motors = data.get('motors')
+        if not isinstance(motors, dict):
+            raise CalibrationError(f'{path} has no motors.')
+
+        calibration = {}
+        for key, motor in motors.items():
+            try:
+                m_id = int(key)
+            except ValueError as e:
+                raise CalibrationError(f'{key!r} is not a motor ID.') from e
+
+            calibration[m_id] = _parse_motor(m_id, motor)
+
+        return cls(path, calibration)
+
+    @classmethod
+    def migrate(cls, path: str = PATH) -> 'CalibrationStore':
+        """
+        Convert the legacy per-joint files and save them as one calibration file.
+
+        The legacy files are left in place.
+
+        Raises
+        ------
+        OSError
+            If a file could not be read or the calibration could not be saved.
+        CalibrationError
+            If a file is corrupted.
+        """
+        store = cls(path)
+
+        for m_id, file_name in LEGACY_FILES.items():
+            with open(file_name, 'r') as f:
+                try:
+                    low, high, center = (float(f.readline().strip()) for _ in range(3))
+                except ValueError as e:
+                    raise CalibrationError(f'{file_name} is corrupted: {e}') from e
+
+            # The wizard used to store the end rotation's extremes in the order they were set.
+            low, high = sorted((low, high))
+            store.motors[m_id] = _parse_motor(
+                m_id, {'low': low, 'high': high, 'center': center, 'timestamp': os.path.getmtime(file_name)}
+            )
+
+        store.save()
+        print(f'[INFO] [{__name__}] Migrated {", ".join(LEGACY_FILES.values())} to {path}.')
+
+        return store
+
+    def set(self, m_id: int, low: float, high: float, center: float, **fields) -> MotorCalibration:
+        """
+        Replace the calibration of a motor, keeping its PIDs unless given, and save.
+
+        Parameters
+        ----------
+        m_id: int
+            The motor ID.
+        low: float
+            The lowest position, in the motor frame.
+        high: float
+            The highest position, in the motor frame.
+        center: float
+            The zero position of the joint, in the motor frame.
+        **fields
+            Other MotorCalibration fields.
+
+        Returns
+        -------
+        MotorCalibration
+            The new calibration.
+
+        Raises
+        ------
+        CalibrationError
+            If the calibration is invalid.
+        OSError
+            If the calibration could not be saved.
+        """
+        previous = self.motors.get(m_id)
+        data = {
+            'low': low, 'high': high, 'center': center,
+            'pids': previous.pids if previous is not None else None,
+            'timestamp': time(),
+            **fields,
+        }
+
+        self.motors[m_id] = calibration = _parse_motor(m_id, data)
+        self.save()
+
+        return calibration
+
+    def to_dict(self) -> dict:
+        return {
+            'version': VERSION,
+            'motors': {str(m_id): motor._asdict() for m_id, motor in sorted(self.motors.items())},
+        }
+
+    def save(self) -> None:
+        """
+        Atomically replace the calibration file.
+
+        Raises
+        ------
+        OSError
+            If the file could not be written.
+        """
+        _atomic_write(self.path, self.to_dict())
+
+
+def save_warm_start(axes: Mapping[str, AxisState], path: str = WARM_START_PATH) -> None:
+    """
+    Save the homing result of axes at a clean shutdown.
+
+    Parameters
+    ----------
+    axes: Mapping[str, AxisState]
+        The state of each axis, by name.
+    path: str
+        The warm start file.
+
+    Raises
+    ------
+    OSError
+        If the file could not be written.
+    """
+    _atomic_write(path, {
+        'version': VERSION,
+        'timestamp': time(),
+        'axes': {name: state._asdict() for name, state in axes.items()},
+    })
+
+
+def take_warm_start(path: str = WARM_START_PATH) -> dict[str, AxisState]:
+    """
+    Read and remove the homing results saved at the last shutdown.
+
+    The file is removed so that after a crash, which does not save it,
+    every axis is homed again.
+
+    Parameters
+    ----------
+    path: str
+        The warm start file.
+
+    Returns
+    -------
+    dict[str, AxisState]
+        The state of each axis, by name, empty if there is none or it is unusable.
+    """
+    try:
+        with open(path, 'r') as f:
+            text = f.read()
+        os.remove(path)
+    except FileNotFoundError:
+        return {}
+    except OSError as e:
+        print(f'[WARNING] [{__name__}] Warm start state could not be read: {e}')
+        return {}
+
+    try:
+        data = json.loads(text)
+        if data.get('version') != VERSION:
+            raise CalibrationError(f'{path} is not a version {VERSION} warm start.')
+
+        return {
+            name: AxisState(_number(state['offset'], f'{name} offset'), _number(state['raw'], f'{name} raw'))
+            for name, state in data['axes'].items()
+        }
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        print(f'[WARNING] [{__name__}] Warm start state is corrupted: {e}')
+        return {}
@@ -0,0 +1,207 @@
+"""
+Filters for teleoperation inputs.
+
+Teleoperation inputs are noisy and arrive late: the camera, inference and
+serial link all add latency before the motors react. These filters smooth
+an input vector and predict it ahead by the measured end-to-end latency,
+so jitter is removed without adding lag on top of the latency already
+present.
+"""
+
+from abc import ABC, abstractmethod
+from math import pi
+from typing import Optional
+
+import numpy as np
+from numpy.typing import ArrayLike
+
+
+class InputFilter(ABC):
+    """
+    A smoothing filter with look-ahead prediction.
+
+    Attributes
+    ----------
+    latency: float
+        The measured end-to-end latency, in seconds, the output should make up for.
+    max_lookahead: float
+        The furthest the output is predicted ahead, in seconds.
+        Predicting further amplifies noise.
+    """
+    latency: float = 0
+    max_lookahead: float = 0.2
+
+    @property
+    def lookahead(self) -> float:
+        """
+        How far ahead the output is predicted.
+        """
+        return min(self.latency, self.max_lookahead)
+
+    @property
+    @abstractmethod
+    def lag(self) -> float:
+        """
+        The delay the filter itself currently adds to a moving input.
+        """
+
+    @property
+    def residual_latency(self) -> float:
+        """
+        The latency left after prediction, filter lag included.
+        """
+        return max(0, self.latency + self.lag - self.lookahead)
+
+    @abstractmethod
+    def update(self, value: ArrayLike, timestamp: float) -> np.ndarray:
+        """
+        Filter a new measurement.
+
+        Parameters
+        ----------
+        value: ArrayLike
+            The measured input vector.
+        timestamp: float
+            When the measurement was taken.
+
+        Returns
+        -------
+        np.ndarray
+            The filtered input, predicted lookahead seconds ahead.
+        """
+
+    @abstractmethod
+    def reset(self) -> None:
+        """
+        Forget the filter state, the next measurement is passed through.
+        """
+
+
+class OneEuroFilter(InputFilter):
+    """
+    The 1€ filter: a low-pass filter whose cutoff rises with speed.
+
+    Slow movements are smoothed heavily to remove jitter, fast movements
+    lightly to keep lag low. The filtered derivative is used for prediction.
+
+    Attributes
+    ----------
+    min_cutoff: float
+        The cutoff frequency (Hz) at rest.
+    beta: float
+        How fast the cutoff rises with speed.
+    d_cutoff: float
+        The cutoff frequency (Hz) of the derivative.
+    """
+    min_cutoff: float
+    beta: float
+    d_cutoff: float
+
+    def __init__(self, min_cutoff: float = 1, beta: float = 0, d_cutoff: float = 1):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.reset()
+
+    @staticmethod
+    def _alpha(cutoff: ArrayLike, dt: float) -> ArrayLike:
+        tau = 1 / (2 * pi * cutoff)
+        return dt / (dt + tau)
+
+    @property
+    def lag(self) -> float:
+        # The time constant of a first-order low-pass filter is its delay on a ramp.
+        return float(np.max(1 / (2 * pi * self._cutoff)))
+
+    def reset(self) -> None:
+        self._value: Optional[np.ndarray] = None
+        self._derivative: Optional[np.ndarray] = None
+        self._cutoff: ArrayLike = self.min_cutoff
+        self._timestamp = 0.0
+
+    def update(self, value: ArrayLike, timestamp: float) -> np.ndarray:
+        value = np.asarray(value, dtype=float)
+
+        if self._value is None:
+            self._value = value
+            self._derivative = np.zeros_like(value)
+            self._timestamp = timestamp
+            return value.copy()
+
+        dt = max(timestamp - self._timestamp, 1e-6)
+        self._timestamp = timestamp
+
+        derivative = (value - self._value) / dt
+        self._derivative = self._derivative + self._alpha(self.d_cutoff, dt) * (derivative - self._derivative)
+
+        self._cutoff = self.min_cutoff + self.beta * np.abs(self._derivative)
+        self._value = self._value + self._alpha(self._cutoff, dt) * (value - self._value)
+
+        return self._value + self._derivative * self.lookahead
+
+
+class KalmanFilter(InputFilter):
+    """
+    A constant-velocity Kalman filter, independent per axis.
+
+    The estimated velocity is used for prediction. At steady state the
+    filter follows constant-velocity motion without lag.
+
+    Attributes
+    ----------
+    process_noise: float
+        The spectral density of the unmodeled acceleration.
+    measurement_noise: float
+        The variance of a measurement.
+    """
+    process_noise: float
+    measurement_noise: float
+
+    def __init__(self, process_noise: float = 100, measurement_noise: float = 0.01):
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.reset()
+
+    @property
+    def lag(self) -> float:
+        return 0
+
+    def reset(self) -> None:
+        self._position: Optional[np.ndarray] = None
+        self._velocity: Optional[np.ndarray] = None
+        # The upper triangle of every axis' 2x2 covariance matrix.
+        self._p00 = self._p01 = self._p11 = None
+        self._timestamp = 0.0
+
+    def update(self, value: ArrayLike, timestamp: float) -> np.ndarray:
+        value = np.asarray(value, dtype=float)
+
+        if self._position is None:
+            self._position = value
+            self._velocity = np.zeros_like(value)
+            self._p00 = np.full_like(value, self.measurement_noise)
+            self._p01 = np.zeros_like(value)
+            self._p11 = np.full_like(value, self.process_noise)
+            self._timestamp = timestamp
+            return value.copy()
+
+        dt = max(timestamp - self._timestamp, 1e-6)
+        self._timestamp = timestamp
+        q = self.process_noise
+
+        # Predict
+        self._position = self._position + self._velocity * dt
+        p00 = self._p00 + 2 * dt * self._p01 + dt ** 2 * self._p11 + q * dt ** 3 / 3
+        p01 = self._p01 + dt * self._p11 + q * dt ** 2 / 2
+        p11 = self._p11 + q * dt
+
+        # Update
+        s = p00 + self.measurement_noise
+        k0, k1 = p00 / s, p01 / s
+        innovation = value - self._position
+
+        self._position = self._position + k0 * innovation
+        self._velocity = self._velocity + k1 * innovation
+        self._p00, self._p01, self._p11 = (1 - k0) * p00, (1 - k0) * p01, p11 - k1 * p01
+
+        return self._position + self._velocity * self.lookahead
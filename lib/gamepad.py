@@ -1,114 +1,205 @@
 from threading import Thread
-from time import time
+from time import sleep, time
+from tkinter import TclError
+from typing import Optional
 import hid
+import numpy as np
 
 from lib.app import Application
+from lib.filtering import InputFilter, KalmanFilter
+from lib.utils import Mailbox
 
 # from lib.widget import Control
 
 
 class GamePadDelegate:
+    """
+    Teleoperation from a gamepad.
+
+    A reader thread keeps only the latest HID report. A control thread
+    turns it into targets at a fixed rate, independent of the report rate
+    and of the serial bus, and the GUI is updated at a lower display rate.
+
+    Targets are ordered x, y, z, r, e throughout.
+    """
     device: hid.Device
     app: Application
-
-    def __init__(self, app: Application):
+    # Control ticks per second.
+    rate: float
+    # GUI updates per second.
+    display_rate: float = 10
+    # Report byte of each axis, the end effector is the difference of two triggers.
+    axes = [8, 9, 7, 6, 19]
+    e_release = 18
+    range_in = np.array(((0, 0, 0, 0, -255), (255, 255, 255, 255, 255)))
+    range_out = np.array(((-5, -5, -10, -0.5, -10), (5, 5, 10, 0.5, 10)))
+    # Dead zone of each axis, in output units.
+    thresholds = np.array((0.5, 0.5, 1, 0.1, 1))
+    # Lower and upper bounds of each axis.
+    bounds = np.array(((0, -30, 0, -1.57, 0), (30, 30, 160, 1.57, 100)))
+    # Smooths the integrated targets and predicts them ahead by the motion latency.
+    filter: InputFilter
+    reports: Mailbox[bytes]
+    # The unfiltered targets integrated from the sticks.
+    targets: Optional[np.ndarray] = None
+    # The filtered targets of the last tick.
+    output: Optional[np.ndarray] = None
+    # The targets last sent to the motion thread.
+    sent: Optional[np.ndarray] = None
+    # The targets last shown in the GUI, to detect moves from elsewhere.
+    shown: Optional[np.ndarray] = None
+    # Whether the GUI's realtime mode is on, as of the last GUI update.
+    realtime: bool = False
+    # Whether the sticks command velocities instead of positions, as of the last GUI update.
+    velocity: bool = False
+    # Whether the last velocity command was non-zero.
+    moving: bool = False
+
+    def __init__(self, app: Application, rate: float = 100):
+        """
+        Parameters
+        ----------
+        app: Application
+            The application to control.
+        rate: float
+            Control ticks per second.
+        """
         self.app = app
+        self.rate = rate
+        self.filter = KalmanFilter()
+        self.reports = Mailbox()
+        self._report: Optional[np.ndarray] = None
+        self._reseed: Optional[np.ndarray] = None
 
         self.device = hid.Device(0x054c, 0x0268)
-        Thread(target=self.event_loop, daemon=True).start()
+        Thread(target=self._read_loop, daemon=True).start()
+        Thread(target=self._control_loop, daemon=True).start()
+        self.app.after(0, self._sync)
 
     @staticmethod
     def map_range(range_in: tuple, range_out: tuple, val_in):
         return (val_in - range_in[0]) / (range_in[1] - range_in[0]) * (range_out[1] - range_out[0]) + range_out[0]
-    
+
     @staticmethod
     def threshold(val, thresh, offset = 0):
-        return val if (abs(val) > thresh) else offset
-    
+        return np.where(np.abs(val) > thresh, val, offset)
+
     @staticmethod
     def clamp(val, bounds: tuple):
-        return min(max(val, bounds[0]), bounds[1])
+        return np.clip(val, bounds[0], bounds[1])
 
     @staticmethod
     def _signed_ceil(val):
-        c = int(val) != val
-        return int(val) + c if val > 0 else int(val) - c
-
-    def event_loop(self):
-        start = time()
+        return np.sign(val) * np.ceil(np.abs(val))
 
+    def _read_loop(self):
         while True:
             report = self.device.read(64)
-            _vals = list(report)
-
-            delta = 10 * (time() - start)
-
-            r = self.clamp(
-                self.app.target_r_var.get() + delta * self.threshold(
-                    self.map_range(
-                        (0, 255),
-                        (-0.5, 0.5),
-                        _vals[6]
-                    ),
-                    0.1
-                ),
-                (-1.57, 1.57)
-                )
-            z = self.clamp(
-                self.app.target_z_var.get() + delta * self.threshold(
-                    self.map_range(
-                        (0, 255),
-                        (-10, 10),
-                        _vals[7]
-                    ),
-                    1
-                ),
-                (0, 160)
-            )
-            x = self.clamp(
-                self.app.target_x_var.get() + delta * self.threshold(
-                    self.map_range(
-                        (0, 255),
-                        (-5, 5),
-                        _vals[8]
-                    ),
-                    0.5
-                ),
-                (0, 30)
-            )
-            y = self.clamp(
-                self.app.target_y_var.get() + delta * self.threshold(
-                    self.map_range(
-                        (0, 255),
-                        (-5, 5),
-                        _vals[9]
-                    ),
-                    0.5
-                ),
-                (-30, 30)
-            )
-
-            e = self.clamp(
-                self.app.target_e_var.get() + self._signed_ceil(delta * self.threshold(
-                    self.map_range(
-                        (-255, 255),
-                        (-10, 10),
-                        _vals[19] - _vals[18]
-                    ),
-                    1
-                )),
-                (0, 100)
-            )
-
-            self.app.update_targets(
-                x,
-                y,
-                z,
-                r,
-                e
-            )
-
-            start = time()
+            if len(report) > max(self.axes):
+                self.reports.post(report)
 
+    def _control_loop(self):
+        last = time()
 
+        while True:
+            start = time()
 
+            report = self.reports.take(0)
+            if report is not None:
+                self._report = np.frombuffer(report, dtype=np.uint8).astype(float)
+
+            if self._reseed is not None:
+                self.targets, self._reseed = self._reseed, None
+                self.filter.reset()
+
+            if self.targets is not None and self._report is not None:
+                self._tick(start - last, start)
+
+            last = start
+            sleep(max(0, 1 / self.rate - (time() - start)))
+
+    def _tick(self, dt: float, now: float):
+        """
+        Integrate the sticks over one tick and send the filtered targets.
+        """
+        values = self._report[self.axes]
+        values[4] -= self._report[self.e_release]
+
+        speeds = 10 * self.threshold(self.map_range(self.range_in, self.range_out, values), self.thresholds)
+        step = dt * speeds
+        step[4] = self._signed_ceil(step[4])
+        self.targets = self.clamp(self.targets + step, self.bounds)
+
+        if self.realtime and self.velocity:
+            self._send_velocity(speeds)
+            return
+
+        # The motion thread holds a setpoint for up to one period before sending it.
+        self.filter.latency = self.app.motion.latency.average + 0.5 / self.app.motion.rate
+        output = self.clamp(self.filter.update(self.targets, now), self.bounds)
+        output[4] = round(output[4])
+        self.output = output
+
+        if self.realtime and (self.sent is None or not np.allclose(output, self.sent)):
+            x, y, z, r, e = output
+            self.app.motion.post(float(x), float(y), float(z), float(r), int(e))
+            self.sent = output
+
+    def _send_velocity(self, speeds: np.ndarray):
+        """
+        Send the stick velocities, every tick while they are non-zero
+        to keep the motion thread's watchdog from stopping the arm.
+
+        The motion thread scales the velocities to the joint limits and
+        stops at the workspace edge, so the targets follow the pose it
+        reached rather than the integrated stick speeds.
+        """
+        moving = bool(np.any(speeds[:4]))
+
+        pose = self.app.motion.velocity_pose()
+        if pose is not None:
+            self.targets[:4] = pose
+        self.output = self.targets.copy()
+
+        if moving or self.moving:
+            vx, vy, vz, vr, _ = speeds
+            self.app.motion.post_velocity(float(vx), float(vy), float(vz), float(vr), int(self.targets[4]))
+            self.sent = None
+
+        self.moving = moving
+
+    def _current_targets(self) -> np.ndarray:
+        return np.array((
+            self.app.target_x_var.get(),
+            self.app.target_y_var.get(),
+            self.app.target_z_var.get(),
+            self.app.target_r_var.get(),
+            self.app.target_e_var.get(),
+        ), dtype=float)
+
+    def _sync(self):
+        """
+        Exchange targets with the GUI, on the Tk thread.
+
+        Targets changed in the GUI (or by jobs, widgets) since the last
+        update take over from the integrated ones, otherwise the GUI shows
+        the gamepad's targets.
+        """
+        try:
+            current = self._current_targets()
+            self.realtime = self.app.realtime_var.get()
+            self.velocity = self.app.velocity_teleop_var.get()
+
+            if self.shown is None or not np.allclose(current, self.shown):
+                self._reseed = current
+                self.shown = current
+                self.output = None
+            elif self.output is not None and not np.allclose(self.output, self.shown):
+                x, y, z, r, e = self.output
+                self.app.update_targets(float(x), float(y), float(z), float(r), int(e), move=False)
+                self.shown = self._current_targets()
+        except TclError:
+            # An entry is being edited.
+            pass
+
+        self.app.after(int(1000 / self.display_rate), self._sync)
@@ -13,4 +13,4 @@ def read_gcode_line(line: str) -> Generator[tuple[str, float], None, None]:
 
 
 def write_gcode_line(file: TextIO, commands: dict[str, float]):
-    file.write(' '.join(f'{command}{value}' for command, value in commands))
+    file.write(' '.join(f'{command}{value}' for command, value in commands.items()))
@@ -0,0 +1,162 @@
+"""
+Homing of independent axes in parallel.
+
+Every motor has its own serial port, so axes which do not depend on each
+other mechanically are homed at the same time, and each axis starts as
+soon as the axes it depends on are done.
+"""
+
+from threading import Thread
+from time import perf_counter, sleep
+from typing import Callable, NamedTuple
+
+from hardware.FOCMC_interface import Motor
+
+
+def wait_for_stall(motor: Motor, zero_speed: float, interval: float = 0.02, spin_up: float = 0.5,
+                   settle: int = 3, timeout: float = 30) -> None:
+    """
+    Wait until a motor driven towards an end stop has stopped.
+
+    Parameters
+    ----------
+    motor: Motor
+        The motor being driven.
+    zero_speed: float
+        The speed below which the motor is considered still.
+    interval: float
+        Seconds between velocity samples.
+    spin_up: float
+        How long a motor which never moved may take to start moving,
+        after which it is considered to already be at the end stop.
+    settle: int
+        The number of consecutive still samples needed.
+    timeout: float
+        How long the motor may take to stop.
+
+    Raises
+    ------
+    TimeoutError
+        If the motor did not stop in time.
+    """
+    start = perf_counter()
+    moving = False
+    still = 0
+
+    while True:
+        elapsed = perf_counter() - start
+        if elapsed > timeout:
+            raise TimeoutError(f'Motor {motor.m_id} did not stop within {timeout} s.')
+
+        if abs(motor.velocity) > zero_speed:
+            moving = True
+            still = 0
+        else:
+            still += 1
+
+        if still >= settle and (moving or elapsed >= spin_up):
+            return
+
+        sleep(interval)
+
+
+class AxisTime(NamedTuple):
+    """
+    When an axis was homed, in seconds since Homing.run() was called.
+    """
+    name: str
+    start: float
+    end: float
+
+
+class Homing:
+    """
+    Runs the homing routine of every axis once the axes it depends on are homed.
+
+    Attributes
+    ----------
+    times: list[AxisTime]
+        When each finished axis started and ended, in seconds since run() was called.
+    """
+    times: list[AxisTime]
+
+    def __init__(self):
+        self._routines: dict[str, tuple[Callable[[], None], tuple[str, ...]]] = {}
+        self.times = []
+
+    def add(self, name: str, routine: Callable[[], None], after: tuple[str, ...] = ()) -> None:
+        """
+        Add the homing routine of an axis.
+
+        Parameters
+        ----------
+        name: str
+            The name of the axis.
+        routine: Callable[[], None]
+            Homes the axis.
+        after: tuple[str, ...]
+            The axes which must be homed first.
+        """
+        self._routines[name] = (routine, after)
+
+    def run(self) -> None:
+        """
+        Home every axis, blocking until all are done.
+
+        An axis whose dependency failed is not homed.
+
+        Raises
+        ------
+        Exception
+            The first exception raised by a routine, after every other axis has finished.
+        """
+        start = perf_counter()
+        threads: dict[str, Thread] = {}
+        errors: dict[str, BaseException] = {}
+        self.times = []
+
+        def home(name: str) -> None:
+            routine, after = self._routines[name]
+
+            for dependency in after:
+                threads[dependency].join()
+                if dependency in errors:
+                    return
+
+            begin = perf_counter() - start
+            try:
+                routine()
+            except Exception as e:
+                errors[name] = e
+            else:
+                self.times.append(AxisTime(name, begin, perf_counter() - start))
+
+        for name in self._routines:
+            threads[name] = Thread(target=home, args=(name,), name=f'homing-{name}', daemon=True)
+        for thread in threads.values():
+            thread.start()
+        for thread in threads.values():
+            thread.join()
+
+        if errors:
+            raise next(iter(errors.values()))
+
+    def report(self) -> str:
+        """
+        Describe when each axis was homed.
+
+        Returns
+        -------
+        str
+            One line per axis in start order, then the total.
+        """
+        times = sorted(self.times, key=lambda axis: axis.start)
+        lines = [
+            f'{axis.name:<6} {axis.start * 1000:8.0f} -> {axis.end * 1000:8.0f} ms ({(axis.end - axis.start) * 1000:.0f} ms)'
+            for axis in times
+        ]
+
+        if times:
+            lines.append(f'Total: {max(axis.end for axis in times) * 1000:.0f} ms')
+
+        return '\n'.join(lines)
@@ -0,0 +1,388 @@
+"""
+Jobs and the job queue.
+
+A job is parsed, validated and compiled to joint targets before it runs.
+The queue prepares upcoming jobs in the background while the current job
+runs, so consecutive jobs follow each other without a pause.
+"""
+
+import os.path
+from threading import Thread, Condition
+from time import time
+from typing import Callable, Literal, Optional, TextIO
+
+from lib.gcode import read_gcode_line, write_gcode_line
+from lib.system import System
+from lib.workspace import WorkspaceMap
+
+Pose = dict[str, float]
+Status = Literal['pending', 'ready', 'running', 'done', 'failed', 'aborted']
+
+AXES = ('X', 'Y', 'Z', 'R', 'E', 'D')
+
+
+class Job:
+    """
+    A job file and its compiled motion.
+
+    Attributes
+    ----------
+    file_name: str
+        The job file.
+    status: Status
+        Where the job is in its life cycle.
+    error: Optional[str]
+        Why preparing or running the job failed.
+    poses: list[Pose]
+        The fully resolved pose of every waypoint, keyed by G-code axis.
+    joints: list[tuple[float, float]]
+        The (t1, t2) pose of every waypoint.
+    slow: list[int]
+        Line numbers of waypoints in slow or unreachable regions.
+    prepare_time: float
+        Time spent preparing the job.
+    start_time: Optional[float]
+        When the job started running.
+    end_time: Optional[float]
+        When the job stopped running.
+    """
+    file_name: str
+    status: Status
+    error: Optional[str]
+    poses: list[Pose]
+    joints: list[tuple[float, float]]
+    slow: list[int]
+    prepare_time: float
+    start_time: Optional[float]
+    end_time: Optional[float]
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Discard the compiled motion so the job is prepared again.
+        """
+        self.status = 'pending'
+        self.error = None
+        self.poses = []
+        self.joints = []
+        self.slow = []
+        self.prepare_time = 0
+        self.start_time = None
+        self.end_time = None
+
+    @property
+    def run_time(self) -> Optional[float]:
+        if self.start_time is not None and self.end_time is not None:
+            return self.end_time - self.start_time
+
+    @property
+    def final_pose(self) -> Optional[Pose]:
+        return self.poses[-1] if self.poses else None
+
+    @property
+    def final_joints(self) -> Optional[tuple[float, float]]:
+        return self.joints[-1] if self.joints else None
+
+    def prepare(
+        self,
+        system: System,
+        workspace: WorkspaceMap,
+        initial: Pose,
+        previous: Optional[tuple[float, float]] = None,
+        min_speed: float = 5,
+    ) -> None:
+        """
+        Parse, validate and compile the job.
+
+        Parameters
+        ----------
+        system: System
+            The system whose kinematics are used.
+        workspace: WorkspaceMap
+            The map used to flag waypoints in slow regions.
+        initial: Pose
+            The pose of the arm when the job starts, keyed by G-code axis.
+        previous: Optional[tuple[float, float]]
+            The (t1, t2) pose of the arm when the job starts.
+        min_speed: float
+            The slowest acceptable cartesian speed.
+
+        Raises
+        ------
+        OSError
+            If the file can not be read.
+        ValueError
+            If the file is not valid G-code.
+        """
+        start = time()
+        self.reset()
+
+        with open(self.file_name, 'r') as f:
+            lines = f.readlines()
+
+        state = dict(initial)
+        numbers = []
+
+        for number, line in enumerate(lines, 1):
+            try:
+                commands = list(read_gcode_line(line))
+            except (ValueError, AssertionError) as e:
+                raise ValueError(f'Line {number}: {e}')
+
+            if not commands:
+                continue
+
+            state.update(commands)
+            previous = system.cartesian_to_dual_polar(state['X'], state['Y'], previous)
+
+            numbers.append(number)
+            self.poses.append(dict(state))
+            self.joints.append(previous)
+
+        slow = workspace.slow(
+            [pose['X'] for pose in self.poses], [pose['Y'] for pose in self.poses], min_speed
+        )
+        self.slow = [number for number, is_slow in zip(numbers, slow) if is_slow]
+
+        self.prepare_time = time() - start
+        self.status = 'ready'
+
+    def write(self, destination: TextIO) -> None:
+        """
+        Write the compiled job as fully resolved G-code.
+
+        Parameters
+        ----------
+        destination: TextIO
+            Where the job is written.
+        """
+        for pose in self.poses:
+            write_gcode_line(destination, {axis: pose[axis] for axis in AXES})
+            destination.write('\n')
+
+
+class JobQueue:
+    """
+    An ordered queue of jobs which are prepared ahead of execution.
+
+    Attributes
+    ----------
+    jobs: list[Job]
+        Every job in the queue, including finished ones.
+    running: bool
+        Whether the queue is executing jobs.
+    error: Optional[str]
+        Why the last run stopped early, None if it did not.
+    """
+    jobs: list[Job]
+    running: bool = False
+    error: Optional[str] = None
+    _generation: int = 0
+
+    def __init__(self, system: System, workspace: WorkspaceMap, initial: Callable[[], Pose]):
+        """
+        Parameters
+        ----------
+        system: System
+            The system whose kinematics are used.
+        workspace: WorkspaceMap
+            The map used to validate jobs.
+        initial: Callable[[], Pose]
+            Returns the pose of the arm, used to prepare the first queued job.
+        """
+        self.system = system
+        self.workspace = workspace
+        self.initial = initial
+        self.jobs = []
+        self._condition = Condition()
+
+        Thread(target=self._prepare_loop, daemon=True).start()
+
+    def add(self, file_name: str) -> Job:
+        """
+        Append a job to the queue.
+
+        Parameters
+        ----------
+        file_name: str
+            The job file.
+
+        Returns
+        -------
+        Job
+            The queued job.
+        """
+        job = Job(file_name)
+
+        with self._condition:
+            self.jobs.append(job)
+            self._condition.notify_all()
+
+        return job
+
+    def remove(self, index: int) -> None:
+        """
+        Remove a job which is not running.
+
+        Jobs after it are prepared again since their starting pose changes.
+
+        Parameters
+        ----------
+        index: int
+            The position of the job in the queue.
+        """
+        with self._condition:
+            if self.jobs[index].status == 'running':
+                return
+
+            del self.jobs[index]
+            self._invalidate(index)
+
+    def clear_finished(self) -> None:
+        with self._condition:
+            self.jobs = [job for job in self.jobs if job.status not in ('done', 'aborted')]
+
+    def _invalidate(self, index: int) -> None:
+        self._generation += 1
+        for job in self.jobs[index:]:
+            if job.status in ('ready', 'failed'):
+                job.reset()
+
+        self._condition.notify_all()
+
+    def _predecessor(self, job: Job) -> Optional[Job]:
+        index = self.jobs.index(job)
+        return self.jobs[index - 1] if index > 0 else None
+
+    def _prepare_loop(self) -> None:
+        while True:
+            with self._condition:
+                while (job := self._next_pending()) is None:
+                    self._condition.wait()
+
+                before = self._predecessor(job)
+                generation = self._generation
+
+            # A finished job is not run again, the arm starts from wherever it is now.
+            if before is not None and before.status in ('ready', 'running') and before.final_pose is not None:
+                initial, previous = before.final_pose, before.final_joints
+            else:
+                initial, previous = self.initial(), self.system.joint_target
+
+            try:
+                job.prepare(self.system, self.workspace, initial, previous)
+            except (OSError, ValueError) as e:
+                job.reset()
+                job.status = 'failed'
+                job.error = str(e)
+
+            with self._condition:
+                if generation != self._generation and job in self.jobs:
+                    # The queue changed underneath us, the starting pose may be stale.
+                    job.reset()
+                self._condition.notify_all()
+
+    def _next_pending(self) -> Optional[Job]:
+        for job in self.jobs:
+            if job.status == 'pending':
+                # The job before must be prepared first, its final pose is our starting pose.
+                # After a failed job there is no starting pose until it is removed or fixed.
+                before = self._predecessor(job)
+                return job if before is None or before.status not in ('pending', 'failed') else None
+
+    def _head(self) -> Optional[Job]:
+        return next((job for job in self.jobs if job.status in ('pending', 'ready', 'failed')), None)
+
+    def run(self, execute: Callable[[Job], bool]) -> None:
+        """
+        Execute queued jobs in order until the queue is exhausted,
+        a job fails, or the queue is stopped.
+
+        The first job is prepared again from the current pose of the arm.
+        A job which failed to prepare stops the run, with the reason in error.
+
+        This function is intended to be launched in a thread.
+
+        Parameters
+        ----------
+        execute: Callable[[Job], bool]
+            Runs a prepared job and returns whether it completed.
+        """
+        self.running = True
+        self.error = None
+
+        try:
+            with self._condition:
+                # The arm may have moved since the first job was prepared.
+                head = self._head()
+                if head is not None and head.status != 'pending':
+                    self._invalidate(self.jobs.index(head))
+
+            while self.running:
+                with self._condition:
+                    # Jobs may be removed while waiting, so the head is looked up after every wake-up.
+                    while (job := self._head()) is not None and job.status == 'pending':
+                        self._condition.wait()
+                        if not self.running:
+                            return
+
+                    if job is None:
+                        return
+
+                    if job.status == 'failed':
+                        self.error = f'{os.path.basename(job.file_name)}: {job.error}'
+                        return
+
+                    job.status = 'running'
+
+                job.start_time = time()
+                completed = execute(job)
+                job.end_time = time()
+
+                with self._condition:
+                    job.status = 'done' if completed else 'aborted'
+                    if not completed:
+                        return
+        finally:
+            self.running = False
+
+    def stop(self) -> None:
+        """
+        Stop after the current job.
+        """
+        with self._condition:
+            self.running = False
+            self._condition.notify_all()
+
+    def statistics(self) -> dict[str, float]:
+        """
+        Aggregate throughput of the finished jobs.
+
+        Returns
+        -------
+        dict[str, float]
+            jobs, waypoints, run_time, idle_time (between consecutive jobs),
+            prepare_time, jobs_per_hour and waypoints_per_second.
+        """
+        done = sorted(
+            (job for job in self.jobs if job.status == 'done'), key=lambda job: job.start_time
+        )
+        run_time = sum(job.run_time for job in done)
+        idle_time = sum(
+            max(0, b.start_time - a.end_time) for a, b in zip(done, done[1:])
+        )
+        waypoints = sum(len(job.poses) for job in done)
+        elapsed = run_time + idle_time
+
+        return {
+            'jobs': len(done),
+            'waypoints': waypoints,
+            'run_time': run_time,
+            'idle_time': idle_time,
+            'prepare_time': sum(job.prepare_time for job in done),
+            'jobs_per_hour': 3600 * len(done) / elapsed if elapsed else 0,
+            'waypoints_per_second': waypoints / elapsed if elapsed else 0,
+        }
@@ -0,0 +1,461 @@
+"""
+Realtime motion, decoupled from whoever produces the setpoints.
+"""
+
+from math import hypot
+from threading import Event, Lock, Thread
+from time import sleep, time
+from typing import Iterable, Literal, Optional, Sequence
+
+import numpy as np
+
+from hardware.FOCMC_interface import MotorException
+from hardware.end_effector import EndEffectorException
+
+from lib.system import System
+from lib.utils import Mailbox, StageTimer
+
+
+PathStatus = Literal['pending', 'running', 'done', 'cancelled', 'failed']
+
+# Wakes the motion thread for a new path, it is not a setpoint.
+_FOLLOW: dict[str, float] = {}
+
+
+class PathHandle:
+    """
+    A path planned in joint space and streamed by the motion thread.
+
+    Attributes
+    ----------
+    times: np.ndarray
+        The time at which each waypoint is reached, from the start of the path.
+        The first entry is the pose the arm starts from, not a waypoint.
+    joints: np.ndarray
+        The (t1, t2, z, r) pose of each entry, r relative to the world.
+    e: np.ndarray
+        The end effector position of each waypoint, NaN where it is left unchanged.
+    status: PathStatus
+        Whether the path is waiting, being followed or finished.
+    progress: int
+        The number of waypoints reached.
+    error: Optional[str]
+        Why the path failed.
+    """
+    times: np.ndarray
+    joints: np.ndarray
+    e: np.ndarray
+    status: PathStatus = 'pending'
+    progress: int = 0
+    error: Optional[str] = None
+
+    def __init__(self, times: np.ndarray, joints: np.ndarray, e: np.ndarray):
+        self.times = times
+        self.joints = joints
+        self.e = e
+        self.start: Optional[float] = None
+        self.cancelled = False
+        self._finished = Event()
+
+    def __len__(self) -> int:
+        return len(self.times) - 1
+
+    @property
+    def duration(self) -> float:
+        return float(self.times[-1])
+
+    @property
+    def done(self) -> bool:
+        return self._finished.is_set()
+
+    def cancel(self) -> None:
+        """
+        Stop following the path, the arm stops near where it is.
+        """
+        self.cancelled = True
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for the path to finish.
+
+        Parameters
+        ----------
+        timeout: Optional[float]
+            How long to wait, forever if None.
+
+        Returns
+        -------
+        bool
+            Whether the path was followed to the end.
+        """
+        self._finished.wait(timeout)
+        return self.status == 'done'
+
+    def sample(self, t: float) -> tuple[float, float, float, float, Optional[int]]:
+        """
+        The joint targets at a time, linearly interpolated between waypoints.
+
+        Parameters
+        ----------
+        t: float
+            Seconds from the start of the path.
+
+        Returns
+        -------
+        tuple[float, float, float, float, Optional[int]]
+            t1, t2, z, r and the end effector position of the last waypoint reached.
+        """
+        t1, t2, z, r = (float(np.interp(t, self.times, column)) for column in self.joints.T)
+        e = self.e[max(int(np.searchsorted(self.times, t, 'right')) - 1, 0)]
+
+        return t1, t2, z, r, None if np.isnan(e) else int(e)
+
+    def _finish(self, status: PathStatus, error: Optional[str] = None) -> None:
+        self.status = status
+        self.error = error
+        self._finished.set()
+
+
+class MotionThread:
+    """
+    A dedicated thread which sends realtime setpoints to the motors at a fixed rate.
+
+    Producers (GUI callbacks, teleoperation) post cartesian setpoints and
+    return immediately. The thread only ever acts on the latest setpoint,
+    intermediate ones are dropped.
+
+    Whole paths are planned up front and streamed by the thread, a
+    setpoint posted while a path is followed cancels the path.
+
+    Setpoints are either positions, sent to the motors as angle targets
+    through inverse kinematics, or cartesian velocities, sent as velocity
+    targets through the inverse Jacobian. A velocity stays in effect until
+    the next setpoint; if none arrives within the watchdog period the arm
+    stops and holds its position in angle mode.
+
+    Attributes
+    ----------
+    rate: float
+        The maximum number of setpoints sent per second.
+    setpoints: Mailbox[dict[str, float]]
+        The latest setpoint waiting to be sent.
+    latency: StageTimer
+        How long sending a setpoint to the motors takes.
+    watchdog: float
+        Seconds without a setpoint after which velocity motion stops.
+    velocity_mode: bool
+        Whether t1, t2 and r are currently in velocity mode.
+    """
+    rate: float
+    setpoints: Mailbox[dict[str, float]]
+    latency: StageTimer
+    watchdog: float = 0.25
+    velocity_mode: bool = False
+    # Joints driven in velocity mode, z stays in angle mode so it never sags.
+    velocity_joints = ('t1', 't2', 'r')
+
+    def __init__(self, system: System, rate: float = 20):
+        """
+        Parameters
+        ----------
+        system: System
+            The system to move.
+        rate: float
+            The maximum number of setpoints sent per second.
+        """
+        self.system = system
+        self.rate = rate
+        self.setpoints = Mailbox()
+        self.latency = StageTimer()
+        self._path: Optional[PathHandle] = None
+        # The dead reckoned t1, t2, z, r of velocity motion, r relative to t1.
+        self._estimate: Optional[list[float]] = None
+        self._path_lock = Lock()
+
+        Thread(target=self._loop, daemon=True).start()
+
+    def post(self, x: float, y: float, z: float, r: float, e: Optional[int] = None) -> None:
+        """
+        Request a realtime move, replacing any pending request.
+
+        Parameters
+        ----------
+        x: float
+            The x-coordinate to move to.
+        y: float
+            The y-coordinate to move to.
+        z: float
+            The z-coordinate to move to.
+        r: float
+            The end effector rotation to move to.
+        e: Optional[int]
+            The end effector position to move to.
+        """
+        self.setpoints.post({'x': x, 'y': y, 'z': z, 'r': r, 'e': e})
+
+    def post_velocity(self, vx: float, vy: float, vz: float, vr: float, e: Optional[int] = None) -> None:
+        """
+        Request a realtime cartesian velocity, replacing any pending request.
+
+        The velocity must be posted again within the watchdog period,
+        otherwise the arm stops and holds its position.
+
+        Parameters
+        ----------
+        vx: float
+            The x velocity.
+        vy: float
+            The y velocity.
+        vz: float
+            The z velocity.
+        vr: float
+            The end effector angular velocity.
+        e: Optional[int]
+            The end effector position to move to.
+        """
+        self.setpoints.post({'vx': vx, 'vy': vy, 'vz': vz, 'vr': vr, 'e': e})
+
+    def follow(self, poses: Iterable[Sequence[float]], times: Optional[Iterable[float]] = None,
+               speed: float = 5) -> PathHandle:
+        """
+        Follow a path, replacing any path being followed.
+
+        The path is converted to joint space here, on the caller's thread,
+        and the motion thread interpolates between the waypoints at its rate.
+        The arm first moves to the first waypoint at its velocity limits.
+
+        Parameters
+        ----------
+        poses: Iterable[Sequence[float]]
+            The (x, y, z, r) or (x, y, z, r, e) waypoints, an array or any iterable.
+        times: Optional[Iterable[float]]
+            The time at which each waypoint is reached, from the first waypoint.
+            By default the waypoints are reached at a constant cartesian speed.
+        speed: float
+            The cartesian speed used without times.
+
+        Returns
+        -------
+        PathHandle
+            The progress of the path.
+
+        Raises
+        ------
+        ValueError
+            If the poses or times do not have the expected shape, or the times decrease.
+        """
+        poses = np.asarray(poses if isinstance(poses, (np.ndarray, list, tuple)) else list(poses), dtype=float)
+        if poses.ndim != 2 or len(poses) == 0 or poses.shape[1] not in (4, 5):
+            raise ValueError(f'Expected (n, 4) or (n, 5) poses, got {poses.shape}.')
+
+        if times is None:
+            distances = np.linalg.norm(np.diff(poses[:, :3], axis=0), axis=1)
+            times = np.concatenate(((0,), np.cumsum(distances) / speed))
+        else:
+            times = np.asarray(list(times), dtype=float)
+            if times.shape != (len(poses),) or np.any(np.diff(times) < 0):
+                raise ValueError('Expected one non-decreasing time per pose.')
+            times = times - times[0]
+
+        system = self.system
+        joints = np.empty((len(poses), 4))
+        previous = system.joint_target
+        for i, (x, y, z, r) in enumerate(poses[:, :4]):
+            previous = system.cartesian_to_dual_polar(x, y, previous)
+            joints[i] = (*previous, z, r)
+
+        if system.motor_targets is not None:
+            t1, t2, z, r = system.motor_targets
+        else:
+            t1, t2, z, r = system.get_all_pos()
+        current = np.array((t1, t2, z, r + t1))
+        lead = max(
+            abs(joints[0, i] - current[i]) / system.velocity_limits[name]
+            for i, name in enumerate(('t1', 't2', 'z', 'r'))
+        )
+
+        e = poses[:, 4] if poses.shape[1] == 5 else np.full(len(poses), np.nan)
+        path = PathHandle(
+            np.concatenate(((0,), times + lead)),
+            np.concatenate((current[np.newaxis], joints)),
+            np.concatenate(((np.nan,), e)),
+        )
+
+        with self._path_lock:
+            replaced, self._path = self._path, path
+        if replaced is not None:
+            replaced.cancel()
+            replaced._finish('cancelled')
+        self.setpoints.post(_FOLLOW)
+
+        return path
+
+    def velocity_pose(self) -> Optional[tuple[float, float, float, float]]:
+        """
+        The pose reached by the last velocity motion.
+
+        Returns
+        -------
+        Optional[tuple[float, float, float, float]]
+            The dead reckoned x, y, z, r, r relative to the world,
+            or None if the arm was moved to a position since.
+        """
+        estimate = self._estimate
+        if estimate is None:
+            return None
+
+        t1, t2, z, r = tuple(estimate)
+        return (*self.system.polar_to_cartesian(t1, t2), z, r + t1)
+
+    def _loop(self) -> None:
+        while True:
+            following = self._path is not None
+            target = self.setpoints.take(0 if following else self.watchdog if self.velocity_mode else None)
+            start = time()
+
+            path = self._path
+            if target is _FOLLOW:
+                target = None
+            elif target is not None and path is not None:
+                self._end_path(path, 'cancelled')
+                path = None
+
+            try:
+                if path is not None:
+                    self._step_path(path, start)
+                elif target is None:
+                    self._hold()
+                elif 'vx' in target:
+                    self._move_velocity(target, start)
+                else:
+                    if self.velocity_mode:
+                        self._hold()
+
+                    t1, t2 = self.system.cartesian_to_dual_polar(
+                        target['x'], target['y'], self.system.joint_target
+                    )
+                    self.system.jog(t1=t1, t2=t2, z=target['z'], r=target['r'], e=target['e'])
+                    self._estimate = None
+            except (MotorException, EndEffectorException) as e:
+                print(f'[WARNING] [{__name__}] Realtime move failed: {e}')
+                if path is not None:
+                    self._end_path(path, 'failed', str(e))
+            else:
+                if target is not None:
+                    self.latency.record(time() - start)
+
+            sleep(max(0, 1 / self.rate - (time() - start)))
+
+    def _step_path(self, path: PathHandle, now: float) -> None:
+        if path.cancelled:
+            self._end_path(path, 'cancelled')
+            return
+
+        if path.start is None:
+            self._hold()
+            self._estimate = None
+            path.start = now
+            path.status = 'running'
+
+        t = now - path.start
+        t1, t2, z, r, e = path.sample(t)
+        reached = int(np.searchsorted(path.times, t, 'right')) - 1
+        # The end effector is only moved when a waypoint changes it.
+        if e is not None and e == path.e[path.progress]:
+            e = None
+
+        self.system.jog(t1=t1, t2=t2, z=z, r=r, e=e)
+        # The lead-in to the first waypoint is not a waypoint.
+        path.progress = reached
+
+        if t >= path.duration:
+            self._end_path(path, 'done')
+
+    def _end_path(self, path: PathHandle, status: PathStatus, error: Optional[str] = None) -> None:
+        with self._path_lock:
+            if self._path is path:
+                self._path = None
+        path._finish(status, error)
+
+    def _enter_velocity_mode(self, now: float) -> None:
+        joints = self.system.joints
+
+        t1, t2, r = (joints[name].position for name in self.velocity_joints)
+        z = self.system.motor_targets[2] if self.system.motor_targets is not None else joints['z'].position
+        self._estimate = [t1, t2, z, r]
+        self._velocities = (0.0, 0.0, 0.0)
+        self._vz = 0.0
+        self._estimate_time = now
+
+        # The previous angle target briefly acts as a velocity target, until the first command.
+        for name in self.velocity_joints:
+            joints[name].set_control_mode('velocity')
+            joints[name].move(0)
+
+        self.velocity_mode = True
+
+    def _move_velocity(self, target: dict[str, float], now: float) -> None:
+        if not self.velocity_mode:
+            self._enter_velocity_mode(now)
+
+        system = self.system
+        limits = system.velocity_limits
+
+        # Dead reckoning of the joint angles from the commanded velocities.
+        dt = now - self._estimate_time
+        self._estimate_time = now
+        for i, velocity in zip((0, 1, 3), self._velocities):
+            self._estimate[i] += velocity * dt
+        self._estimate[2] = min(max(self._estimate[2] + self._vz * dt, 0), 160)
+
+        t1, t2, z, r = self._estimate
+        w1, w2 = system.cartesian_to_joint_velocity(t1, t2, target['vx'], target['vy'])
+        wr = target['vr'] - w1
+        vz = target['vz']
+
+        # Stop planar motion before it leaves the workspace.
+        ahead = (t1 + w1 * self.watchdog, t2 + w2 * self.watchdog)
+        if not system._within_limits(ahead) or hypot(*system.polar_to_cartesian(*ahead)) < system.minimum_radius:
+            w1, w2, wr = 0, 0, target['vr']
+
+        # Scale every axis alike so the direction of motion is kept.
+        scale = max(
+            abs(w1) / limits['t1'], abs(w2) / limits['t2'], abs(wr) / limits['r'], abs(vz) / limits['z'], 1
+        )
+        w1, w2, wr, vz = (round(velocity / scale, 3) for velocity in (w1, w2, wr, vz))
+
+        for name, velocity in zip(self.velocity_joints, (w1, w2, wr)):
+            system.joints[name].move(velocity)
+        system.joints['z'].move(self._estimate[2])
+
+        self._velocities = (w1, w2, wr)
+        self._vz = vz
+        system.joint_target = (t1, t2)
+        system.motor_targets = (t1, t2, z, r)
+
+        if target['e'] is not None:
+            system.end_effector.move(target['e'])
+
+    def _hold(self) -> None:
+        """
+        Stop velocity motion and hold the current position in angle mode.
+        """
+        if not self.velocity_mode:
+            return
+
+        joints = self.system.joints
+
+        for name in self.velocity_joints:
+            joints[name].move(0)
+
+        t1, t2, r = (joints[name].position for name in self.velocity_joints)
+
+        # The previous velocity target briefly acts as an angle target, until it is replaced.
+        for name, position in zip(self.velocity_joints, (t1, t2, r)):
+            joints[name].set_control_mode('angle')
+            joints[name].move(position)
+
+        self.velocity_mode = False
+        self._estimate = [t1, t2, self._estimate[2], r]
+        self.system.joint_target = (t1, t2)
+        self.system.motor_targets = tuple(self._estimate)
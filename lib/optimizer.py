@@ -0,0 +1,325 @@
+"""
+Travel-order optimization for jobs that visit points in no particular order.
+
+Waypoints placed between the comment lines ``# BEGIN UNORDERED`` and
+``# END UNORDERED`` may be executed in any order. Each such block is reordered
+to minimize the time the arm takes to run it, everything else in the job is
+left untouched.
+
+A move runs for the duration D of the waypoint it goes to, or longer if a
+joint cannot cover the distance in that time at its velocity limit, so the
+cost of a move depends on its direction.
+"""
+
+from typing import Optional, TextIO
+
+import numpy as np
+
+from lib.gcode import read_gcode_line, write_gcode_line
+from lib.system import System
+
+BLOCK_BEGIN = 'BEGIN UNORDERED'
+BLOCK_END = 'END UNORDERED'
+AXES = ('X', 'Y', 'Z', 'R', 'E', 'D')
+JOINTS = ('t1', 't2', 'z', 'r')
+
+Pose = dict[str, float]
+
+
+def _marker(line: str) -> Optional[str]:
+    text = line.strip()
+    if text.startswith('#'):
+        text = text.lstrip('#').strip().upper()
+        if text in (BLOCK_BEGIN, BLOCK_END):
+            return text
+
+
+def joint_coordinates(
+    system: System, poses: list[Pose], previous: Optional[tuple[float, float]] = None, chain: bool = True
+) -> np.ndarray:
+    """
+    Convert job poses to joint coordinates.
+
+    Parameters
+    ----------
+    system: System
+        The system whose kinematics are used.
+    poses: list[Pose]
+        Fully resolved poses.
+    previous: Optional[tuple[float, float]]
+        The (t1, t2) pose used to pick the elbow configuration.
+    chain: bool
+        Whether each pose picks its configuration relative to the pose
+        before it (a trajectory) or relative to previous (a point set).
+
+    Returns
+    -------
+    np.ndarray
+        An (n, 4) array of t1, t2, z and end effector motor angles.
+    """
+    joints = np.empty((len(poses), len(JOINTS)))
+    for i, pose in enumerate(poses):
+        t1, t2 = system.cartesian_to_dual_polar(pose['X'], pose['Y'], previous)
+        joints[i] = t1, t2, pose['Z'], pose['R'] - t1
+        if chain:
+            previous = (t1, t2)
+
+    return joints
+
+
+def travel_times(system: System, joints: np.ndarray, durations: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Pairwise move times.
+
+    Every joint moves simultaneously at its velocity limit,
+    so a move takes as long as its slowest joint, and no less
+    than the duration programmed for its destination.
+
+    Parameters
+    ----------
+    system: System
+        The system whose velocity limits are used.
+    joints: np.ndarray
+        An (n, 4) array of joint coordinates.
+    durations: Optional[np.ndarray]
+        The programmed duration D of a move to each point, None for none.
+
+    Returns
+    -------
+    np.ndarray
+        An (n, n) matrix whose [i, j] element is the time in seconds
+        of the move from point i to point j.
+    """
+    cost = np.zeros((len(joints), len(joints)))
+    if durations is not None:
+        cost[:] = durations[None, :]
+
+    for axis, name in enumerate(JOINTS):
+        column = joints[:, axis]
+        np.maximum(
+            cost,
+            np.abs(column[:, None] - column[None, :]) / system.velocity_limits[name],
+            out=cost
+        )
+
+    np.fill_diagonal(cost, 0)
+
+    return cost
+
+
+def sequence_time(system: System, poses: list[Pose]) -> float:
+    """
+    Estimated time of visiting poses in the given order.
+    """
+    if len(poses) < 2:
+        return 0
+
+    joints = joint_coordinates(system, poses)
+    limits = np.array([system.velocity_limits[name] for name in JOINTS])
+    travel = (np.abs(np.diff(joints, axis=0)) / limits).max(axis=1)
+
+    return float(np.maximum(travel, [pose['D'] for pose in poses[1:]]).sum())
+
+
+def _nearest_neighbour(cost: np.ndarray, start: int, end: int) -> np.ndarray:
+    unvisited = np.ones(len(cost), dtype=bool)
+    unvisited[[start, end]] = False
+    path = [start]
+
+    while unvisited.any():
+        candidates = np.flatnonzero(unvisited)
+        node = candidates[np.argmin(cost[path[-1], candidates])]
+        unvisited[node] = False
+        path.append(node)
+
+    path.append(end)
+
+    return np.array(path)
+
+
+def _two_opt(cost: np.ndarray, path: np.ndarray) -> bool:
+    improved = False
+
+    for i in range(1, len(path) - 2):
+        a, b = path[i - 1], path[i]
+        c, e = path[i + 1:-1], path[i + 2:]
+        # Reversing path[i:j + 1] also reverses the moves within it.
+        reversal = np.cumsum(cost[path[i + 1:-1], path[i:-2]] - cost[path[i:-2], path[i + 1:-1]])
+        delta = cost[a, c] + cost[b, e] - cost[a, b] - cost[c, e] + reversal
+        j = int(np.argmin(delta))
+        if delta[j] < -1e-9:
+            j += i + 1
+            path[i:j + 1] = path[i:j + 1][::-1]
+            improved = True
+
+    return improved
+
+
+def _or_opt(cost: np.ndarray, path: np.ndarray, max_length: int = 3) -> tuple[np.ndarray, bool]:
+    improved = False
+
+    for length in range(1, max_length + 1):
+        i = 1
+        while i + length < len(path):
+            segment = path[i:i + length]
+            first, last = segment[0], segment[-1]
+            before, after = path[i - 1], path[i + length]
+            removal = cost[before, first] + cost[last, after] - cost[before, after]
+
+            rest = np.concatenate((path[:i], path[i + length:]))
+            u, v = rest[:-1], rest[1:]
+            forward = cost[u, first] + cost[last, v] - cost[u, v]
+            reversal = cost[segment[1:], segment[:-1]].sum() - cost[segment[:-1], segment[1:]].sum()
+            backward = cost[u, last] + cost[first, v] - cost[u, v] + reversal
+
+            k_f, k_b = int(np.argmin(forward)), int(np.argmin(backward))
+            if backward[k_b] < forward[k_f]:
+                k, insertion, segment = k_b, backward[k_b], segment[::-1]
+            else:
+                k, insertion = k_f, forward[k_f]
+
+            if insertion - removal < -1e-9:
+                path = np.concatenate((rest[:k + 1], segment, rest[k + 1:]))
+                improved = True
+            else:
+                i += 1
+
+    return path, improved
+
+
+def order_points(cost: np.ndarray, start: int, end: int) -> np.ndarray:
+    """
+    Find a short open path through every node of a cost matrix.
+
+    A nearest-neighbour tour is refined with 2-opt and Or-opt moves
+    until neither finds an improvement.
+
+    Parameters
+    ----------
+    cost: np.ndarray
+        An (n, n) matrix of the cost of going from each node to each other.
+    start: int
+        The node the path must start at.
+    end: int
+        The node the path must end at.
+
+    Returns
+    -------
+    np.ndarray
+        The node indices in visiting order, including start and end.
+    """
+    path = _nearest_neighbour(cost, start, end)
+
+    improved = True
+    while improved:
+        improved = _two_opt(cost, path)
+        path, moved = _or_opt(cost, path)
+        improved |= moved
+
+    return path
+
+
+def _resolve(lines: list[str], initial: Pose) -> list[Optional[Pose]]:
+    state = dict(initial)
+    poses = []
+
+    for line in lines:
+        commands = list(read_gcode_line(line))
+        if commands:
+            state.update(commands)
+            poses.append(dict(state))
+        else:
+            poses.append(None)
+
+    return poses
+
+
+def optimize_job(system: System, source: TextIO, destination: TextIO, initial: Pose) -> tuple[float, float]:
+    """
+    Reorder the unordered blocks of a job to minimize its run time.
+
+    Waypoints inside a block are rewritten as fully specified poses.
+    The first waypoint after a block is fully specified as well so the
+    axes it omits do not depend on the new order.
+
+    Parameters
+    ----------
+    system: System
+        The system whose kinematics and velocity limits form the cost model.
+    source: TextIO
+        The job to optimize.
+    destination: TextIO
+        Where the optimized job is written.
+    initial: Pose
+        The pose of the arm when the job starts, keyed by G-code axis.
+
+    Returns
+    -------
+    tuple[float, float]
+        The estimated run time of the job before and after optimization.
+    """
+    lines = source.readlines()
+    poses = _resolve(lines, initial)
+
+    def write_pose(pose: Pose) -> None:
+        write_gcode_line(destination, {axis: pose[axis] for axis in AXES})
+        destination.write('\n')
+
+    original = [dict(initial)] + [pose for pose in poses if pose is not None]
+    optimized = [dict(initial)]
+
+    state = dict(initial)
+    block: Optional[list[int]] = None
+    pin = False
+
+    for i, line in enumerate(lines):
+        marker = _marker(line)
+
+        if block is None and marker == BLOCK_BEGIN:
+            destination.write(line)
+            block = []
+            entry = dict(state)
+        elif block is not None and marker == BLOCK_END:
+            points = [poses[j] for j in block]
+            exit_pose = next((pose for pose in poses[i + 1:] if pose is not None), None)
+
+            if points:
+                nodes = points + [entry, exit_pose or entry]
+                reference = tuple(joint_coordinates(system, [entry])[0, :2])
+                cost = travel_times(
+                    system,
+                    joint_coordinates(system, nodes, reference, chain=False),
+                    np.array([node['D'] for node in nodes])
+                )
+                if exit_pose is None:
+                    cost[-1, :] = cost[:, -1] = 0
+
+                for node in order_points(cost, len(points), len(points) + 1)[1:-1]:
+                    write_pose(points[node])
+                    optimized.append(points[node])
+
+                state = dict(optimized[-1])
+
+            destination.write(line)
+            block = None
+            pin = True
+        elif block is not None:
+            if poses[i] is not None:
+                block.append(i)
+            else:
+                destination.write(line)
+        elif poses[i] is not None:
+            state = poses[i]
+            optimized.append(state)
+            if pin:
+                write_pose(state)
+                pin = False
+            else:
+                destination.write(line)
+        else:
+            destination.write(line)
+
+    if block is not None:
+        raise ValueError(f'Job ends inside an unordered block (missing "# {BLOCK_END}").')
+
+    return sequence_time(system, original), sequence_time(system, optimized)
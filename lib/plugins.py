@@ -0,0 +1,200 @@
+"""
+Lazy discovery and loading of third-party widgets.
+
+Plugins are found by parsing their source instead of importing it, so a
+heavy or broken plugin costs nothing until its menu entry is first opened.
+"""
+
+import ast
+import os
+from importlib import import_module
+from time import perf_counter
+from typing import Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from lib.widget import Widget
+
+
+class PluginSpec:
+    """
+    A widget class found in a plugin module, not yet imported.
+
+    Attributes
+    ----------
+    module: str
+        The full name of the module defining the widget.
+    class_name: str
+        The name of the widget class.
+    label: str
+        The menu label, the class attribute `label` if it is a string literal,
+        otherwise the class name.
+    description: str
+        The first line of the class docstring.
+    scan_time: float
+        How long discovery took for the module, in seconds.
+    import_time: Optional[float]
+        How long importing and instantiating took, in seconds, once loaded.
+    error: Optional[Exception]
+        Why loading failed, if it did.
+    widget: Optional[Widget]
+        The widget instance, once loaded.
+    """
+    module: str
+    class_name: str
+    label: str
+    description: str
+    scan_time: float
+    import_time: Optional[float] = None
+    error: Optional[Exception] = None
+    widget: Optional['Widget'] = None
+
+    def __init__(self, module: str, class_name: str, label: str, description: str, scan_time: float):
+        self.module = module
+        self.class_name = class_name
+        self.label = label
+        self.description = description
+        self.scan_time = scan_time
+
+
+def _is_widget(node: ast.ClassDef) -> bool:
+    """
+    Whether a class directly subclasses Widget and implements setup().
+    """
+    bases = {base.id if isinstance(base, ast.Name) else getattr(base, 'attr', None) for base in node.bases}
+    defines_setup = any(
+        isinstance(item, ast.FunctionDef) and item.name == 'setup' for item in node.body
+    )
+
+    return 'Widget' in bases and defines_setup
+
+
+def _label(node: ast.ClassDef) -> str:
+    for item in node.body:
+        if isinstance(item, ast.Assign):
+            targets = [target.id for target in item.targets if isinstance(target, ast.Name)]
+        elif isinstance(item, ast.AnnAssign) and isinstance(item.target, ast.Name) and item.value is not None:
+            targets = [item.target.id]
+        else:
+            continue
+
+        if 'label' in targets and isinstance(item.value, ast.Constant) and isinstance(item.value.value, str):
+            return item.value.value
+
+    return node.name
+
+
+def discover(directory: str, package: str) -> list[PluginSpec]:
+    """
+    Find the widget classes of every module in a directory without importing them.
+
+    Parameters
+    ----------
+    directory: str
+        The directory containing the plugin modules.
+    package: str
+        The package name of the directory.
+
+    Returns
+    -------
+    list[PluginSpec]
+        The widgets found, in module name order.
+    """
+    specs = []
+
+    for file_name in sorted(os.listdir(directory)):
+        name, extension = os.path.splitext(file_name)
+        if extension != '.py' or name.startswith('_'):
+            continue
+
+        start = perf_counter()
+
+        try:
+            with open(os.path.join(directory, file_name)) as f:
+                tree = ast.parse(f.read(), file_name)
+        except (OSError, SyntaxError) as e:
+            print(f'[WARNING] [{__name__}] Skipping plugin {file_name}: {e}')
+            continue
+
+        classes = [node for node in tree.body if isinstance(node, ast.ClassDef) and _is_widget(node)]
+        scan_time = perf_counter() - start
+
+        for node in classes:
+            docstring = ast.get_docstring(node) or ''
+            specs.append(PluginSpec(
+                f'{package}.{name}',
+                node.name,
+                _label(node),
+                docstring.strip().split('\n')[0],
+                scan_time / len(classes),
+            ))
+
+    return specs
+
+
+def load(spec: PluginSpec, parent) -> 'Widget':
+    """
+    Import a plugin and instantiate its widget, once.
+
+    Parameters
+    ----------
+    spec: PluginSpec
+        The plugin to load.
+    parent: Application
+        The application the widget controls.
+
+    Returns
+    -------
+    Widget
+        The widget, the same instance on every call.
+
+    Raises
+    ------
+    Exception
+        Whatever importing or instantiating the plugin raised.
+    """
+    if spec.widget is not None:
+        return spec.widget
+
+    start = perf_counter()
+
+    try:
+        cls = getattr(import_module(spec.module), spec.class_name)
+        spec.widget = cls(parent)
+    except Exception as e:
+        spec.error = e
+        print(f'[WARNING] [{__name__}] Failed to load plugin {spec.module}.{spec.class_name}: {e}')
+        raise
+
+    spec.import_time = perf_counter() - start
+    print(f'[INFO] [{__name__}] Loaded plugin {spec.label} in {spec.import_time * 1000:.1f} ms.')
+
+    return spec.widget
+
+
+def report(specs: list[PluginSpec]) -> str:
+    """
+    Describe the cost of every plugin so far.
+
+    Parameters
+    ----------
+    specs: list[PluginSpec]
+        The discovered plugins.
+
+    Returns
+    -------
+    str
+        One line per plugin with its discovery and import time.
+    """
+    lines = []
+
+    for spec in specs:
+        if spec.error is not None:
+            status = f'failed: {spec.error}'
+        elif spec.import_time is not None:
+            status = f'imported in {spec.import_time * 1000:.1f} ms'
+        else:
+            status = 'not imported'
+
+        lines.append(f'{spec.label} ({spec.module}): scanned in {spec.scan_time * 1000:.1f} ms, {status}')
+
+    return '\n'.join(lines)
@@ -0,0 +1,94 @@
+"""
+Startup phase timing.
+
+Startup phases run concurrently on several threads, so the report shows
+when each phase started and ended relative to process start rather than
+only how long it took.
+"""
+
+from contextlib import contextmanager
+from threading import Lock, current_thread
+from time import perf_counter
+from typing import Iterator, NamedTuple, Optional
+
+
+class Phase(NamedTuple):
+    name: str
+    thread: str
+    start: float
+    end: float
+
+
+class StartupProfiler:
+    """
+    Records startup phases and the time until the application is ready.
+
+    Attributes
+    ----------
+    phases: list[Phase]
+        The finished phases, times in seconds since the profiler was created.
+    time_to_ready: Optional[float]
+        Seconds from the profiler's creation until ready() was called.
+    """
+    phases: list[Phase]
+    time_to_ready: Optional[float] = None
+
+    def __init__(self):
+        self._start = perf_counter()
+        self._lock = Lock()
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Time a block of code as a startup phase.
+
+        Parameters
+        ----------
+        name: str
+            The name of the phase.
+        """
+        start = perf_counter() - self._start
+
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases.append(Phase(name, current_thread().name, start, perf_counter() - self._start))
+
+    def ready(self) -> None:
+        """
+        Mark the application as ready for use and print the report.
+        """
+        self.time_to_ready = perf_counter() - self._start
+        print(f'[INFO] [{__name__}] Startup:\n{self.report()}')
+
+    def report(self) -> str:
+        """
+        Describe every phase and the time to ready.
+
+        Returns
+        -------
+        str
+            One line per phase in start order, then the totals.
+        """
+        with self._lock:
+            phases = sorted(self.phases, key=lambda phase: phase.start)
+
+        lines = [
+            f'{phase.name:<14} {phase.thread:<12} {phase.start * 1000:8.0f} -> {phase.end * 1000:8.0f} ms'
+            + f' ({(phase.end - phase.start) * 1000:.0f} ms)'
+            for phase in phases
+        ]
+
+        total = sum(phase.end - phase.start for phase in phases)
+        lines.append(f'Sum of phases: {total * 1000:.0f} ms')
+
+        if self.time_to_ready is not None:
+            lines.append(f'Time to ready: {self.time_to_ready * 1000:.0f} ms')
+
+        return '\n'.join(lines)
+
+
+# Created on first import, main imports this module before anything else.
+startup = StartupProfiler()
@@ -0,0 +1,333 @@
+"""
+A shared memory channel for processes on the same machine.
+
+The application publishes the latest joint state, targets and job status
+into a named shared memory block, and takes setpoints from a single slot
+in the same block. Local tools attach to it without serial or socket
+round trips:
+
+    channel = SharedChannel()
+    state = channel.state()
+    channel.post(x=15, y=10, z=80, r=0, e=50)
+
+Both the state and the setpoint slot are protected by a seqlock: the
+writer makes the sequence number odd while it writes, and readers retry
+until they copy the slot with the same even sequence number before and
+after. There is one writer per slot, the application for the state and
+a single client process for the setpoint.
+
+A writer killed mid-write leaves the sequence number odd, so readers only
+retry for a bounded time, and the next writer of the slot makes it even
+again before writing.
+"""
+
+from multiprocessing import resource_tracker, shared_memory
+from threading import Lock, Thread
+from time import perf_counter, sleep, time
+from typing import Callable, NamedTuple, Optional, get_args
+
+import numpy as np
+
+from lib.job import Status
+from lib.motion import MotionThread
+from lib.system import System
+from lib.telemetry import POSITION, TARGET, Sample, Telemetry
+
+NAME = 'scara_arm'
+MAGIC = 0x53434152
+VERSION = 1
+JOB_STATUSES = ('none', *get_args(Status))
+
+HEADER = np.dtype([('magic', '<u4'), ('version', '<u4')])
+STATE = np.dtype([
+    ('sequence', '<u8'),
+    ('timestamp', '<f8'),
+    ('positions', '<f8', 4),
+    ('targets', '<f8', 4),
+    ('cartesian', '<f8', 2),
+    ('job_status', '<i4'),
+    ('job_progress', '<i4'),
+    ('job_length', '<i4'),
+])
+SETPOINT = np.dtype([
+    ('sequence', '<u8'),
+    ('count', '<u8'),
+    ('timestamp', '<f8'),
+    ('target', '<f8', 5),
+])
+# Slots start on separate cache lines.
+STATE_OFFSET = 64
+SETPOINT_OFFSET = STATE_OFFSET + -(-STATE.itemsize // 64) * 64
+SIZE = SETPOINT_OFFSET + -(-SETPOINT.itemsize // 64) * 64
+
+
+class SharedState(NamedTuple):
+    """
+    A consistent copy of the published state.
+
+    Attributes
+    ----------
+    timestamp: float
+        When the state was acquired.
+    positions: tuple[float, float, float, float]
+        The t1, t2, z, r joint positions, r relative to t1.
+    targets: tuple[float, float, float, float]
+        The last t1, t2, z, r joint targets, r relative to t1.
+    x: float
+        The x-coordinate of the end effector.
+    y: float
+        The y-coordinate of the end effector.
+    job_status: str
+        The status of the current job, 'none' without one.
+    job_progress: int
+        The number of waypoints of the current job completed.
+    job_length: int
+        The number of waypoints of the current job.
+    """
+    timestamp: float
+    positions: tuple[float, float, float, float]
+    targets: tuple[float, float, float, float]
+    x: float
+    y: float
+    job_status: str
+    job_progress: int
+    job_length: int
+
+
+def _write(slot: np.ndarray, **fields) -> None:
+    # An odd sequence number here was left by a writer which died mid-write.
+    slot['sequence'] += 1 + (int(slot['sequence']) & 1)
+    for name, value in fields.items():
+        slot[name] = value
+    slot['sequence'] += 1
+
+
+def _read(slot: np.ndarray, timeout: float) -> Optional[np.ndarray]:
+    deadline = None
+
+    while True:
+        before = int(slot['sequence'])
+        if not before & 1:
+            copy = slot.copy()
+            if int(slot['sequence']) == before:
+                return copy
+
+        if deadline is None:
+            deadline = perf_counter() + timeout
+        elif perf_counter() >= deadline:
+            return None
+
+        sleep(0)
+
+
+class SharedChannel:
+    """
+    The shared memory block, from either side.
+    """
+
+    def __init__(self, name: str = NAME, create: bool = False):
+        """
+        Parameters
+        ----------
+        name: str
+            The name of the shared memory block.
+        create: bool
+            Create the block, as the application, rather than attach to it.
+
+        Raises
+        ------
+        FileNotFoundError
+            If attaching and the block does not exist.
+        FileExistsError
+            If creating and the block already exists.
+        ValueError
+            If the block does not hold a channel of this version.
+        """
+        self.memory = shared_memory.SharedMemory(name, create=create, size=SIZE if create else 0)
+        self.created = create
+
+        if not create:
+            # Before Python 3.13 attaching registers the block for removal when this process exits.
+            resource_tracker.unregister(self.memory._name, 'shared_memory')
+
+        self._header = np.ndarray((), HEADER, self.memory.buf, 0)
+        self._state = np.ndarray((), STATE, self.memory.buf, STATE_OFFSET)
+        self._setpoint = np.ndarray((), SETPOINT, self.memory.buf, SETPOINT_OFFSET)
+        self._taken = 0
+
+        if create:
+            self._header['magic'] = MAGIC
+            self._header['version'] = VERSION
+        elif (self._header['magic'], self._header['version']) != (MAGIC, VERSION):
+            self.close()
+            raise ValueError(f'Shared memory {name!r} does not hold a version {VERSION} channel.')
+
+    def publish(self, timestamp: float, positions: tuple[float, ...], targets: tuple[float, ...],
+                cartesian: tuple[float, float], job_status: str = 'none', job_progress: int = 0,
+                job_length: int = 0) -> None:
+        """
+        Replace the published state. Only the application calls this.
+        """
+        _write(
+            self._state,
+            timestamp=timestamp,
+            positions=positions,
+            targets=targets,
+            cartesian=cartesian,
+            job_status=JOB_STATUSES.index(job_status),
+            job_progress=job_progress,
+            job_length=job_length,
+        )
+
+    def state(self, timeout: float = 0.01) -> SharedState:
+        """
+        A consistent copy of the latest published state.
+
+        Parameters
+        ----------
+        timeout: float
+            How long to retry while the state is being written.
+
+        Raises
+        ------
+        TimeoutError
+            If the state was being written for the whole timeout,
+            which happens if the application died mid-write.
+        """
+        state = _read(self._state, timeout)
+        if state is None:
+            raise TimeoutError(f'The shared state was being written for over {timeout} s.')
+
+        return SharedState(
+            float(state['timestamp']),
+            tuple(state['positions'].tolist()),
+            tuple(state['targets'].tolist()),
+            *state['cartesian'].tolist(),
+            JOB_STATUSES[int(state['job_status'])],
+            int(state['job_progress']),
+            int(state['job_length']),
+        )
+
+    def post(self, x: float, y: float, z: float, r: float, e: int) -> None:
+        """
+        Request a realtime move, replacing any setpoint not taken yet.
+        Only one client process may post.
+        """
+        _write(
+            self._setpoint,
+            count=self._setpoint['count'] + 1,
+            timestamp=time(),
+            target=(x, y, z, r, e),
+        )
+
+    def take(self) -> Optional[tuple[float, float, float, float, int]]:
+        """
+        The setpoint posted since the last call, if any. Only the application calls this.
+
+        A setpoint being written is taken at a later call. The slot is not
+        waited on, so a client which died mid-write cannot block the caller.
+        """
+        setpoint = _read(self._setpoint, 0)
+        if setpoint is None or setpoint['count'] == self._taken:
+            return None
+
+        self._taken = int(setpoint['count'])
+        x, y, z, r, e = setpoint['target'].tolist()
+        return x, y, z, r, round(e)
+
+    def close(self) -> None:
+        """
+        Detach from the block, and remove it if this side created it.
+        """
+        del self._header, self._state, self._setpoint
+        self.memory.close()
+
+        if self.created:
+            self.memory.unlink()
+
+
+class SharedStateServer:
+    """
+    Publishes every telemetry sample to the channel and sends posted setpoints
+    to the motion thread.
+
+    Attributes
+    ----------
+    rate: float
+        How many times per second the setpoint slot is checked.
+    """
+    rate: float
+    running: bool = False
+
+    def __init__(self, system: System, telemetry: Telemetry, motion: MotionThread,
+                 job: Callable[[], tuple[str, int, int]], rate: float = 100, name: str = NAME):
+        """
+        Parameters
+        ----------
+        system: System
+            The system whose state is published.
+        telemetry: Telemetry
+            The acquisition stream the state comes from.
+        motion: MotionThread
+            Where setpoints are sent.
+        job: Callable[[], tuple[str, int, int]]
+            Returns the status, progress and length of the current job.
+        rate: float
+            How many times per second the setpoint slot is checked.
+        name: str
+            The name of the shared memory block.
+
+        Raises
+        ------
+        FileExistsError
+            If the block already exists.
+        """
+        self.system = system
+        self.telemetry = telemetry
+        self.motion = motion
+        self.job = job
+        self.rate = rate
+        self.channel = SharedChannel(name, create=True)
+        # The acquisition thread may still call _publish() with a listener list copied before stop().
+        self._lock = Lock()
+
+        self.running = True
+        self.telemetry.acquire(POSITION, TARGET)
+        self.telemetry.add_listener(self._publish)
+        Thread(target=self._take_loop, daemon=True).start()
+
+    def _publish(self, sample: Sample) -> None:
+        if POSITION not in sample.values or TARGET not in sample.values:
+            return
+
+        positions = sample.values[POSITION]
+
+        with self._lock:
+            if not self.running:
+                return
+
+            self.channel.publish(
+                sample.timestamp,
+                positions,
+                sample.values[TARGET],
+                self.system.polar_to_cartesian(positions[0], positions[1]),
+                *self.job(),
+            )
+
+    def _take_loop(self) -> None:
+        while self.running:
+            setpoint = self.channel.take()
+            if setpoint is not None:
+                self.motion.post(*setpoint)
+
+            sleep(1 / self.rate)
+
+        with self._lock:
+            self.channel.close()
+
+    def stop(self) -> None:
+        self.telemetry.remove_listener(self._publish)
+        self.telemetry.release(POSITION, TARGET)
+
+        with self._lock:
+            self.running = False
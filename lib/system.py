@@ -1,6 +1,7 @@
 import math
 import os.path
 import serial
+import numpy as np
 from serial.tools.list_ports import comports
 from time import time, sleep
 from typing import Optional, Callable
@@ -12,6 +13,8 @@ from hardware.end_effector import EndEffectorException
 from hardware.FOC_BLDC_end_effector import FOCBLDC as EndEffector
 
 from lib.bezier import bezier
+from lib.calibration import AxisState, CalibrationStore, MotorCalibration, save_warm_start
+from lib.homing import Homing, wait_for_stall
 
 class JogError(Exception):
     ...
@@ -39,6 +42,17 @@ class System:
     l1: float = 15.5
     l2: float = 14.7
     minimum_radius: float = 15
+    # Joint velocity limits (rad/s). 'z' is not enforced by the controller,
+    # it is an estimate used for planning only.
+    velocity_limits: dict[str, float] = {'t1': 4, 't2': 4, 'z': 20, 'r': 12}
+    # Calibrated joint ranges (rad), relative to the joint zero.
+    joint_limits: dict[str, tuple[float, float]] = {}
+    # The last (t1, t2) pose sent to the motors.
+    joint_target: Optional[tuple[float, float]] = None
+    # The last targets sent to the motors, in joints order and motor frame.
+    motor_targets: Optional[tuple[float, float, float, float]] = None
+    # The largest raw encoder change since shutdown for which an axis is not homed again.
+    warm_start_tolerance: float = 0.05
 
     def __init__(self):
         """
@@ -102,65 +116,154 @@ class System:
         self.m_vertical.set_PIDs('angle', 10)
 
         self.m_inner_rot.set_voltage_limit(12)
-        self.m_inner_rot.set_velocity_limit(4)
+        self.m_inner_rot.set_velocity_limit(self.velocity_limits['t1'])
         self.m_inner_rot.set_PIDs('vel', 2, 20, R=200, F=0.01)
         self.m_inner_rot.set_PIDs('angle', 20, D=4, R=125, F=0.01)
 
         self.m_outer_rot.set_voltage_limit(12)
-        self.m_outer_rot.set_velocity_limit(4)
+        self.m_outer_rot.set_velocity_limit(self.velocity_limits['t2'])
         self.m_outer_rot.set_PIDs('vel', 0.6, 20, F=0.01)
         self.m_outer_rot.set_PIDs('angle', 20, D=3, R=100, F=0.01)
 
         self.m_end_rot.set_voltage_limit(3)
-        self.m_end_rot.set_velocity_limit(12)
+        self.m_end_rot.set_velocity_limit(self.velocity_limits['r'])
 
 
-    def load_motors(self, onFail: Optional[Callable] = None):
+    @staticmethod
+    def read_calibration() -> CalibrationStore:
+        """
+        Read the motor calibration from disk.
+
+        Needs no hardware, so it can run while the system is connecting.
+
+        Returns
+        -------
+        CalibrationStore
+            The validated calibration of every calibrated motor.
+
+        Raises
+        ------
+        OSError
+            If the calibration could not be read.
+        ValueError
+            If the calibration is corrupted.
+        """
+        return CalibrationStore.load()
+
+    def load_motors(self, onFail: Optional[Callable] = None, calibration: Optional[CalibrationStore] = None,
+                    warm_start: Optional[dict[str, AxisState]] = None):
         """
         Load motor calibration from disk.
 
         *This function will cause movement.
 
+        The vertical axis and the end effector are not driven into their
+        end stops if their encoders have not moved since the homing
+        results in warm_start were saved.
+
         Parameters
         ----------
         onFail: Optional[Callable]
             Callback for if files are not found or corrupted.
+        calibration: Optional[CalibrationStore]
+            The calibration already read by read_calibration(), read from disk if None.
+        warm_start: Optional[dict[str, AxisState]]
+            The homing results saved at the last shutdown, by axis.
         """
+        homing = Homing()
+        warm_start = warm_start or {}
+
+        def home_vertical():
+            if self._resume(self.m_vertical, warm_start.get('z')):
+                self.m_vertical.set_control_mode('angle')
+                self.m_vertical.move(160/2)
+                self.m_vertical.enable()
+            else:
+                self.single_ended_home(self.m_vertical, 160/2, -4)
 
+        def home_end_effector():
+            self.end_effector.enable()
+            motor = self.end_effector.m
 
-        self.single_ended_home(self.m_vertical, 160/2, -4)
-        self.end_effector.enable()
-        self.auto_calibrate(
-            self.end_effector.m, voltage=2, speed=15, zeroSpeed=10
-        )
-        self.end_effector.m.set_voltage_limit(6)
-        self.end_effector.m.set_velocity_limit(999)
+            if self._resume(motor, warm_start.get('e')):
+                motor.set_control_mode('angle')
+                motor.move(0)
+                motor.enable()
+            else:
+                self.auto_calibrate(motor, voltage=2, speed=15, zeroSpeed=10)
+
+            motor.set_voltage_limit(6)
+            motor.set_velocity_limit(999)
+
+        # The vertical axis and the end effector are independent of everything else,
+        # the arm only swings to its center once it is at a known height.
+        homing.add('z', home_vertical)
+        homing.add('e', home_end_effector)
 
         try:
-            with open('config/inner_rot', 'r') as f:
-                self.absolute_home(
-                    self.m_inner_rot, *(float(f.readline().strip())
-                                        for _ in range(3))
-                )
+            if calibration is None:
+                calibration = self.read_calibration()
 
-            with open('config/outer_rot', 'r') as f:
-                self.absolute_home(
-                    self.m_outer_rot, *(float(f.readline().strip())
-                                        for _ in range(3))
-                )
+            rotary = {name: calibration[self.joints[name].m_id] for name in ('t1', 't2', 'r')}
+        except (OSError, ValueError, KeyError):
+            rotary = None
 
-            with open('config/end_rot', 'r') as f:
-                self.absolute_home(
-                    self.m_end_rot, *(float(f.readline().strip())
-                                      for _ in range(3))
-                )
-        except (FileNotFoundError, ValueError):
+        if rotary is not None:
+            for name in rotary:
+                homing.add(name, lambda name=name: self._home_rotary(name, rotary[name]), after=('z',))
+
+        try:
+            homing.run()
+        finally:
+            print(f'[INFO] [{__name__}] Homing:\n{homing.report()}')
+
+        if rotary is None:
             if onFail is not None:
                 onFail()
             else:
                 msg = 'Failed to load motor config from disk.'
                 raise NotImplementedError()
-        
+
+    def _resume(self, motor: Motor, state: Optional[AxisState]) -> bool:
+        """
+        Restore the offset of a motor from the last shutdown, if it has not moved since.
+        """
+        if state is None:
+            return False
+
+        moved = abs(motor.position + motor.offset - state.raw)
+        if moved > self.warm_start_tolerance:
+            print(f'[INFO] [{__name__}] Motor {motor.m_id} moved by {moved:.3f} since shutdown, homing it.')
+            return False
+
+        motor.offset = state.offset
+        print(f'[INFO] [{__name__}] Motor {motor.m_id} resumed without homing.')
+        return True
+
+    def save_warm_start(self) -> None:
+        """
+        Save the homing results of the vertical axis and the end effector,
+        for the next start to skip homing them.
+
+        Call only once homed, at shutdown.
+        """
+        try:
+            save_warm_start({
+                name: AxisState(motor.offset, motor.position + motor.offset)
+                for name, motor in (('z', self.m_vertical), ('e', self.end_effector.m))
+            })
+        except (MotorException, OSError) as e:
+            print(f'[WARNING] [{__name__}] Failed to save the warm start state: {e}')
+
+    def _home_rotary(self, name: str, calibration: MotorCalibration) -> None:
+        motor = self.joints[name]
+        low, high, center = calibration[:3]
+
+        for stage, gains in (calibration.pids or {}).items():
+            motor.set_PIDs(stage, **gains)
+
+        self.absolute_home(motor, low, high, center)
+        self.joint_limits[name] = (low - center, high - center)
 
     def motors_enabled(self, value: bool):
         """
@@ -207,10 +310,7 @@ class System:
             motor.move(-speed)
             motor.enable()
 
-            sleep(1)
-
-            while abs(motor.velocity) > zeroSpeed:
-                sleep(0.1)
+            wait_for_stall(motor, zeroSpeed)
 
             motor.move(0)
 
@@ -218,10 +318,7 @@ class System:
 
             motor.move(speed)
 
-            sleep(1)
-
-            while abs(motor.velocity) > zeroSpeed:
-                sleep(0.1)
+            wait_for_stall(motor, zeroSpeed)
 
             motor.move(0)
 
@@ -300,10 +397,7 @@ class System:
             motor.move(voltage)
             motor.enable()
 
-            sleep(1)
-
-            while abs(motor.velocity) > zeroSpeed:
-                sleep(0.1)
+            wait_for_stall(motor, zeroSpeed)
 
             motor.move(0)
 
@@ -340,11 +434,32 @@ class System:
             -t2 - t1
         ), self.l1 * math.sin(t1) + self.l2 * math.sin(t2 + t1)
 
-    def cartesian_to_dual_polar(self, x: float, y: float):
+    def polar_to_cartesian_array(self, t1: np.ndarray, t2: np.ndarray) -> np.ndarray:
         """
-        Convert cartesian coordinates to cascaded polar coordinates.
+        Convert many polar coordinates to cartesian at once.
 
-        (x, y) -> (t1, t2)
+        Parameters
+        ----------
+        t1: np.ndarray
+            The angles of the first motor.
+        t2: np.ndarray
+            The angles of the second motor.
+
+        Returns
+        -------
+        np.ndarray
+            An (n, 2) array of end effector x and y coordinates.
+        """
+        return np.column_stack((
+            self.l1 * np.cos(t1) + self.l2 * np.cos(t1 + t2),
+            self.l1 * np.sin(t1) + self.l2 * np.sin(t1 + t2),
+        ))
+
+    def inverse_kinematics(self, x: float, y: float) -> tuple[tuple[float, float], tuple[float, float]]:
+        """
+        Compute both joint solutions for a cartesian position.
+
+        (x, y) -> ((t1, t2), (t1, t2))
 
         Parameters
         ----------
@@ -355,19 +470,20 @@ class System:
 
         Returns
         -------
-        tuple[float, float]
-            The angle of the first motor and the angle of the second motor.
+        tuple[tuple[float, float], tuple[float, float]]
+            The solution with a positive elbow angle (t2 >= 0)
+            and the solution with a negative elbow angle.
         """
         r = abs(complex(x, y))
         a = math.atan2(y, x)
 
         if r <= self.minimum_radius:
-            return self.cartesian_to_dual_polar(
+            return self.inverse_kinematics(
                 (self.minimum_radius + 0.1) * math.cos(a),
                 (self.minimum_radius + 0.1) * math.sin(a),
             )
         elif r > self.l1 + self.l2:
-            return a, 0
+            return (a, 0), (a, 0)
 
         # This section is adapted by Daniel from the original inverse kinematics math by Adin.
         # start
@@ -377,15 +493,151 @@ class System:
         t2 = math.pi - math.acos(
             (self.l1 ** 2 + self.l2 ** 2 - r ** 2) / (2 * self.l1 * self.l2)
         )
-        if y >= 0:
-            acos_value = -acos_value
-        else:
-            t2 = -t2
-
-        t1 = a + acos_value
         # end
 
-        return t1, t2
+        return (a - acos_value, t2), (a + acos_value, -t2)
+
+    def cartesian_to_dual_polar(
+        self, x: float, y: float, previous: Optional[tuple[float, float]] = None
+    ) -> tuple[float, float]:
+        """
+        Convert cartesian coordinates to cascaded polar coordinates.
+
+        (x, y) -> (t1, t2)
+
+        Without a previous pose the elbow configuration is chosen
+        from the sign of y. With a previous pose the configuration
+        which requires the least joint motion is chosen, so a path
+        crossing y = 0 does not swing the elbow over.
+
+        Parameters
+        ----------
+        x: float
+            The x-coordinate of the end effector.
+        y: float
+            The y-coordinate of the end effector.
+        previous: Optional[tuple[float, float]]
+            The (t1, t2) pose the arm is moving from.
+
+        Returns
+        -------
+        tuple[float, float]
+            The angle of the first motor and the angle of the second motor.
+        """
+        positive, negative = self.inverse_kinematics(x, y)
+
+        if previous is None:
+            return positive if y >= 0 else negative
+
+        solutions = [
+            solution for solution in (positive, negative) if self._within_limits(solution)
+        ] or [positive, negative]
+
+        return min(solutions, key=lambda solution: self.joint_travel_time(previous, solution))
+
+    def _within_limits(self, solution: tuple[float, float]) -> bool:
+        for name, angle in zip(('t1', 't2'), solution):
+            if name in self.joint_limits:
+                low, high = self.joint_limits[name]
+                if not low <= angle <= high:
+                    return False
+
+        return True
+
+    def joint_travel_time(self, start: tuple[float, float], end: tuple[float, float]) -> float:
+        """
+        Estimate the time to move t1 and t2 between two poses
+        at their velocity limits.
+
+        Parameters
+        ----------
+        start: tuple[float, float]
+            The starting (t1, t2) pose.
+        end: tuple[float, float]
+            The final (t1, t2) pose.
+
+        Returns
+        -------
+        float
+            The travel time of the slowest joint.
+        """
+        return max(
+            abs(e - s) / self.velocity_limits[name]
+            for name, s, e in zip(('t1', 't2'), start, end)
+        )
+
+    def jacobian(self, t1: float, t2: float) -> tuple[tuple[float, float], tuple[float, float]]:
+        """
+        The partial derivatives of the end effector position with respect to the joint angles.
+
+        Parameters
+        ----------
+        t1: float
+            The angle of the first motor.
+        t2: float
+            The angle of the second motor.
+
+        Returns
+        -------
+        tuple[tuple[float, float], tuple[float, float]]
+            ((dx/dt1, dx/dt2), (dy/dt1, dy/dt2)).
+        """
+        s1, c1 = math.sin(t1), math.cos(t1)
+        s12, c12 = math.sin(t1 + t2), math.cos(t1 + t2)
+
+        return (
+            (-self.l1 * s1 - self.l2 * s12, -self.l2 * s12),
+            (self.l1 * c1 + self.l2 * c12, self.l2 * c12),
+        )
+
+    def cartesian_to_joint_velocity(
+        self, t1: float, t2: float, vx: float, vy: float, damping: float = 1, threshold: float = 0.1
+    ) -> tuple[float, float]:
+        """
+        Convert an end effector velocity to joint velocities at a pose.
+
+        Uses the damped least squares inverse of the Jacobian. The damping
+        is zero, giving the exact inverse, while the manipulability |det J|
+        is above threshold * l1 * l2, and ramps up to its maximum at the
+        fully extended singularity, where the result stays bounded.
+
+        Parameters
+        ----------
+        t1: float
+            The angle of the first motor.
+        t2: float
+            The angle of the second motor.
+        vx: float
+            The x velocity of the end effector.
+        vy: float
+            The y velocity of the end effector.
+        damping: float
+            The damping factor at the singularity, in length units.
+        threshold: float
+            The fraction of the largest manipulability below which damping is applied.
+
+        Returns
+        -------
+        tuple[float, float]
+            The velocities of the first and second motor.
+        """
+        (a, b), (c, d) = self.jacobian(t1, t2)
+
+        # det J = l1 l2 sin(t2), so the manipulability is at most l1 l2.
+        limit = threshold * self.l1 * self.l2
+        manipulability = abs(a * d - b * c)
+        damping = damping * max(0, 1 - manipulability / limit) if limit > 0 else 0
+
+        # (J^T J + damping^2 I)^-1 J^T v, with the 2x2 inverse written out.
+        p = a * a + c * c + damping ** 2
+        q = a * b + c * d
+        r = b * b + d * d + damping ** 2
+        det = p * r - q * q
+
+        u = a * vx + c * vy
+        v = b * vx + d * vy
+
+        return (r * u - q * v) / det, (p * v - q * u) / det
 
     def get_all_pos(self):
         """
@@ -427,6 +679,9 @@ class System:
         self.joints['t2'].move(t2)
         self.joints['z'].move(z)
 
+        self.joint_target = (t1, t2)
+        self.motor_targets = (t1, t2, z, r - t1)
+
         if e is not None:
             self.end_effector.move(e)
 
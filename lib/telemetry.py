@@ -0,0 +1,361 @@
+"""
+Shared acquisition of motor state.
+
+Reading motor state costs a serial round trip per value, and the serial
+bus is shared with motion commands. Instead of every consumer polling the
+motors on its own, consumers register the channels they need with a single
+Telemetry stream and read its latest sample.
+"""
+
+from collections import Counter
+from threading import Thread, Condition
+from time import sleep, time
+from types import MappingProxyType
+from typing import Callable, Mapping, NamedTuple, Optional
+
+import numpy as np
+
+from hardware.FOCMC_interface import MotorException
+
+from lib.system import System
+
+POSITION = 'MMG6'
+VELOCITY = 'MMG5'
+TORQUE = 'MMG1'
+# The last commanded motor targets, known without asking the motors.
+TARGET = 'target'
+
+
+class RingBuffer:
+    """
+    A fixed-capacity history of rows backed by a NumPy array.
+
+    Appending never allocates, once full the oldest rows are overwritten.
+    """
+
+    def __init__(self, capacity: int, width: int = 1):
+        """
+        Parameters
+        ----------
+        capacity: int
+            The maximum number of rows kept.
+        width: int
+            The number of values per row.
+        """
+        self._data = np.zeros((capacity, width))
+        self._index = 0
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def capacity(self) -> int:
+        return len(self._data)
+
+    def append(self, row) -> None:
+        """
+        Add a row, overwriting the oldest one if full.
+
+        Parameters
+        ----------
+        row: ArrayLike
+            The values of the row.
+        """
+        self._data[self._index] = row
+        self._index = (self._index + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def clear(self) -> None:
+        self._index = 0
+        self._count = 0
+
+    def view(self) -> np.ndarray:
+        """
+        The rows from oldest to newest.
+
+        Returns
+        -------
+        np.ndarray
+            A (len, width) array.
+        """
+        if self._count < self.capacity:
+            return self._data[:self._count]
+
+        return np.concatenate((self._data[self._index:], self._data[:self._index]))
+
+
+class Sample(NamedTuple):
+    """
+    One acquisition of every requested channel.
+
+    Attributes
+    ----------
+    timestamp: float
+        When the acquisition finished.
+    values: Mapping[str, tuple[float, ...]]
+        The value of each channel for every joint, in System.joints order.
+        Positions are relative to the joint zero.
+    """
+    timestamp: float
+    values: Mapping[str, tuple[float, ...]]
+
+
+class Snapshot(NamedTuple):
+    """
+    The joint and cartesian state of the arm at one time.
+
+    Attributes
+    ----------
+    timestamp: float
+        When the positions were acquired.
+    joints: tuple[float, float, float, float]
+        The t1, t2, z, r positions, r relative to t1.
+    x: float
+        The x-coordinate of the end effector.
+    y: float
+        The y-coordinate of the end effector.
+    z: float
+        The z-coordinate of the end effector.
+    r: float
+        The rotation of the end effector relative to the world.
+    """
+    timestamp: float
+    joints: tuple[float, float, float, float]
+    x: float
+    y: float
+    z: float
+    r: float
+
+    @classmethod
+    def from_sample(cls, sample: Sample, system: System) -> 'Snapshot':
+        """
+        Parameters
+        ----------
+        sample: Sample
+            A sample with the POSITION channel.
+        system: System
+            The system the sample was acquired from.
+        """
+        t1, t2, z, r = sample.values[POSITION]
+        x, y = system.polar_to_cartesian(t1, t2)
+
+        return cls(sample.timestamp, (t1, t2, z, r), x, y, z, r + t1)
+
+
+class Subscription:
+    """
+    Delivers samples of a telemetry stream to a callback at a limited rate.
+
+    The callback runs on the acquisition thread and must return quickly.
+    """
+
+    def __init__(self, telemetry: 'Telemetry', callback: Callable[[Sample], None],
+                 channels: tuple[str, ...], rate: float):
+        self.telemetry = telemetry
+        self.callback = callback
+        self.channels = channels
+        self.rate = rate
+        self._last = 0.0
+
+        telemetry.acquire(*channels, rate=rate)
+        telemetry.add_listener(self._on_sample)
+
+    def _on_sample(self, sample: Sample) -> None:
+        # Faster streams are decimated, with slack for the jitter of the acquisition loop.
+        if sample.timestamp - self._last < 1 / self.rate - 0.5 / self.telemetry.effective_rate:
+            return
+        if not all(channel in sample.values for channel in self.channels):
+            return
+
+        self._last = sample.timestamp
+        self.callback(sample)
+
+    def cancel(self) -> None:
+        """
+        Stop the deliveries and release the channels.
+        """
+        self.telemetry.remove_listener(self._on_sample)
+        self.telemetry.release(*self.channels, rate=self.rate)
+
+
+class Telemetry:
+    """
+    A single acquisition stream of motor state shared by every consumer.
+
+    The stream only reads the channels which at least one consumer has
+    acquired, and is idle when there are none. It runs at the highest rate
+    requested by a consumer, or at the base rate if that is higher.
+
+    Attributes
+    ----------
+    rate: float
+        The base number of samples acquired per second.
+    sample: Optional[Sample]
+        The latest sample.
+    """
+    rate: float
+    sample: Optional[Sample] = None
+
+    def __init__(self, system: System, rate: float = 20):
+        """
+        Parameters
+        ----------
+        system: System
+            The system to monitor.
+        rate: float
+            The maximum number of samples acquired per second.
+        """
+        self.system = system
+        self.rate = rate
+        self._channels: Counter[str] = Counter()
+        self._rates: Counter[float] = Counter()
+        self._listeners: list[Callable[[Sample], None]] = []
+        self._condition = Condition()
+
+        Thread(target=self._loop, daemon=True).start()
+
+    @property
+    def effective_rate(self) -> float:
+        return max((self.rate, *self._rates))
+
+    def acquire(self, *channels: str, rate: Optional[float] = None) -> None:
+        """
+        Start acquiring channels on behalf of a consumer.
+
+        Parameters
+        ----------
+        *channels: str
+            Motor commands returning a float, such as 'MMG6', or TARGET.
+        rate: Optional[float]
+            The number of samples per second the consumer needs.
+        """
+        with self._condition:
+            self._channels.update(channels)
+            if rate is not None:
+                self._rates[rate] += 1
+            self._condition.notify_all()
+
+    def release(self, *channels: str, rate: Optional[float] = None) -> None:
+        """
+        Stop acquiring channels on behalf of a consumer.
+
+        Parameters
+        ----------
+        *channels: str
+            Channels previously passed to acquire().
+        rate: Optional[float]
+            The rate previously passed to acquire().
+        """
+        with self._condition:
+            self._channels.subtract(channels)
+            self._channels = +self._channels
+            if rate is not None:
+                self._rates[rate] -= 1
+                self._rates = +self._rates
+
+    def add_listener(self, callback: Callable[[Sample], None]) -> None:
+        """
+        Call a function with every new sample.
+
+        The callback runs on the acquisition thread and must return quickly.
+        Exceptions it raises are logged and ignored.
+
+        Parameters
+        ----------
+        callback: Callable[[Sample], None]
+            The function to call.
+        """
+        with self._condition:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback: Callable[[Sample], None]) -> None:
+        with self._condition:
+            self._listeners.remove(callback)
+
+    def subscribe(self, callback: Callable[[Sample], None], *channels: str, rate: float) -> Subscription:
+        """
+        Acquire channels and call a function with samples at a given rate.
+
+        Parameters
+        ----------
+        callback: Callable[[Sample], None]
+            The function to call, on the acquisition thread.
+        *channels: str
+            The channels the samples must contain.
+        rate: float
+            The number of samples per second delivered.
+
+        Returns
+        -------
+        Subscription
+            Cancel it to stop the deliveries.
+        """
+        return Subscription(self, callback, channels, rate)
+
+    def wait(self, channel: str, newer_than: float = 0, timeout: Optional[float] = None) -> Optional[Sample]:
+        """
+        Wait for a sample of a channel, which must be acquired by someone.
+
+        Parameters
+        ----------
+        channel: str
+            The channel the sample must contain.
+        newer_than: float
+            The time the sample must be acquired after.
+        timeout: Optional[float]
+            How long to wait, forever if None.
+
+        Returns
+        -------
+        Optional[Sample]
+            The sample, or None if the wait timed out.
+        """
+        def ready() -> bool:
+            sample = self.sample
+            return sample is not None and sample.timestamp > newer_than and channel in sample.values
+
+        with self._condition:
+            if not self._condition.wait_for(ready, timeout):
+                return None
+
+            return self.sample
+
+    def _read(self, channel: str) -> tuple[float, ...]:
+        if channel == TARGET:
+            return self.system.motor_targets or (float('nan'),) * len(self.system.joints)
+
+        if channel == POSITION:
+            return tuple(motor.position for motor in self.system.joints.values())
+
+        return tuple(motor._send_command(channel, float) for motor in self.system.joints.values())
+
+    def _loop(self) -> None:
+        while True:
+            with self._condition:
+                while not self._channels:
+                    self._condition.wait()
+
+                channels = tuple(self._channels)
+                listeners = tuple(self._listeners)
+                period = 1 / self.effective_rate
+
+            start = time()
+
+            try:
+                values = {channel: self._read(channel) for channel in channels}
+                self.sample = Sample(time(), MappingProxyType(values))
+
+                with self._condition:
+                    self._condition.notify_all()
+            except MotorException as e:
+                print(f'[WARNING] [{__name__}] Acquisition failed: {e}')
+            else:
+                for listener in listeners:
+                    # Listeners include widget callbacks, one failing must not stop the stream for everyone.
+                    try:
+                        listener(self.sample)
+                    except Exception as e:
+                        print(f'[WARNING] [{__name__}] Listener {listener!r} failed: {e!r}')
+
+            sleep(max(0, period - (time() - start)))
@@ -1,9 +1,90 @@
-from threading import Thread
+from threading import Thread, Lock, Event
 
-from typing import Callable
+from typing import Callable, Generic, Optional, TypeVar
+
+T = TypeVar('T')
 
 def threaded_callback(function: Callable) -> Callable:
     def wrapper(*args, **kwargs):
         Thread(target = function, args = args, kwargs = kwargs, daemon = True).start()
 
-    return wrapper
\ No newline at end of file
+    return wrapper
+
+class Mailbox(Generic[T]):
+    """
+    A single slot handing the latest value from producers to a consumer.
+
+    Posting overwrites any value which has not been taken yet,
+    so a slow consumer only ever sees the newest value.
+
+    Attributes
+    ----------
+    dropped: int
+        The number of values overwritten before they were taken.
+    """
+    dropped: int = 0
+
+    def __init__(self):
+        self._lock = Lock()
+        self._event = Event()
+        self._value: Optional[T] = None
+
+    def post(self, value: T) -> None:
+        """
+        Replace the value in the slot.
+
+        Parameters
+        ----------
+        value: T
+            The new value.
+        """
+        with self._lock:
+            if self._event.is_set():
+                self.dropped += 1
+            self._value = value
+            self._event.set()
+
+    def take(self, timeout: Optional[float] = None) -> Optional[T]:
+        """
+        Wait for a value and empty the slot.
+
+        Parameters
+        ----------
+        timeout: Optional[float]
+            How long to wait, forever if None.
+
+        Returns
+        -------
+        Optional[T]
+            The latest value, or None if the wait timed out.
+        """
+        if not self._event.wait(timeout):
+            return None
+
+        with self._lock:
+            value, self._value = self._value, None
+            self._event.clear()
+
+        return value
+
+class StageTimer:
+    """
+    Exponentially averaged duration of a pipeline stage.
+
+    Attributes
+    ----------
+    average: float
+        The averaged duration in seconds.
+    count: int
+        The number of recorded durations.
+    """
+    average: float = 0
+    count: int = 0
+
+    def __init__(self, smoothing: float = 0.1):
+        self.smoothing = smoothing
+
+    def record(self, duration: float) -> None:
+        self.average = duration if not self.count else \
+            self.average + self.smoothing * (duration - self.average)
+        self.count += 1
@@ -1,14 +1,22 @@
 from threading import Thread
+from time import time
 from abc import ABC, abstractmethod
 import tkinter as tk
 
+import numpy as np
+
 from lib.app import Application
+from lib.motion import PathHandle
 from lib.system import System
+from lib.telemetry import POSITION, Snapshot, Subscription
 
-from typing import Optional, Union, TypeVar
+from typing import Callable, Iterable, Optional, Sequence, Union, TypeVar
 
 T = TypeVar('T', float, int)
 
+# Lower and upper bounds of x, y, z, r, e.
+_bounds = np.array(((0, -30, 0, -1.57, 0), (30, 30, 160, 1.57, 100)))
+
 def _clamp(value: Optional[T], m: Union[float, int], M: Union[float, int]) -> Optional[T]:
     if value is not None:
         return type(value)(min(max(value, m), M))
@@ -33,7 +41,11 @@ class Control:
 
     def __init__(self, parent):
         self._parent: Application = parent
-        self._system: System = parent.system
+
+    @property
+    def _system(self) -> System:
+        # Looked up on use, widgets are created before the hardware is brought up.
+        return self._parent.system
 
     @property
     def target_x(self):
@@ -62,13 +74,76 @@ class Control:
 
         Returns
         -------
-        tuple[float, float, float, float, int]
-            x, y, z, r positions.
+        tuple[float, float, float, float]
+            x, y, z, r positions, r relative to the world as in move().
+        """
+        snapshot = self.snapshot()
+
+        return snapshot.x, snapshot.y, snapshot.z, snapshot.r
+
+    def snapshot(self, timeout: float = 1) -> Snapshot:
+        """
+        The latest state of the system.
+
+        Uses the shared telemetry sample when one is recent, otherwise
+        waits for the next acquisition.
+
+        Parameters
+        ----------
+        timeout: float
+            How long to wait for an acquisition.
+
+        Returns
+        -------
+        Snapshot
+            The timestamped joint and cartesian state.
+
+        Raises
+        ------
+        TimeoutError
+            If no acquisition finished in time.
+        """
+        telemetry = self._parent.telemetry
+        sample = telemetry.sample
+
+        if sample is None or POSITION not in sample.values \
+                or time() - sample.timestamp > 2 / telemetry.effective_rate:
+            telemetry.acquire(POSITION)
+            try:
+                sample = telemetry.wait(POSITION, time(), timeout)
+            finally:
+                telemetry.release(POSITION)
+
+            if sample is None:
+                raise TimeoutError('No telemetry sample was acquired.')
+
+        return Snapshot.from_sample(sample, self._system)
+
+    def subscribe(self, callback: Callable[[Snapshot], None], rate: float = 10) -> Subscription:
         """
+        Call a function with the state of the system at a given rate.
+
+        Every subscriber shares the application's single acquisition stream.
+        The callback runs on the acquisition thread and must return quickly,
+        use after() to update the GUI from it.
+
+        Parameters
+        ----------
+        callback: Callable[[Snapshot], None]
+            The function to call.
+        rate: float
+            The number of updates per second.
 
-        t1, t2, z = self._system.get_all_pos()
+        Returns
+        -------
+        Subscription
+            Cancel it to stop the updates.
+        """
+        system = self._system
 
-        return self._system.polar_to_cartesian(t1, t2) + (z, self._system.m_end_rot.position)
+        return self._parent.telemetry.subscribe(
+            lambda sample: callback(Snapshot.from_sample(sample, system)), POSITION, rate=rate
+        )
 
     def move(self, *args: str,
              x: Optional[float] = None, y: Optional[float] = None, z: Optional[float] = None, r: Optional[float] = None, e: Optional[int] = None,
@@ -109,7 +184,7 @@ class Control:
         )
         
         t1, t2 = self._system.cartesian_to_dual_polar(
-            self._parent.target_x_var.get(), self._parent.target_y_var.get()
+            self._parent.target_x_var.get(), self._parent.target_y_var.get(), self._system.joint_target
         )
         z = self._parent.target_z_var.get()
         r = self._parent.target_r_var.get()
@@ -126,6 +201,34 @@ class Control:
         else:
             self._system.jog(t1=t1, t2=t2, z=z, r=r, e=e)
 
+    def follow(self, path: Iterable[Sequence[float]], times: Optional[Iterable[float]] = None,
+               speed: float = 5) -> PathHandle:
+        """
+        Follow a path as one continuous motion, without waiting for it.
+
+        The whole path is handed to the motion thread at once, which is
+        much cheaper than calling move() for every point.
+
+        Parameters
+        ----------
+        path: Iterable[Sequence[float]]
+            The (x, y, z, r) or (x, y, z, r, e) waypoints, an array or any iterable.
+        times: Optional[Iterable[float]]
+            The time at which each waypoint is reached, from the first waypoint.
+        speed: float
+            The cartesian speed used without times.
+
+        Returns
+        -------
+        PathHandle
+            The progress of the path, which can also cancel it or wait for it.
+        """
+        path = np.array(path if isinstance(path, (np.ndarray, list, tuple)) else list(path), dtype=float)
+        if path.ndim == 2 and path.shape[1] in (4, 5):
+            path = np.clip(path, *_bounds[:, :path.shape[1]])
+
+        return self._parent.motion.follow(path, times, speed)
+
 
 class Widget(tk.Toplevel, ABC):
     """
@@ -0,0 +1,170 @@
+"""
+Manipulability map of the planar workspace.
+
+Near the minimum radius and near full extension small cartesian moves need
+large joint velocities. The map precomputes, per grid cell, the condition
+number of the arm's Jacobian and the cartesian speed the arm can reach in
+every direction without exceeding the joint velocity limits.
+"""
+
+from typing import Union
+
+import numpy as np
+
+from lib.system import System
+
+ArrayLike = Union[float, np.ndarray]
+
+
+class WorkspaceMap:
+    """
+    A grid over the planar workspace holding manipulability metrics.
+
+    Cells the arm can not reach hold NaN.
+
+    Attributes
+    ----------
+    resolution: float
+        The size of a cell.
+    x: np.ndarray
+        The x-coordinates of the cell centers.
+    y: np.ndarray
+        The y-coordinates of the cell centers.
+    condition: np.ndarray
+        The condition number of the Jacobian, indexed [y, x].
+    speed: np.ndarray
+        The largest cartesian speed achievable in every direction, indexed [y, x].
+    """
+    resolution: float
+    x: np.ndarray
+    y: np.ndarray
+    condition: np.ndarray
+    speed: np.ndarray
+
+    def __init__(self, system: System, resolution: float = 0.25):
+        """
+        Build the map from the link lengths and joint velocity limits of a system.
+
+        Parameters
+        ----------
+        system: System
+            The system to map.
+        resolution: float
+            The size of a cell.
+        """
+        l1, l2 = system.l1, system.l2
+        reach = l1 + l2
+
+        self.resolution = resolution
+        self.x = np.arange(-reach, reach + resolution, resolution)
+        self.y = np.arange(-reach, reach + resolution, resolution)
+        x, y = np.meshgrid(self.x, self.y)
+
+        r = np.hypot(x, y)
+        reachable = (r > system.minimum_radius) & (r <= reach)
+
+        # The elbow angle is the same for both configurations up to sign,
+        # both metrics only depend on its magnitude and on r.
+        cos_t2 = np.clip((r ** 2 - l1 ** 2 - l2 ** 2) / (2 * l1 * l2), -1, 1)
+        det = np.abs(l1 * l2 * np.sqrt(1 - cos_t2 ** 2))
+
+        # Singular values of the 2x2 Jacobian from its Frobenius norm and determinant.
+        frobenius = l1 ** 2 + 2 * l2 ** 2 + 2 * l1 * l2 * cos_t2
+        spread = np.sqrt(np.maximum(frobenius ** 2 - 4 * det ** 2, 0))
+        sigma_max = np.sqrt((frobenius + spread) / 2)
+        sigma_min = np.sqrt(np.maximum((frobenius - spread) / 2, 0))
+
+        # The rows of the inverse Jacobian have norms l2 / det and r / det,
+        # the slowest direction is bound by whichever joint saturates first.
+        v1, v2 = system.velocity_limits['t1'], system.velocity_limits['t2']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.condition = np.where(reachable, sigma_max / sigma_min, np.nan)
+            self.speed = np.where(reachable, det / np.maximum(l2 / v1, r / v2), np.nan)
+
+    def _index(self, x: ArrayLike, y: ArrayLike) -> tuple[np.ndarray, np.ndarray]:
+        i = np.clip(np.rint((np.asarray(y) - self.y[0]) / self.resolution), 0, len(self.y) - 1)
+        j = np.clip(np.rint((np.asarray(x) - self.x[0]) / self.resolution), 0, len(self.x) - 1)
+        return i.astype(int), j.astype(int)
+
+    def condition_at(self, x: ArrayLike, y: ArrayLike) -> ArrayLike:
+        """
+        Look up the Jacobian condition number at one or more positions.
+
+        Parameters
+        ----------
+        x: ArrayLike
+            The x-coordinate(s).
+        y: ArrayLike
+            The y-coordinate(s).
+
+        Returns
+        -------
+        ArrayLike
+            The condition number(s), NaN where unreachable.
+        """
+        return self.condition[self._index(x, y)]
+
+    def speed_at(self, x: ArrayLike, y: ArrayLike) -> ArrayLike:
+        """
+        Look up the achievable cartesian speed at one or more positions.
+
+        Parameters
+        ----------
+        x: ArrayLike
+            The x-coordinate(s).
+        y: ArrayLike
+            The y-coordinate(s).
+
+        Returns
+        -------
+        ArrayLike
+            The speed(s) in length units per second, NaN where unreachable.
+        """
+        return self.speed[self._index(x, y)]
+
+    def slow(self, x: ArrayLike, y: ArrayLike, min_speed: float = 5) -> np.ndarray:
+        """
+        Find positions which are unreachable or slower than a given speed.
+
+        Parameters
+        ----------
+        x: ArrayLike
+            The x-coordinate(s).
+        y: ArrayLike
+            The y-coordinate(s).
+        min_speed: float
+            The slowest acceptable cartesian speed.
+
+        Returns
+        -------
+        np.ndarray
+            A boolean mask of the offending positions.
+        """
+        speed = self.speed_at(x, y)
+        return np.isnan(speed) | (speed < min_speed)
+
+    def save_image(self, file_name: str) -> None:
+        """
+        Export the speed map as a binary PPM image.
+
+        Slow cells are red, fast cells are green and unreachable cells are gray.
+        The top of the image is +y.
+
+        Parameters
+        ----------
+        file_name: str
+            The file to write.
+        """
+        speed = np.flipud(self.speed)
+        reachable = ~np.isnan(speed)
+        normalized = np.zeros_like(speed)
+        normalized[reachable] = speed[reachable] / np.nanmax(speed)
+
+        image = np.full(speed.shape + (3,), 200, dtype=np.uint8)
+        image[..., 0] = np.where(reachable, 255 * (1 - normalized), 200)
+        image[..., 1] = np.where(reachable, 255 * normalized, 200)
+        image[..., 2] = np.where(reachable, 0, 200)
+
+        with open(file_name, 'wb') as f:
+            f.write(f'P6 {image.shape[1]} {image.shape[0]} 255\n'.encode())
+            f.write(image.tobytes())
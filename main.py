@@ -1,5 +1,8 @@
-import tkinter as tk
-from lib.app import Application
+from lib.profiler import startup
+
+with startup.phase('imports'):
+    import tkinter as tk
+    from lib.app import Application
 
 if __name__ == '__main__':
     root = tk.Tk()
@@ -1,10 +1,9 @@
-import os
-import os.path
 from threading import Thread
 import tkinter.ttk as ttk
 from tkinter import messagebox
-from hardware.FOCMC_interface import MotorException
+from hardware.FOCMC_interface import Motor, MotorException
 
+from lib.calibration import CalibrationError, CalibrationStore
 from lib.widget import Widget
 
 
@@ -12,6 +11,9 @@ class CalibrationWizard(Widget):
     content_frame: ttk.Frame
     continue_button: ttk.Button
     cancel_button: ttk.Button
+    store: CalibrationStore
+    # Positions measured for the joint being calibrated, saved once it is complete.
+    positions: list[float]
 
     def setup(self):
         self.title('Calibration Wizard')
@@ -19,11 +21,21 @@ class CalibrationWizard(Widget):
 
         self.control._system.motors_enabled(False)
 
-        if not os.path.exists('config'):
-            os.mkdir('config')
+        try:
+            self.store = CalibrationStore.load()
+        except (OSError, CalibrationError):
+            # Recalibrating replaces whatever could not be read.
+            self.store = CalibrationStore()
+        self.positions = []
 
         self.step1()
 
+    def save(self, motor: Motor, low: float, high: float, center: float):
+        try:
+            self.store.set(motor.m_id, low, high, center, offset=motor.offset)
+        except (OSError, CalibrationError) as e:
+            messagebox.showerror(__name__, f'Failed to save the calibration of motor {motor.m_id}.\n{e}')
+
     def step1(self):
         self.content_frame = ttk.Frame(self)
         self.content_frame.pack(side='top', fill='both', expand=True)
@@ -73,8 +85,7 @@ Click continue to begin.
             self.control._system.m_inner_rot, voltage=-12, zeroSpeed=0.1, active=False
         )
 
-        with open('config/inner_rot', 'w') as f:
-            f.write(f'{low}\n')
+        self.positions = [low]
 
         self.continue_button['command'] = self.step3
         self.continue_button['state'] = 'normal'
@@ -109,8 +120,7 @@ Click continue to begin.
             self.control._system.m_inner_rot, voltage=12, zeroSpeed=0.1, active=False
         )
 
-        with open('config/inner_rot', 'a') as f:
-            f.write(f'{high}\n')
+        self.positions.append(high)
 
         self.continue_button['command'] = self.step4
         self.continue_button['state'] = 'normal'
@@ -148,8 +158,7 @@ Click continue to begin.
             self.failed()
             return
 
-        with open('config/inner_rot', 'a') as f:
-            f.write(f'{center}\n')
+        self.save(motor, *self.positions, center)
 
         motor.set_control_mode('angle')
         motor.move(0)
@@ -189,8 +198,9 @@ Click continue to begin.""",
             self.failed()
             return
 
-        with open('config/end_rot', 'w' if word == 'left' else 'a') as f:
-            f.write(f'{value}\n')
+        if word == 'left':
+            self.positions = []
+        self.positions.append(value)
 
         if word != 'center':
             if word == 'left':
@@ -208,7 +218,10 @@ Click continue to begin.""",
             child.destroy()
 
         if word == 'center':
-            self.control._system.m_end_rot.offset = value
+            motor.offset = value
+            # The left extreme is set first, it is not necessarily the lower one.
+            left, right, center = self.positions
+            self.save(motor, min(left, right), max(left, right), center)
             self.step6()
             return
 
@@ -260,11 +273,8 @@ Click continue to begin.""",
         self.continue_button['text'] = 'Working...'
         self.continue_button['state'] = 'disabled'
 
-        with open('config/outer_rot', 'w') as f:
-            for num in self.control._system.auto_calibrate(
-                self.control._system.m_outer_rot, voltage=6, speed=2
-            ):
-                f.write(f'{num}\n')
+        motor = self.control._system.m_outer_rot
+        self.save(motor, *self.control._system.auto_calibrate(motor, voltage=6, speed=2))
 
         self.cancel_button.destroy()
         self.continue_button['command'] = self.close
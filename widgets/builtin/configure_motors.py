@@ -12,6 +12,8 @@ from lib.utils import threaded_callback
 
 class ConfigureMotors(Widget):
     selected_motor: Motor
+    console_rate: float = 10
+    console_lines: int = 500
 
     def setup(self):
         self.selected_motor = self.control._system.motors[1]
@@ -167,34 +169,56 @@ class ConfigureMotors(Widget):
         self.console_send.bind('<Return>', lambda _: self.selected_motor._send_command(self.send_var.get()))
 
 
+        self._console_motor = None
+        self._console_count = 0
+
         self._select_motor('t1')
-        self._console_bg_task()
+        self.after(0, self._update_console)
         self._loop()
 
     @threaded_callback
     def _select_motor(self, motor_id: str) -> None:
         self.selected_motor = self.control._system.joints[motor_id]
-        self._update_console()
 
         print(f'[INFO] [{__name__}] Selected motor {self.selected_motor.m_id}.')
 
     def _update_console(self) -> None:
-        as_text = '\n'.join([f'{t}:\t{cmd}\t\t{resp}' for t, cmd, resp in self.selected_motor.log])
-        self.console_text.configure(state='normal')
-        self.console_text.delete(1.0, tk.END)
-        self.console_text.insert(tk.INSERT, as_text)
-        self.console_text.configure(state='disabled')
-        self.console_text.see(tk.END)
-
-    @threaded_callback
-    def _console_bg_task(self) -> None:
-        while True:
-            with self.selected_motor.log_informer:
-                self.selected_motor.log_informer.wait()
-                if not self.alive:
-                    return
-
-                self._update_console()
+        """
+        Append the log entries added since the last refresh and reschedule.
+
+        Runs on the Tk thread at console_rate, so any number of commands
+        between refreshes costs a single insert.
+        """
+        if not self.alive:
+            return
+
+        motor = self.selected_motor
+
+        try:
+            if motor is not self._console_motor:
+                self._console_motor = motor
+                self._console_count = 0
+                self.console_text.configure(state='normal')
+                self.console_text.delete(1.0, tk.END)
+                self.console_text.configure(state='disabled')
+
+            entries, self._console_count = motor.log_since(self._console_count)
+
+            if entries:
+                as_text = ''.join(f'{t}:\t{cmd}\t\t{resp}\n' for t, cmd, resp in entries)
+                self.console_text.configure(state='normal')
+                self.console_text.insert(tk.END, as_text)
+
+                excess = int(self.console_text.index('end-1c').split('.')[0]) - 1 - self.console_lines
+                if excess > 0:
+                    self.console_text.delete(1.0, f'{excess + 1}.0')
+
+                self.console_text.configure(state='disabled')
+                self.console_text.see(tk.END)
+
+            self.after(int(1000 / self.console_rate), self._update_console)
+        except tk.TclError:
+            return
 
     @threaded_callback
     def _loop(self):
@@ -1,31 +1,37 @@
+from abc import ABC, abstractmethod
+from argparse import ArgumentParser
+import os
 from threading import Thread
+from tkinter import messagebox
 import zipfile
+from typing import Optional, Union
 from lib.widget import Widget
+from lib.filtering import InputFilter, OneEuroFilter
+from lib.utils import Mailbox, StageTimer
 
 import cv2
 import mediapipe as mp
-from math import sqrt
 from time import sleep, time
 import numpy as np
 
-cap = cv2.VideoCapture(0)
-#cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-
 mp_hands = mp.solutions.hands
-hands = mp_hands.Hands()
-mp_draw = mp.solutions.drawing_utils
 
-def calc_avgs(point_indices, landmarks):
-    x_total = 0
-    y_total = 0
-    z_total = 0
-    for index in point_indices:
-        point = landmarks[index]
-        x_total += point.x
-        y_total += point.y
-        z_total += point.z
-    return x_total/len(point_indices), y_total/len(point_indices), z_total/len(point_indices)
+# Landmark indices of the palm, the four fingers (base to tip) and the drawn skeleton.
+PALM = [0, 5, 9, 13, 17]
+FINGERS = np.array([[4*i + 5 + j for j in range(4)] for i in range(4)])
+SKELETON = [
+    [0, 1, 2, 3, 4], [0, 5, 6, 7, 8], [5, 9, 10, 11, 12],
+    [9, 13, 14, 15, 16], [13, 17, 18, 19, 20], [0, 17],
+]
+
+def landmark_array(landmarks) -> np.ndarray:
+    """
+    Convert mediapipe landmarks to an (n, 3) array of x, y, z.
+    """
+    return np.array([(lm.x, lm.y, lm.z) for lm in landmarks])
 
+def calc_avgs(point_indices, points: np.ndarray) -> np.ndarray:
+    return points[point_indices].mean(axis=0)
 
 # s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 # s.connect(("192.168.1.3",8080))
@@ -45,150 +51,529 @@ def sgn(x):
         return -1
     return 1
 
-def normed_dot(x1, y1, z1, x2, y2, z2):
-    dot = x1 * x2 + y1 * y2 + z1 * z2
-    this_mag = sqrt(x1**2 + y1**2 + z1**2)
-    last_mag = sqrt(x2**2 + y2**2 + z2**2)
-    return dot/this_mag/last_mag
+def calc_curve(chains: np.ndarray) -> np.ndarray:
+    """
+    Straightness of chains of points.
+
+    The sum of the cosines between every pair of segments of a chain,
+    divided by the number of segments.
+
+    Parameters
+    ----------
+    chains: np.ndarray
+        A (..., n, 3) array of chains of n points.
+
+    Returns
+    -------
+    np.ndarray
+        The curve value of every chain.
+    """
+    vectors = chains[..., :-1, :] - chains[..., 1:, :]
+    vectors = vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+    gram = vectors @ np.swapaxes(vectors, -1, -2)
+    segments = vectors.shape[-2]
+
+    return np.triu(gram, 1).sum(axis=(-2, -1)) / segments
+
+def calc_features(points: np.ndarray) -> tuple[float, float, float, float, float]:
+    """
+    Compute the tracked hand features from its landmarks.
+
+    Parameters
+    ----------
+    points: np.ndarray
+        The (21, 3) landmark array.
+
+    Returns
+    -------
+    tuple[float, float, float, float, float]
+        Palm centroid x and y, hand scale, mean finger curve and thumb height.
+    """
+    x, y, _ = calc_avgs(PALM, points)
+    z = np.linalg.norm(points[[5, 17]] - points[0], axis=1).sum()
+    curve = calc_curve(points[FINGERS]).mean()
+    thumb_height = (points[4, 1] - points[0, 1]) / z
+
+    return float(x), float(y), float(z), float(curve), float(thumb_height)
+
+
+class VideoSource(ABC):
+    """
+    A stream of timestamped frames.
+
+    Attributes
+    ----------
+    live: bool
+        Whether frames arrive in real time, rather than being read as fast as requested.
+    """
+    live: bool = False
+
+    @abstractmethod
+    def read(self) -> Optional[tuple[float, np.ndarray]]:
+        """
+        Read the next frame.
+
+        Returns
+        -------
+        Optional[tuple[float, np.ndarray]]
+            The frame's timestamp in seconds and the BGR image,
+            or None if no frame is available.
+        """
+
+    def close(self) -> None:
+        pass
+
+
+class CaptureSource(VideoSource):
+    """
+    A webcam or a recorded video file read through OpenCV.
+    """
+
+    def __init__(self, source: Union[int, str]):
+        """
+        Parameters
+        ----------
+        source: Union[int, str]
+            A camera index or a video file name.
+        """
+        self.live = isinstance(source, int)
+        self.capture = cv2.VideoCapture(source)
+
+        if not self.capture.isOpened():
+            raise OSError(f'Failed to open video source {source!r}.')
+
+    def read(self) -> Optional[tuple[float, np.ndarray]]:
+        success, img = self.capture.read()
+        if not success:
+            return None
+
+        timestamp = time() if self.live else self.capture.get(cv2.CAP_PROP_POS_MSEC) / 1000
+        return timestamp, img
+
+    def close(self) -> None:
+        self.capture.release()
+
+
+class FrameDirectory(VideoSource):
+    """
+    A recording stored as a directory of image files, read in name order.
+    """
+    extensions = ('.png', '.jpg', '.jpeg', '.bmp')
+
+    def __init__(self, directory: str, fps: float = 30):
+        """
+        Parameters
+        ----------
+        directory: str
+            The directory containing the frames.
+        fps: float
+            The frame rate the frames were recorded at.
+        """
+        self.files = sorted(
+            os.path.join(directory, name) for name in os.listdir(directory)
+            if name.lower().endswith(self.extensions)
+        )
+        self.fps = fps
+        self.index = 0
+
+        if not self.files:
+            raise OSError(f'No frames found in {directory!r}.')
+
+    def read(self) -> Optional[tuple[float, np.ndarray]]:
+        if self.index >= len(self.files):
+            return None
+
+        img = cv2.imread(self.files[self.index])
+        timestamp = self.index / self.fps
+        self.index += 1
+
+        if img is None:
+            raise OSError(f'Failed to read frame {self.files[self.index - 1]!r}.')
+
+        return timestamp, img
+
+
+def open_source(source: Union[int, str], fps: float = 30) -> VideoSource:
+    """
+    Open a camera index, a video file or a directory of frames.
+
+    Parameters
+    ----------
+    source: Union[int, str]
+        A camera index, or the name of a video file or frame directory.
+        A string of digits is treated as a camera index.
+    fps: float
+        The frame rate of a frame directory.
+
+    Returns
+    -------
+    VideoSource
+        The opened source.
+    """
+    if isinstance(source, str) and source.isdigit():
+        source = int(source)
+
+    if isinstance(source, str) and os.path.isdir(source):
+        return FrameDirectory(source, fps)
+
+    return CaptureSource(source)
+
+
+class HandTracker:
+    """
+    Turns frames into arm setpoints, independent of the GUI and of timing.
+
+    Attributes
+    ----------
+    inference_scale: float
+        Fraction of the frame size used for inference.
+    roi: bool
+        Run inference on a crop around the last detected hand.
+    roi_margin: float
+        Padding around the hand's bounding box, relative to its size.
+    filter: InputFilter
+        Smooths x, y, z, e and r, and predicts them ahead by the measured latency.
+    """
+    inference_scale: float
+    roi: bool
+    roi_margin: float = 0.5
+    roi_box: Optional[tuple[int, int, int, int]] = None
+    filter: InputFilter
+    # Seconds a hand must be seen before it takes control.
+    hand_on_bound: float = 1
+
+    def __init__(self, inference_scale: float = 1, roi: bool = False):
+        self.inference_scale = inference_scale
+        self.roi = roi
+        self.hands = mp_hands.Hands()
+        self.filter = OneEuroFilter(min_cutoff=1, beta=0.05)
+
+        self.num_attrs = 4
+        self.last_moves = [0] * self.num_attrs
+        self.master_pos = [-999] * self.num_attrs
+        #sensitivity = [.15, .3, .65, 1, 0]
+        self.sensitivity = [0] * 10
+        self.hand_on = False
+        self.hand_on_start = 0
+
+    def detect(self, img) -> Optional[np.ndarray]:
+        """
+        Find the landmarks of a hand in a frame.
+
+        With roi enabled, inference runs on a crop around the last detected
+        hand and falls back to the whole frame when the hand is lost.
+        The input is shrunk by inference_scale before inference.
+
+        Returns
+        -------
+        Optional[np.ndarray]
+            The (21, 3) landmark array normalized to the whole frame,
+            or None if no hand was found.
+        """
+        height, width, _ = img.shape
+        x0, y0, x1, y1 = self.roi_box if self.roi and self.roi_box is not None else (0, 0, width, height)
+
+        crop = img[y0:y1, x0:x1]
+        if self.inference_scale != 1:
+            crop = cv2.resize(
+                crop, None, fx=self.inference_scale, fy=self.inference_scale, interpolation=cv2.INTER_AREA
+            )
+
+        results = self.hands.process(cv2.cvtColor(crop, cv2.COLOR_BGR2RGB))
+        # print("[INFO] handmarks: {}".format(results.multi_hand_landmarks))
+
+        if not results.multi_hand_landmarks:
+            self.roi_box = None
+            return None
+
+        points = landmark_array(results.multi_hand_landmarks[0].landmark)
+        points *= (x1 - x0) / width, (y1 - y0) / height, (x1 - x0) / width
+        points += x0 / width, y0 / height, 0
+
+        low = points[:, :2].min(axis=0)
+        high = points[:, :2].max(axis=0)
+        margin = self.roi_margin * (high - low).max()
+        (bx0, by0), (bx1, by1) = np.clip(low - margin, 0, 1), np.clip(high + margin, 0, 1)
+        self.roi_box = int(bx0 * width), int(by0 * height), int(bx1 * width) + 1, int(by1 * height) + 1
+
+        return points
+
+    def track(self, points: Optional[np.ndarray], captured: float, latency: float = 0) -> Optional[dict[str, float]]:
+        """
+        Turn detected landmarks into a filtered arm setpoint.
+
+        Parameters
+        ----------
+        points: Optional[np.ndarray]
+            The landmarks found by detect().
+        captured: float
+            When the frame was captured.
+        latency: float
+            The capture to motor latency the setpoint is predicted ahead by.
 
-def calc_curve(landmarks):
-    vectors = []
-    last_lm = None
-    for lm in landmarks:
-        if last_lm is not None:
-            vectors.append([last_lm.x - lm.x, last_lm.y - lm.y, last_lm.z - lm.z])
-            #print([vectors[-1]])
-        last_lm = lm
+        Returns
+        -------
+        Optional[dict[str, float]]
+            The x, y, z, e and r setpoint, or None if there is no hand in control.
+        """
+        if points is None:
+            self.filter.reset()
+            return None
 
-    dot_total = 0
+        if not self.hand_on:
+            self.hand_on = True
+            self.hand_on_start = captured
 
-    for i in range(len(vectors)):
-        for j in range(i + 1, len(vectors)):
-            x1, y1, z1 = vectors[i]
-            x2, y2, z2 = vectors[j]
-            dot_total += normed_dot(x1, y1, z1, x2, y2, z2)
-    return dot_total / (len(landmarks) - 1)
+        if captured - self.hand_on_start <= self.hand_on_bound:
+            return None
+
+        x, y, z, curve, thumb_height = calc_features(points)
+
+        full_pos = [x, y, z, curve] #this is the position in the latent space
+        full_pos = [clip(1/z, 2, 5, 0, 30), clip(x, .1, .95, -30, 30),
+            clip(y, .1, .85, 10, 160), clip(curve, -.3, 1, 0, 100)]
+
+        rot = clip(thumb_height, -.4, -.6, -.5, .5)
+
+        self.filter.latency = latency
+        *filtered, rot = self.filter.update(full_pos + [rot], captured)
+
+        for i in range(self.num_attrs):
+            if abs(self.master_pos[i] - filtered[i]) > self.sensitivity[i]:
+                self.last_moves[i] = captured
+                self.master_pos[i] = float(filtered[i])
+
+        return {
+            'x': self.master_pos[0],
+            'y': self.master_pos[1],
+            'z': self.master_pos[2],
+            'e': self.master_pos[3],
+            'r': float(rot),
+        }
 
 
 class HandTracking(Widget):
+    """
+    Teleoperation from a camera.
+
+    Capture, inference, arm control and display run as separate stages
+    connected by latest-value mailboxes, so a slow stage drops stale
+    frames instead of delaying the others.
+    """
+    stages = ('capture', 'inference', 'control', 'display', 'latency')
+    # A camera index, or the name of a video file or frame directory to replay.
+    source: Union[int, str] = 0
+    # Fraction of the frame size used for inference.
+    inference_scale: float = 1
+    # Run inference on a crop around the last detected hand.
+    roi: bool = False
+    tracker: HandTracker
+    video: VideoSource
+
     def setup(self):
         self.running = True
-        Thread(target=self.main, daemon=True).start()
-
-    def main(self):
-        num_attrs = 4
-        avgs = [None] * num_attrs
-        avg_factors = [.3] * num_attrs
-        last_moves = [0] * num_attrs
-        master_pos = [-999] * num_attrs
-        #sensitivity = [.15, .3, .65, 1, 0]
-        sensitivity = [0] * 10
-
-        x_avg, y_avg, z_avg = None, None, None
-        curve_avg = None
-        x_vel_sgn_count = 0
-        x_vel_sgn = 0
-        y_vel_sgn_count = 0
-        y_vel_sgn = 0
-        x_vel_avg, y_vel_avg = 0, 0
-        factor = .5
-        start = time()
-        hand_on = False
-        hand_on_start = time()
-        hand_on_bound = 1
-        while True:
-            
-            _, img = cap.read()
-            imgRGB = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            results = hands.process(imgRGB)
-            # print("[INFO] handmarks: {}".format(results.multi_hand_landmarks))
-            
-            if results.multi_hand_landmarks:
-                if not hand_on:
-                    hand_on = True
-                    hand_on_start = time()
-
-                for hand_landmarks in results.multi_hand_landmarks:
-                    index = 0
-                    for lm in hand_landmarks.landmark:
-                        height, width, channel = img.shape
-                        cx, cy = int(lm.x * width), int(lm.y * height)
-                        col = min(255, max(index-5, 0) * 40)
-                        cv2.circle(img, (cx, cy), 10, (col, col, col), cv2.FILLED)
-                        index += 1
-                    mp_draw.draw_landmarks(img, hand_landmarks, mp_hands.HAND_CONNECTIONS)
-                #print(results.multi_hand_landmarks)
-                landmarks = results.multi_hand_landmarks[0].landmark
-
-                 
-                if time() - hand_on_start > hand_on_bound:
-                    x, y, *_ = calc_avgs([0, 5, 9, 13, 17], landmarks)
-                    lm1 = landmarks[0]
-                    def calc_dist(lm1, lm2):
-                        return sqrt((lm1.x - lm2.x)**2 + (lm1.y - lm2.y)**2 + (lm1.z - lm2.z)**2)
-                    z = calc_dist(lm1, landmarks[5]) + calc_dist(lm1, landmarks[17])
-                    curve = sum(calc_curve(landmarks[4*i + 5: 4*i+9]) for i in range(4)) / 4
-
-                    top_ys = sum(landmarks[i*4+8].y for i in range(4)) / 4
-
-                    thumb_curve = calc_curve([landmarks[0], landmarks[1], landmarks[2]])
-                    thumb_height = (landmarks[4].y - landmarks[0].y)/z
-                    print(thumb_height)
-                    #print(curve)
-                    #print(thumb_curve)
-                    full_pos = [x, y, z, curve] #this is the position in the latent space
-                    full_pos = [clip(1/z, 2, 5, 0, 30), clip(x, .1, .95, -30, 30),
-                        clip(y, .1, .85, 10, 160), clip(curve, -.3, 1, 0, 100)]
-
-                    if avgs[0] is None:
-                        avgs = full_pos
-                    else:
-                        '''
-                        other_factor = .3
-                        x_vel = x - x_avg
-                        y_vel = y - y_avg
-                    
-                        x_vel_avg = x_vel * factor + x_vel_avg * (1- other_factor)
-                        y_vel_avg = y_vel * factor + y_vel_avg * (1- other_factor)
-                        if sgn(x_vel) == x_vel_sgn:
-                            x_vel_sgn_count += 1
-                        else:
-                            x_vel_avg = 0
-                            x_vel_sgn_count = 0
-
-                        if sgn(y_vel) == y_vel_sgn:
-                            y_vel_sgn_count += 1
-                        else:
-                            y_vel_avg = 0
-                            y_vel_sgn_count = 0
-                        '''
-                        for i in range(num_attrs):
-                            avgs[i] = avgs[i] * avg_factors[i] + full_pos[i] * (1-avg_factors[i])
-
-                    #lookahead=0
-                    #use_x, use_y, use_z = x_avg + x_vel_avg*lookahead, y_avg+y_vel_avg*lookahead, z_avg
-                    
-                    
-                    for i in range(num_attrs):
-                        if abs(master_pos[i] - avgs[i]) > sensitivity[i]:
-                            last_moves[i] = time()
-                            master_pos[i] = avgs[i]
-
-                    #master_pos = full_pos
-                    
-
-                    #pos = [clip(z_avg, .1, .05, 0, 30), clip(x_avg, .1, .95, -30, 30), clip(y_avg, 0, 1, 10, 160)]
-                    #print(30*(1-point.y), 60*(.5-point.x), point.z)
-                    #pos = ','.join(map(str, pos))
-                    rot = clip(thumb_height, -.4, -.6, -.5, .5)
-                    try:
-                        self.control.move(x=master_pos[0], y=master_pos[1],
-                            z=master_pos[2], e=master_pos[3], r=rot)
-                    except:
-                        print('OOF')
-                    # sleep(.025)
-                    #print(time() - start)
+
+        self.frames = Mailbox()
+        self.annotations = Mailbox()
+        self.setpoints = Mailbox()
+        self.timers = {stage: StageTimer() for stage in self.stages}
+
+        try:
+            self.video = open_source(self.source)
+        except OSError as e:
+            messagebox.showerror(__name__, str(e))
+            self.close()
+            return
+
+        self.tracker = HandTracker(self.inference_scale, self.roi)
+
+        Thread(target=self._capture, daemon=True).start()
+        Thread(target=self._infer, daemon=True).start()
+        Thread(target=self._command, daemon=True).start()
+        Thread(target=self._display, daemon=True).start()
+
+    def _capture(self):
+        playback_start = None
+
+        while self.running:
+            start = time()
+            frame = self.video.read()
+            if frame is None:
+                if not self.video.live:
+                    break
+                sleep(0.01)
+                continue
+
+            timestamp, img = frame
+
+            # Recordings are replayed in real time, as if they came from a camera.
+            if not self.video.live:
+                if playback_start is None:
+                    playback_start = start - timestamp
+                sleep(max(0, playback_start + timestamp - time()))
+                start = time()
+
+            self.timers['capture'].record(time() - start)
+            self.frames.post((start, img))
+
+        self.video.close()
+
+    def _infer(self):
+        while self.running:
+            frame = self.frames.take(0.5)
+            if frame is None:
+                continue
+
+            captured, img = frame
+            start = time()
+
+            points = self.tracker.detect(img)
+            setpoint = self.tracker.track(points, captured, self.timers['latency'].average)
+
+            self.timers['inference'].record(time() - start)
+
+            if setpoint is not None:
+                self.setpoints.post((captured, setpoint))
+            self.annotations.post((img, points))
+
+    def _command(self):
+        while self.running:
+            setpoint = self.setpoints.take(0.5)
+            if setpoint is None:
+                continue
+
+            captured, target = setpoint
+            start = time()
+
+            try:
+                self.control.move(**target)
+            except Exception as e:
+                print(f'[WARNING] [{__name__}] Move failed: {e}')
+
+            end = time()
+            self.timers['control'].record(end - start)
+            self.timers['latency'].record(end - captured)
+
+    def _display(self):
+        while self.running:
+            annotation = self.annotations.take(0.5)
+            if annotation is None:
+                continue
+
+            img, points = annotation
+            start = time()
+
+            if points is not None:
+                height, width, _ = img.shape
+                pixels = (points[:, :2] * (width, height)).astype(np.int32)
+                cv2.polylines(img, [pixels[chain] for chain in SKELETON], False, (255, 255, 255), 2)
+
             img = cv2.flip(img, 1)
+            cv2.putText(
+                img, self.report(), (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1
+            )
             cv2.imshow("Image", img)
             if cv2.waitKey(1) & 0xFF == ord('q'):
-                break
\ No newline at end of file
+                self.running = False
+
+            self.timers['display'].record(time() - start)
+
+        cv2.destroyWindow("Image")
+
+    def report(self) -> str:
+        """
+        Per-stage latency, residual latency after prediction and dropped frame summary.
+        """
+        return ' '.join(
+            f'{stage} {timer.average * 1000:.0f}ms' for stage, timer in self.timers.items()
+        ) + f' residual {self.tracker.filter.residual_latency * 1000:.0f}ms dropped {self.frames.dropped}'
+
+    def close(self):
+        self.running = False
+        super().close()
+
+
+def benchmark(video: VideoSource, tracker: HandTracker, latency: float = 0.1,
+              limit: Optional[int] = None) -> tuple[dict[str, np.ndarray], list[tuple[float, dict[str, float]]]]:
+    """
+    Run every frame of a recording through the tracking pipeline as fast as possible.
+
+    Frames are processed one at a time and none are dropped, and the setpoints
+    depend only on the frame timestamps, so runs on the same recording are comparable.
+
+    Parameters
+    ----------
+    video: VideoSource
+        The recording to track.
+    tracker: HandTracker
+        The tracker to measure.
+    latency: float
+        The capture to motor latency assumed for prediction.
+    limit: Optional[int]
+        The maximum number of frames to process.
+
+    Returns
+    -------
+    tuple[dict[str, np.ndarray], list[tuple[float, dict[str, float]]]]
+        The duration of every stage for every frame,
+        and the timestamped setpoints produced.
+    """
+    durations = {'capture': [], 'detection': [], 'tracking': []}
+    setpoints = []
+
+    while limit is None or len(durations['capture']) < limit:
+        start = time()
+        frame = video.read()
+        if frame is None:
+            break
+
+        timestamp, img = frame
+        detected = time()
+        points = tracker.detect(img)
+        tracked = time()
+        setpoint = tracker.track(points, timestamp, latency)
+        end = time()
+
+        durations['capture'].append(detected - start)
+        durations['detection'].append(tracked - detected)
+        durations['tracking'].append(end - tracked)
+
+        if setpoint is not None:
+            setpoints.append((timestamp, setpoint))
+
+    return {stage: np.array(values) for stage, values in durations.items()}, setpoints
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark hand tracking on a recording.')
+    parser.add_argument('source', help='a video file, a directory of frames or a camera index')
+    parser.add_argument('--fps', type=float, default=30, help='frame rate of a frame directory')
+    parser.add_argument('--frames', type=int, help='maximum number of frames to process')
+    parser.add_argument('--latency', type=float, default=0.1, help='latency compensated by prediction, in seconds')
+    parser.add_argument('--inference-scale', type=float, default=1)
+    parser.add_argument('--roi', action='store_true')
+    parser.add_argument('--setpoints', help='write the setpoint stream to this CSV file')
+    args = parser.parse_args()
+
+    video = open_source(args.source, args.fps)
+    tracker = HandTracker(args.inference_scale, args.roi)
+
+    start = time()
+    durations, setpoints = benchmark(video, tracker, args.latency, args.frames)
+    elapsed = time() - start
+    video.close()
+
+    frames = len(durations['capture'])
+    print(f'{frames} frames in {elapsed:.2f} s ({frames / elapsed:.1f} fps), {len(setpoints)} setpoints')
+    for stage, values in durations.items():
+        if len(values):
+            print(
+                f'{stage:>10}: mean {values.mean() * 1000:.2f} ms, '
+                + f'p95 {np.percentile(values, 95) * 1000:.2f} ms, max {values.max() * 1000:.2f} ms'
+            )
+
+    if args.setpoints:
+        with open(args.setpoints, 'w') as f:
+            f.write('timestamp,x,y,z,e,r\n')
+            for timestamp, setpoint in setpoints:
+                f.write(f'{timestamp:.3f},' + ','.join(f'{setpoint[k]:.3f}' for k in 'xyzer') + '\n')
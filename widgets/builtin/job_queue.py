@@ -0,0 +1,107 @@
+import os.path
+from threading import Thread
+
+import tkinter as tk
+import tkinter.ttk as ttk
+from tkinter import filedialog as fd
+from tkinter import messagebox
+
+from lib.job import Job, JobQueue
+from lib.widget import Widget
+
+
+class JobQueueManager(Widget):
+    queue: JobQueue
+    job_list: tk.Listbox
+
+    def setup(self):
+        self.queue = self.control._parent.job_queue
+
+        self.title('Job Queue')
+
+        self.job_list = tk.Listbox(self, width=60, height=10, selectmode='single')
+        self.job_list.pack(side='top', fill='both', expand=True, padx=10, pady=10)
+
+        buttons = ttk.Frame(self)
+        buttons.pack(side='top', fill='x')
+
+        ttk.Button(buttons, text='Add...', command=self._add).pack(side='left')
+        ttk.Button(buttons, text='Remove', command=self._remove).pack(side='left')
+        ttk.Button(buttons, text='Clear Finished',
+                   command=self.queue.clear_finished).pack(side='left')
+
+        self.abort_button = ttk.Button(buttons, text='Abort', command=self._abort)
+        self.abort_button.pack(side='right')
+        self.start_button = ttk.Button(buttons, text='Start', command=self._start)
+        self.start_button.pack(side='right')
+
+        self.stats_var = tk.StringVar()
+        ttk.Label(self, textvariable=self.stats_var).pack(side='bottom', anchor='w', padx=10, pady=10)
+
+        self._rows = []
+        self._refresh()
+
+    def _add(self):
+        for file_name in fd.askopenfilenames(
+            title='Select Job Files',
+            filetypes=[('GCode', '*.gcode')],
+        ):
+            self.queue.add(file_name)
+
+    def _remove(self):
+        for index in self.job_list.curselection():
+            self.queue.remove(index)
+
+    def _start(self):
+        if not self.queue.running:
+            Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        self.queue.run(self.control._parent.run_job)
+
+        if self.queue.error is not None:
+            messagebox.showerror('Job Queue', f'The queue stopped at a job which could not be prepared.\n{self.queue.error}')
+
+    def _abort(self):
+        self.queue.stop()
+        self.control._parent.job_abort = True
+
+    @staticmethod
+    def _describe(job: Job) -> str:
+        text = f'{os.path.basename(job.file_name)}  [{job.status}]'
+
+        if job.status == 'failed':
+            text += f'  {job.error}'
+        elif job.poses:
+            text += f'  {len(job.poses)} waypoints, prepared in {job.prepare_time * 1000:.0f} ms'
+            if job.slow:
+                text += f', {len(job.slow)} slow'
+            if job.run_time is not None:
+                text += f', ran {job.run_time:.1f} s'
+
+        return text
+
+    def _refresh(self):
+        if not self.alive:
+            return
+
+        rows = [self._describe(job) for job in self.queue.jobs]
+        if rows != self._rows:
+            selection = self.job_list.curselection()
+            self.job_list.delete(0, tk.END)
+            self.job_list.insert(tk.END, *rows)
+            for index in selection:
+                if index < len(rows):
+                    self.job_list.selection_set(index)
+            self._rows = rows
+
+        stats = self.queue.statistics()
+        self.stats_var.set(
+            f'{stats["jobs"]} jobs, {stats["waypoints"]} waypoints done in {stats["run_time"]:.1f} s '
+            + f'(+{stats["idle_time"]:.1f} s between jobs) | '
+            + f'{stats["jobs_per_hour"]:.0f} jobs/h, {stats["waypoints_per_second"]:.2f} waypoints/s'
+        )
+
+        self.start_button['state'] = 'disabled' if self.queue.running else 'normal'
+
+        self.after(250, self._refresh)
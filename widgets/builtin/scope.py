@@ -0,0 +1,202 @@
+from threading import Lock
+
+import numpy as np
+import tkinter as tk
+import tkinter.ttk as ttk
+
+from lib.telemetry import POSITION, TARGET, TORQUE, VELOCITY, RingBuffer, Sample, Telemetry
+from lib.widget import Widget
+
+WIDTH = 600
+PLOT_HEIGHT = 150
+MARGIN = 10
+COLORS = ('red', 'blue', 'green', 'orange')
+
+# Each plot shows its channels on a shared vertical scale, targets overlay positions.
+PLOTS = {
+    'Position': (POSITION, TARGET),
+    'Velocity': (VELOCITY,),
+    'Torque': (TORQUE,),
+}
+
+
+def decimate(t: np.ndarray, v: np.ndarray, t0: float, window: float, width: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Reduce a trace to its minimum and maximum per pixel column.
+
+    Parameters
+    ----------
+    t: np.ndarray
+        Sample times, increasing.
+    v: np.ndarray
+        Sample values.
+    t0: float
+        The time at the left edge of the plot.
+    window: float
+        The time span of the plot.
+    width: int
+        The width of the plot in pixels.
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        The x pixel column and value of at most two points per column.
+    """
+    columns = ((t - t0) / window * width).astype(int)
+    keep = (columns >= 0) & ~np.isnan(v)
+    columns, v = columns[keep], v[keep]
+
+    if not len(columns):
+        return columns, v
+
+    starts = np.flatnonzero(np.r_[True, columns[1:] != columns[:-1]])
+    low = np.minimum.reduceat(v, starts)
+    high = np.maximum.reduceat(v, starts)
+
+    return np.repeat(columns[starts], 2), np.column_stack((low, high)).ravel()
+
+
+class Scope(Widget):
+    capacity: int = 10000
+    frame_rate: float = 20
+    telemetry: Telemetry
+
+    def setup(self):
+        self.title('Scope')
+        self.telemetry = self.control._parent.telemetry
+        joints = tuple(self.control._system.joints)
+
+        self.lock = Lock()
+        self.buffers = {
+            channel: RingBuffer(self.capacity, 1 + len(joints))
+            for channels in PLOTS.values() for channel in channels
+        }
+
+        controls = ttk.Frame(self)
+        controls.pack(side='top', fill='x', padx=10, pady=5)
+
+        self.channel_vars = {}
+        for name, channel in (('Position', POSITION), ('Target', TARGET), ('Velocity', VELOCITY), ('Torque', TORQUE)):
+            var = tk.BooleanVar(value=channel in (POSITION, TARGET))
+            ttk.Checkbutton(controls, text=name, variable=var,
+                            command=self._update_channels).pack(side='left')
+            self.channel_vars[channel] = var
+
+        ttk.Separator(controls, orient='vertical').pack(side='left', fill='y', padx=5)
+
+        self.joint_vars = []
+        for joint, color in zip(joints, COLORS):
+            var = tk.BooleanVar(value=True)
+            tk.Checkbutton(controls, text=joint, variable=var, fg=color).pack(side='left')
+            self.joint_vars.append(var)
+
+        self.rate_var = tk.DoubleVar(value=50)
+        ttk.Entry(controls, textvariable=self.rate_var, width=4).pack(side='right')
+        ttk.Label(controls, text='Hz').pack(side='right')
+
+        self.window_var = tk.DoubleVar(value=10)
+        ttk.Entry(controls, textvariable=self.window_var, width=4).pack(side='right')
+        ttk.Label(controls, text='Window (s):').pack(side='right')
+
+        self.canvas = tk.Canvas(
+            self, width=WIDTH + 2 * MARGIN, height=len(PLOTS) * PLOT_HEIGHT, bg='white'
+        )
+        self.canvas.pack(side='bottom', padx=10, pady=10)
+
+        self.labels = {}
+        self.traces = {}
+        for row, (name, channels) in enumerate(PLOTS.items()):
+            top = row * PLOT_HEIGHT
+            self.canvas.create_rectangle(
+                MARGIN, top + MARGIN, MARGIN + WIDTH, top + PLOT_HEIGHT - MARGIN, outline='light gray'
+            )
+            self.labels[name] = self.canvas.create_text(
+                MARGIN + 5, top + MARGIN + 2, anchor='nw', text=name, fill='gray'
+            )
+            for channel in channels:
+                for joint, color in enumerate(COLORS[:len(joints)]):
+                    self.traces[channel, joint] = self.canvas.create_line(
+                        0, 0, 0, 0, fill=color, state='hidden',
+                        dash=(2, 2) if channel == TARGET else ()
+                    )
+
+        self.acquired = ()
+        self.acquired_rate = None
+        self._update_channels()
+        self.telemetry.add_listener(self._on_sample)
+        self.after(0, self._render)
+
+    def _update_channels(self):
+        channels = tuple(channel for channel, var in self.channel_vars.items() if var.get())
+
+        try:
+            rate = max(1, self.rate_var.get())
+        except tk.TclError:
+            rate = self.acquired_rate
+
+        self.telemetry.acquire(*channels, rate=rate)
+        self.telemetry.release(*self.acquired, rate=self.acquired_rate)
+        self.acquired, self.acquired_rate = channels, rate
+
+    def _on_sample(self, sample: Sample):
+        with self.lock:
+            for channel, values in sample.values.items():
+                if channel in self.buffers:
+                    self.buffers[channel].append((sample.timestamp, *values))
+
+    def _render(self):
+        if not self.alive:
+            return
+
+        try:
+            window = max(0.1, self.window_var.get())
+            if max(1, self.rate_var.get()) != self.acquired_rate:
+                self._update_channels()
+        except tk.TclError:
+            window = 10
+
+        try:
+            with self.lock:
+                histories = {channel: buffer.view().copy() for channel, buffer in self.buffers.items()}
+
+            now = self.telemetry.sample.timestamp if self.telemetry.sample is not None else 0
+            t0 = now - window
+            joints = [var.get() for var in self.joint_vars]
+
+            for row, (name, channels) in enumerate(PLOTS.items()):
+                top = row * PLOT_HEIGHT + MARGIN
+                height = PLOT_HEIGHT - 2 * MARGIN
+
+                shown = [
+                    (channel, joint, decimate(histories[channel][:, 0], histories[channel][:, 1 + joint], t0, window, WIDTH))
+                    for channel in channels if self.channel_vars[channel].get()
+                    for joint, show in enumerate(joints) if show
+                ]
+
+                values = [v for _, _, (_, v) in shown if len(v)]
+                low, high = (min(v.min() for v in values), max(v.max() for v in values)) if values else (0, 1)
+                span = high - low or 1
+
+                self.canvas.itemconfig(self.labels[name], text=f'{name}  [{low:.3g}, {high:.3g}]')
+
+                for trace in (self.traces[channel, joint] for channel in channels for joint in range(len(joints))):
+                    self.canvas.itemconfig(trace, state='hidden')
+
+                for channel, joint, (x, v) in shown:
+                    if len(x) < 2:
+                        continue
+
+                    y = top + height * (1 - (v - low) / span)
+                    trace = self.traces[channel, joint]
+                    self.canvas.coords(trace, *np.column_stack((MARGIN + x, y)).ravel().tolist())
+                    self.canvas.itemconfig(trace, state='normal')
+
+            self.after(int(1000 / self.frame_rate), self._render)
+        except tk.TclError:
+            return
+
+    def close(self):
+        if self.alive:
+            self.telemetry.remove_listener(self._on_sample)
+            self.telemetry.release(*self.acquired, rate=self.acquired_rate)
+        super().close()
@@ -1,19 +1,36 @@
-from threading import Thread
-from math import cos, pi, sin
+from math import ceil, cos, pi, sin
 
+import numpy as np
 import tkinter as tk
 
+from lib.job import Job
+from lib.telemetry import POSITION, TORQUE, RingBuffer, Telemetry
 from lib.widget import Widget
 
+CENTER = 200
+SCALE = 5
+
 
 class Visual(Widget):
-    running: bool
+    frame_rate: float = 30
+    trail_capacity: int = 2000
+    trail_points: int = 200
+    preview_points: int = 2000
+    preview_steps: int = 8
+    telemetry: Telemetry
 
     def setup(self):
-        self.running = True
+        self.telemetry = self.control._parent.telemetry
+
         self.canvas = tk.Canvas(self, width=400, height=400, bg='white')
         self.canvas.pack()
 
+        self.preview = self.canvas.create_line(0, 0, 0, 0, fill='light blue', state='hidden')
+        self.trail = self.canvas.create_line(0, 0, 0, 0, fill='gray', state='hidden')
+        self.trail_history = RingBuffer(self.trail_capacity, 2)
+        self._preview_job = None
+        self._trail_time = None
+
         self.curr_l1 = self.canvas.create_line(0, 0, 0, 0, fill='black')
         self.curr_l2 = self.canvas.create_line(0, 0, 0, 0, fill='black')
         self.curr_r = self.canvas.create_line(0, 0, 0, 0, fill='black')
@@ -24,47 +41,104 @@ class Visual(Widget):
             0, 0, 0, 0, fill='blue', dash=(2, 2))
         self.tar_r = self.canvas.create_line(0, 0, 0, 0, fill='blue', dash=(2, 2))
 
-        Thread(target=self.loop, daemon=True).start()
+        self._last_frame = None
+        self.telemetry.acquire(POSITION, TORQUE)
+        self.after(0, self._render)
+
+    def _render(self):
+        """
+        Draw one frame from the latest telemetry sample and reschedule.
+
+        Runs on the Tk thread and never touches the serial bus.
+        """
+        if not self.alive:
+            return
 
-    def loop(self):
         try:
-            while self.running:
+            target = (
+                self.control.target_x,
+                self.control.target_y,
+                self.control.target_r,
+                self.control.target_e,
+            )
+            sample = self.telemetry.sample
+            # Samples only hold the channels acquired by someone, hold the last frame until ours are in.
+            if sample is not None and not (POSITION in sample.values and TORQUE in sample.values):
+                sample = None
+            frame = (target, sample.timestamp if sample is not None else None)
+
+            job = self.control._parent.current_job
+            if job is not self._preview_job:
+                self._preview_job = job
+                self._drawPath(self.preview, self._plan(job), self.preview_points)
+
+            if frame != self._last_frame:
+                self._last_frame = frame
+                x, y, r, _ = target
+
                 t1, t2 = self.control._system.cartesian_to_dual_polar(
-                    self.control.target_x, self.control.target_y
+                    x, y, self.control._system.joint_target
                 )
-                r = self.control.target_r
 
                 self._drawArms(self.tar_l1, self.tar_l2, self.tar_r, t1, t2, r)
 
-                c_t1, c_t2, c_r = (
-                    self.control._system.m_inner_rot.position,
-                    self.control._system.m_outer_rot.position,
-                    self.control._system.m_end_rot.position
-                )
-
-                self._drawArms(
-                    self.curr_l1,
-                    self.curr_l2,
-                    self.curr_r,
-                    c_t1,
-                    c_t2,
-                    c_r + c_t1,
-                    (
-                        self.control._system.m_inner_rot._send_command(
-                            'MMG1', float),
-                        self.control._system.m_outer_rot._send_command(
-                            'MMG1', float),
-                        self.control._system.m_end_rot._send_command(
-                            'MMG1', float
-                        )
+                if sample is not None:
+                    c_t1, c_t2, _, c_r = sample.values[POSITION]
+                    torques = sample.values[TORQUE]
+
+                    if sample.timestamp != self._trail_time:
+                        self._trail_time = sample.timestamp
+                        self.trail_history.append(self.control._system.polar_to_cartesian(c_t1, c_t2))
+                        self._drawPath(self.trail, self.trail_history.view(), self.trail_points)
+
+                    self._drawArms(
+                        self.curr_l1,
+                        self.curr_l2,
+                        self.curr_r,
+                        c_t1,
+                        c_t2,
+                        c_r + c_t1,
+                        (torques[0], torques[1], torques[3])
                     )
-                )
+
+            self.after(int(1000 / self.frame_rate), self._render)
         except tk.TclError:
             self.close()
 
+    def _plan(self, job: Job) -> np.ndarray:
+        """
+        Compute the tool path of a job.
+
+        Moves are interpolated in joint space, so each one is sampled
+        and mapped through forward kinematics in a single batch.
+        """
+        if job is None or len(job.joints) < 2:
+            return np.empty((0, 2))
+
+        joints = np.array(job.joints)
+        steps = np.linspace(0, 1, self.preview_steps, endpoint=False)
+        path = joints[:-1, None, :] + np.diff(joints, axis=0)[:, None, :] * steps[None, :, None]
+        path = np.concatenate((path.reshape(-1, 2), joints[-1:]))
+
+        return self.control._system.polar_to_cartesian_array(path[:, 0], path[:, 1])
+
+    def _drawPath(self, line, points: np.ndarray, max_points: int):
+        """
+        Draw a decimated polyline, at most max_points long, as one canvas item.
+        """
+        if len(points) < 2:
+            self.canvas.itemconfig(line, state='hidden')
+            return
+
+        stride = ceil(len(points) / max_points)
+        decimated = np.concatenate((points[::stride], points[-1:]))
+
+        self.canvas.coords(line, *(CENTER + SCALE * decimated).ravel().tolist())
+        self.canvas.itemconfig(line, state='normal')
+
     def _drawArms(self, line1, line2, line3, t1, t2, r, torques=None):
-        center = 200
-        scale = 5
+        center = CENTER
+        scale = SCALE
         x0 = center
         y0 = center
         x1 = x0 + scale * self.control._system.l1 * cos(t1)
@@ -101,5 +175,6 @@ class Visual(Widget):
             )
 
     def close(self):
-        self.running = False
+        if self.alive:
+            self.telemetry.release(POSITION, TORQUE)
         super().close()
@@ -1,17 +1,522 @@
+"""
+A TCP interface for controlling the arm from other programs.
+
+Every frame, in either direction, is a little-endian uint32 payload length
+followed by the payload. A client frame holds any number of messages, each
+a type byte followed by its fields:
+
+    MOVE  0x01  float32 x, y, z
+    GRIP  0x02  uint32 e
+    STATE 0x03  (no fields)
+
+The server answers every frame containing a STATE message with one frame:
+
+    STATE_REPLY 0x83  float64 timestamp, float32 t1, t2, z, r, x, y
+
+State comes from the shared telemetry sample, so any number of clients can
+poll it without adding serial traffic. Moves are posted to the motion
+thread, the latest one wins.
+
+For streaming teleoperation the server also listens for UDP datagrams on
+the same port number, each a single packet without length prefix:
+
+    SETPOINT 0x11  uint32 sequence, float64 timestamp, float32 x, y, z, r, uint32 e
+
+The timestamp is the sender's clock in seconds. Stale and out of order
+packets are dropped, the rest pass through a jitter buffer which is
+sampled at the control rate. Every address which sent a setpoint in the
+last few seconds receives state datagrams at the state rate:
+
+    STATE_DATAGRAM 0x93  uint32 sequence, float64 timestamp, float32 t1, t2, z, r, x, y
+
+Both the TCP server and the UDP endpoint listen on the same address.
+InterfaceServer defaults to localhost, the widget uses the bind address
+set in it, every interface unless changed, so that other machines on the
+network can connect and stream setpoints.
+"""
+
+import asyncio
+from argparse import ArgumentParser
+from collections import deque
+import math
+import struct
+from time import perf_counter, time
+from typing import Callable, Optional
+
 import tkinter as tk
 import tkinter.ttk as ttk
-import sys
-import struct
-import socket
 
-from requests import delete
+import numpy as np
 
+from lib.telemetry import POSITION
 from lib.widget import Widget
-from lib.utils import threaded_callback
+from lib.utils import StageTimer, threaded_callback
+
+HEADER = struct.Struct('<I')
+MOVE = 0x01
+GRIP = 0x02
+STATE = 0x03
+STATE_REPLY = 0x83
+MESSAGES = {
+    MOVE: struct.Struct('<3f'),
+    GRIP: struct.Struct('<I'),
+    STATE: struct.Struct(''),
+}
+STATE_FORMAT = struct.Struct('<Bd6f')
+SETPOINT = 0x11
+SETPOINT_FORMAT = struct.Struct('<BIdffffI')
+STATE_DATAGRAM = 0x93
+STATE_DATAGRAM_FORMAT = struct.Struct('<BId6f')
+# Larger frames are treated as a protocol error.
+MAX_FRAME = 1 << 16
+
+
+def frame(payload: bytes) -> bytes:
+    """
+    Prefix a payload with its length.
+    """
+    return HEADER.pack(len(payload)) + payload
+
+
+class JitterBuffer:
+    """
+    Plays a stream of timestamped setpoints back after a fixed delay,
+    interpolating between them.
+
+    The sender's clock is mapped to the local one through the smallest
+    transit time recently observed, so the clocks need not be synchronized.
+    Packets arriving within the delay of the fastest one are played back
+    evenly spaced, as they were sent.
+
+    Attributes
+    ----------
+    delay: float
+        The playback delay in seconds, on top of the fastest transit.
+    """
+    delay: float
+
+    def __init__(self, delay: float = 0.05, window: int = 64):
+        """
+        Parameters
+        ----------
+        delay: float
+            The playback delay in seconds.
+        window: int
+            The number of recent packets kept.
+        """
+        self.delay = delay
+        self._packets: deque[tuple[float, np.ndarray]] = deque(maxlen=window)
+        self._transits: deque[float] = deque(maxlen=window)
+
+    def __len__(self) -> int:
+        return len(self._packets)
+
+    @property
+    def offset(self) -> float:
+        """
+        The smallest recent transit time, local clock minus sender clock.
+        """
+        return min(self._transits)
+
+    def clear(self) -> None:
+        self._packets.clear()
+        self._transits.clear()
+
+    def push(self, sent: float, arrival: float, values: tuple[float, ...]) -> None:
+        """
+        Add a packet, which must be newer than every packet already added.
+
+        Parameters
+        ----------
+        sent: float
+            The sender's timestamp.
+        arrival: float
+            The local time the packet arrived.
+        values: tuple[float, ...]
+            The setpoint.
+        """
+        self._packets.append((sent, np.asarray(values, dtype=float)))
+        self._transits.append(arrival - sent)
+
+    def sample(self, now: float) -> Optional[np.ndarray]:
+        """
+        The setpoint to play back at a local time.
+
+        Before the first packet is due the first one is returned,
+        after the last one the last one is held.
+
+        Returns
+        -------
+        Optional[np.ndarray]
+            The interpolated setpoint, None if the buffer is empty.
+        """
+        if not self._packets:
+            return None
+
+        t = now - self.offset - self.delay
+
+        later = None
+        for sent, values in reversed(self._packets):
+            if sent <= t:
+                if later is None:
+                    return values
+
+                later_sent, later_values = later
+                return values + (later_values - values) * (t - sent) / (later_sent - sent)
+
+            later = (sent, values)
+
+        return later[1]
+
+
+class SetpointStream(asyncio.DatagramProtocol):
+    """
+    Receives setpoint datagrams into a jitter buffer.
+
+    The most recent sender controls the arm, a new sender restarts the stream.
+
+    Attributes
+    ----------
+    buffer: JitterBuffer
+        The received setpoints.
+    received: int
+        The number of setpoints accepted.
+    lost: int
+        The number of setpoints skipped in the sequence numbers,
+        including those which later arrive stale.
+    stale: int
+        The number of setpoints dropped for arriving after a newer one.
+    malformed: int
+        The number of datagrams which were not setpoints.
+    transit: StageTimer
+        The time from sending to arrival, only meaningful with synchronized clocks.
+    jitter: StageTimer
+        The transit time in excess of the fastest recent one.
+    subscribers: dict[tuple, float]
+        The addresses receiving state datagrams, with when they last sent a setpoint.
+    """
+    received: int = 0
+    lost: int = 0
+    stale: int = 0
+    malformed: int = 0
+    source: Optional[tuple] = None
+    last_sequence: Optional[int] = None
+    transport: Optional[asyncio.DatagramTransport] = None
+
+    def __init__(self, delay: float = 0.05):
+        self.buffer = JitterBuffer(delay)
+        self.transit = StageTimer()
+        self.jitter = StageTimer()
+        self.subscribers: dict[tuple, float] = {}
+
+    def connection_made(self, transport: asyncio.DatagramTransport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr: tuple) -> None:
+        arrival = time()
+
+        if len(data) != SETPOINT_FORMAT.size or data[0] != SETPOINT:
+            self.malformed += 1
+            return
+
+        _, sequence, sent, x, y, z, r, e = SETPOINT_FORMAT.unpack(data)
+        self.subscribers[addr] = arrival
+
+        if addr != self.source:
+            self.source = addr
+            self.last_sequence = None
+            self.buffer.clear()
+
+        if self.last_sequence is not None:
+            if sequence <= self.last_sequence:
+                self.stale += 1
+                return
+            self.lost += sequence - self.last_sequence - 1
+
+        self.last_sequence = sequence
+        self.received += 1
+
+        self.buffer.push(sent, arrival, (x, y, z, r, e))
+        self.transit.record(arrival - sent)
+        self.jitter.record(arrival - sent - self.buffer.offset)
+
+
+class InterfaceServer:
+    """
+    An asyncio server handling any number of clients.
+
+    Attributes
+    ----------
+    host: str
+        The address to listen on.
+    port: int
+        The port to listen on, 0 picks a free one once serving.
+    clients: int
+        The number of connected clients.
+    frames: int
+        The number of frames handled.
+    control_rate: float
+        How many times per second streamed setpoints are played back.
+    state_rate: float
+        How many state datagrams per second are sent to each subscriber.
+    stream: Optional[SetpointStream]
+        The UDP setpoint stream, once serving.
+    """
+    host: str
+    port: int
+    clients: int = 0
+    frames: int = 0
+    control_rate: float = 50
+    state_rate: float = 20
+    # Seconds without a setpoint after which an address stops receiving state.
+    subscriber_timeout: float = 2
+    stream: Optional[SetpointStream] = None
+    # Set by stop(), which may be called before serve() is listening.
+    stopping: bool = False
+
+    def __init__(self,
+                 snapshot: Callable[[], tuple[float, tuple[float, float, float, float]]],
+                 move: Callable[[float, float, float], None],
+                 grip: Callable[[int], None],
+                 forward: Callable[[float, float], tuple[float, float]],
+                 setpoint: Optional[Callable[[float, float, float, float, int], None]] = None,
+                 host: str = 'localhost', port: int = 1023):
+        """
+        Parameters
+        ----------
+        snapshot: Callable[[], tuple[float, tuple[float, float, float, float]]]
+            Returns the timestamp and t1, t2, z, r positions of the latest state.
+            Must not block, it runs on the event loop.
+        move: Callable[[float, float, float], None]
+            Requests a move to x, y, z. Must not block.
+        grip: Callable[[int], None]
+            Requests an end effector position. Must not block.
+        forward: Callable[[float, float], tuple[float, float]]
+            Forward kinematics, from t1, t2 to x, y.
+        setpoint: Optional[Callable[[float, float, float, float, int], None]]
+            Requests a move to x, y, z, r, e from the UDP stream. Must not block.
+            Without it, UDP is disabled.
+        host: str
+            The address to listen on.
+        port: int
+            The port to listen on.
+        """
+        self.snapshot = snapshot
+        self.move = move
+        self.grip = grip
+        self.forward = forward
+        self.setpoint = setpoint
+        self.host = host
+        self.port = port
+        self._state: tuple[Optional[float], bytes] = (None, b'')
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.started = asyncio.Event()
+
+    async def serve(self) -> None:
+        """
+        Accept clients until stop() is called.
+
+        Returns without serving if stop() was called while binding.
+
+        Raises
+        ------
+        OSError
+            If the address could not be bound.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+        if self.setpoint is not None:
+            try:
+                transport, self.stream = await self._loop.create_datagram_endpoint(
+                    SetpointStream, local_addr=(self.host, self.port)
+                )
+            except OSError:
+                self._server.close()
+                await self._server.wait_closed()
+                raise
+
+        # Nothing is awaited from here to serve_forever(), so a stop() missed here closes the server.
+        if self.stopping:
+            if self.stream is not None:
+                transport.close()
+            self._server.close()
+            await self._server.wait_closed()
+            return
+
+        tasks = []
+        if self.stream is not None:
+            tasks = [asyncio.create_task(self._play()), asyncio.create_task(self._publish())]
+
+        self.started.set()
+
+        async with self._server:
+            try:
+                await self._server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+            finally:
+                for task in tasks:
+                    task.cancel()
+                if self.stream is not None:
+                    transport.close()
+
+    async def start(self) -> 'asyncio.Task[None]':
+        """
+        Run serve() in a task and wait until it is listening.
+
+        Returns
+        -------
+        asyncio.Task[None]
+            The task serving clients, which finishes after stop(),
+            already finished if stop() was called while binding.
+
+        Raises
+        ------
+        OSError
+            If the address could not be bound.
+        """
+        task = asyncio.create_task(self.serve())
+        started = asyncio.create_task(self.started.wait())
+
+        await asyncio.wait((task, started), return_when=asyncio.FIRST_COMPLETED)
+
+        if not self.started.is_set():
+            started.cancel()
+            # Raises the bind error, unless serve() returned because of stop().
+            task.result()
+
+        return task
+
+    async def _play(self) -> None:
+        last = None
+
+        while True:
+            values = self.stream.buffer.sample(time())
+
+            if values is not None and (last is None or not np.array_equal(values, last)):
+                x, y, z, r, e = values
+                self.setpoint(float(x), float(y), float(z), float(r), round(e))
+                last = values
+
+            await asyncio.sleep(1 / self.control_rate)
+
+    async def _publish(self) -> None:
+        sequence = 0
+
+        while True:
+            now = time()
+            subscribers = self.stream.subscribers
+
+            for addr in [addr for addr, seen in subscribers.items() if now - seen > self.subscriber_timeout]:
+                del subscribers[addr]
+
+            if subscribers:
+                timestamp, (t1, t2, z, r) = self.snapshot()
+                x, y = self.forward(t1, t2)
+                datagram = STATE_DATAGRAM_FORMAT.pack(STATE_DATAGRAM, sequence, timestamp, t1, t2, z, r, x, y)
+
+                for addr in subscribers:
+                    self.stream.transport.sendto(datagram, addr)
+                sequence += 1
+
+            await asyncio.sleep(1 / self.state_rate)
+
+    def stop(self) -> None:
+        """
+        Stop accepting clients, from any thread, also while still binding.
+        """
+        self.stopping = True
+        if self._loop is not None and self._server is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+
+    def state(self) -> bytes:
+        """
+        The latest state as a reply frame, packed once per telemetry sample.
+        """
+        timestamp, (t1, t2, z, r) = self.snapshot()
+
+        if self._state[0] != timestamp:
+            x, y = self.forward(t1, t2)
+            self._state = (timestamp, frame(STATE_FORMAT.pack(STATE_REPLY, timestamp, t1, t2, z, r, x, y)))
+
+        return self._state[1]
+
+    def process(self, payload: bytes) -> Optional[bytes]:
+        """
+        Handle every message of a frame.
+
+        Only the last MOVE and GRIP of a frame are acted on.
+
+        Returns
+        -------
+        Optional[bytes]
+            The reply frame, if the frame asked for the state.
+
+        Raises
+        ------
+        ValueError
+            If the frame is malformed.
+        """
+        offset = 0
+        move = grip = None
+        wants_state = False
+
+        while offset < len(payload):
+            kind = payload[offset]
+            if kind not in MESSAGES:
+                raise ValueError(f'Unknown message type {kind:#x}.')
+
+            fields = MESSAGES[kind]
+            if offset + 1 + fields.size > len(payload):
+                raise ValueError('Truncated message.')
+
+            values = fields.unpack_from(payload, offset + 1)
+            offset += 1 + fields.size
+
+            if kind == MOVE:
+                move = values
+            elif kind == GRIP:
+                grip = values[0]
+            else:
+                wants_state = True
+
+        if move is not None:
+            self.move(*move)
+        if grip is not None:
+            self.grip(grip)
+
+        self.frames += 1
+        return self.state() if wants_state else None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.clients += 1
+
+        try:
+            while True:
+                (length,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+                if length > MAX_FRAME:
+                    raise ValueError(f'Frame of {length} bytes is too large.')
+
+                reply = self.process(await reader.readexactly(length))
+
+                if reply is not None:
+                    writer.write(reply)
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except ValueError as e:
+            print(f'[WARNING] [{__name__}] Dropping client: {e}')
+        finally:
+            self.clients -= 1
+            writer.close()
 
 
 class Server(Widget):
     running: bool
+    server: Optional[InterfaceServer] = None
 
     # our setup function creates and integrates some UI elements
     def setup(self):
@@ -26,51 +531,162 @@ class Server(Widget):
         )
         self.button.pack(padx=10, pady=10)  # pack button
 
+        address = ttk.Frame(self)
+        address.pack(padx=10)
+        ttk.Label(address, text='Bind address:').pack(side='left')
+        # Every interface, for clients on other machines. localhost restricts it to this one.
+        self.host_var = tk.StringVar(value='0.0.0.0')
+        ttk.Entry(address, textvariable=self.host_var, width=15).pack(side='left')
+
+        self.stats_var = tk.StringVar()
+        ttk.Label(self, textvariable=self.stats_var).pack(padx=10, pady=10)
+
         self.running = True
-        self.soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.telemetry = self.control._parent.telemetry
+        self.motion = self.control._parent.motion
 
     @threaded_callback
     def _callback(self):
         self.button.config(text="Binding...", state="disabled")
+
+        self.target = {
+            'x': self.control.target_x,
+            'y': self.control.target_y,
+            'z': self.control.target_z,
+            'r': self.control.target_r,
+            'e': self.control.target_e,
+        }
+        self.server = InterfaceServer(
+            self._snapshot, self._move, self._grip, self.control._system.polar_to_cartesian, self._setpoint,
+            host=self.host_var.get().strip() or 'localhost'
+        )
+        self.telemetry.acquire(POSITION)
+        self.after(0, self._refresh)
+
         try:
-            self.soc.bind(("localhost", 1023))
-        except socket.error as message:
-            # print(f"Bind failed. Error Code : {str(message[0])} Message {message[1]}")
-            sys.exit()
-
-        self.button.config(text="Waiting for client...", state="disabled")
-        self.soc.listen(10)
-        client, _ = self.soc.accept()
-        self.button.config(text="Connected")
-        while self.running:
-            b = client.recv(1)
-            if struct.unpack("c", b)[0] == b"\x01":
-                x = client.recv(4)
-                y = client.recv(4)
-                z = client.recv(4)
-                x = struct.unpack("f", x)[0]
-                y = struct.unpack("f", y)[0]
-                z = struct.unpack("f", z)[0]
-                print(f"Received: {x}, {y}, {z}")
-                self.control.move(x=x, y=y, z=z)
-
-            e = client.recv(4)
-            e = struct.unpack("<I", e)[0]
-            self.control.move(e=e)
-
-            m1_rot = self.control._system.m_inner_rot.position
-            m2_rot = self.control._system.m_outer_rot.position
-            z_pos = self.control._system.m_vertical.position
-            r_pos = self.control._system.m_end_rot.position
-
-            client.send(struct.pack("f", m1_rot))
-            client.send(struct.pack("f", m2_rot))
-            client.send(struct.pack("f", z_pos))
-            client.send(struct.pack("f", r_pos-m2_rot))
-        else:
-            self.soc.close()
-            client.close()
+            asyncio.run(self._serve())
+        except OSError as e:
+            print(f'[WARNING] [{__name__}] Failed to start server: {e}')
+        finally:
+            self.telemetry.release(POSITION)
+            self.server = None
+
+        if self.running:
+            self.button.config(text="Start Server", state="normal")
+
+    async def _serve(self):
+        task = await self.server.start()
+        if self.running:
+            self.button.config(text=f"Serving on {self.server.host} port {self.server.port}")
+        await task
+
+    def _snapshot(self) -> tuple[float, tuple[float, float, float, float]]:
+        sample = self.telemetry.sample
+        if sample is None or POSITION not in sample.values:
+            return 0, (math.nan,) * 4
+
+        return sample.timestamp, sample.values[POSITION]
+
+    def _move(self, x: float, y: float, z: float):
+        self.target.update(x=x, y=y, z=z)
+        self.motion.post(**self.target)
+
+    def _grip(self, e: int):
+        self.target['e'] = e
+        self.motion.post(**self.target)
+
+    def _setpoint(self, x: float, y: float, z: float, r: float, e: int):
+        self.target.update(x=x, y=y, z=z, r=r, e=e)
+        self.motion.post(**self.target)
+
+    def _refresh(self):
+        if not self.running or self.server is None:
+            return
+
+        text = f'{self.server.clients} clients, {self.server.frames} frames'
+
+        stream = self.server.stream
+        if stream is not None:
+            text += f'\nUDP: {stream.received} received, {stream.lost} lost, {stream.stale} stale, ' \
+                + f'jitter {stream.jitter.average * 1000:.1f} ms, transit {stream.transit.average * 1000:.1f} ms'
+
+        self.stats_var.set(text)
+        self.after(500, self._refresh)
 
     def close(self):
         self.running = False
+        if self.server is not None:
+            self.server.stop()
         super().close()
+
+
+async def _client(port: int, requests: int, latencies: list[float]) -> None:
+    reader, writer = await asyncio.open_connection('localhost', port)
+    request = frame(
+        bytes((MOVE,)) + MESSAGES[MOVE].pack(15, 0, 80)
+        + bytes((GRIP,)) + MESSAGES[GRIP].pack(50)
+        + bytes((STATE,))
+    )
+
+    for _ in range(requests):
+        start = perf_counter()
+        writer.write(request)
+        (length,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+        await reader.readexactly(length)
+        latencies.append(perf_counter() - start)
+
+    writer.close()
+
+
+async def benchmark(clients: int, requests: int) -> tuple[float, np.ndarray]:
+    """
+    Measure the server with simulated clients, each sending a move, a grip
+    and a state request per frame and waiting for the reply.
+
+    The state is a fake telemetry sample which changes every 50 ms.
+
+    Parameters
+    ----------
+    clients: int
+        The number of concurrent clients.
+    requests: int
+        The number of frames sent by each client.
+
+    Returns
+    -------
+    tuple[float, np.ndarray]
+        The total duration and the round trip time of every frame.
+    """
+    server = InterfaceServer(
+        lambda: (time() // 0.05, (0.5, 1.0, 80, 0)),
+        lambda x, y, z: None,
+        lambda e: None,
+        lambda t1, t2: (15.5 * math.cos(t1) + 14.7 * math.cos(t1 + t2), 15.5 * math.sin(t1) + 14.7 * math.sin(t1 + t2)),
+        port=0,
+    )
+    task = await server.start()
+
+    latencies = []
+    start = perf_counter()
+    await asyncio.gather(*(_client(server.port, requests, latencies) for _ in range(clients)))
+    duration = perf_counter() - start
+
+    server.stop()
+    await task
+
+    return duration, np.array(latencies)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark the interface server with simulated clients.')
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=200, help='frames sent by each client')
+    args = parser.parse_args()
+
+    duration, latencies = asyncio.run(benchmark(args.clients, args.requests))
+
+    print(f'{len(latencies)} frames from {args.clients} clients in {duration:.2f} s '
+          + f'({len(latencies) / duration:.0f} frames/s)')
+    print('Round trip: ' + ', '.join(
+        f'p{q} {np.percentile(latencies, q) * 1000:.2f} ms' for q in (50, 95, 99)
+    ))